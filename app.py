@@ -1,27 +1,65 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
+from flask import (Flask, render_template, request, jsonify, redirect, url_for, flash, session, abort,
+                   current_app, has_app_context, Response, stream_with_context)
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+from sqlalchemy import event, select, func, insert, update, delete, tuple_, and_, case, bindparam, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, object_session, joinedload, selectinload
+from collections import namedtuple
 from datetime import datetime, timedelta, timezone
+from functools import wraps
+import base64
+import click
+import hashlib
+import hmac
+import json
 import os
+import random
+import threading
+import time
 from werkzeug.security import generate_password_hash, check_password_hash
 import uuid
 from dotenv import load_dotenv
+from markupsafe import Markup
+from itsdangerous import BadSignature, URLSafeSerializer
+from jinja2 import FileSystemBytecodeCache
+from assets import AssetManifest, build_assets_command
+from catalog_cache import CatalogCache, CatalogVersion, DeliverySlotCache, FragmentCache, redis_catalog_version
+from catalog_loader import load_catalog_command
+from compression import ResponseCompressor
+from images import ImageStore, image_digest
+from metrics import RequestMetrics
+from order_events import create_event_broker
+from order_queue import OrderIntakeWorkers, create_order_queue
+from replicas import BIND_PREFIX, ReplicaRouter, RoutingSession, replica_reads
+from session_store import ServerSideSessionInterface, create_session_interface
+from search import include_in_autogenerate, install_search_ddl, normalize_search_term, search_pastries
 
 # Load environment variables
 load_dotenv()
 
-# Initialize extensions
-db = SQLAlchemy()
-migrate = Migrate()
+# Initialize extensions; read-only views may route their SELECTs to a replica (see replicas.py)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # Application constants
 DELIVERY_FEE = float(os.getenv('DELIVERY_FEE', 5.99))
 COMPANY_EMAIL = os.getenv('COMPANY_EMAIL', 'orders@sweetdelights.com')
 COMPANY_PHONE = os.getenv('COMPANY_PHONE', '(555) 123-4567')
+API_FIELDS = ('id', 'name', 'description', 'price', 'image_url', 'category')
+API_MAX_LIMIT = int(os.getenv('API_MAX_LIMIT', 1000))
+API_STREAM_CHUNK = int(os.getenv('API_STREAM_CHUNK', 500))
+DELIVERY_WINDOW_DAYS = int(os.getenv('DELIVERY_WINDOW_DAYS', 14))
+REPORT_DEFAULT_DAYS = 30
+REPORT_MAX_DAYS = 366
+ORDER_HISTORY_PAGE_SIZE = int(os.getenv('ORDER_HISTORY_PAGE_SIZE', 20))
+ORDER_HISTORY_MAX_LIMIT = 100
+ORDER_STATUSES = ('pending', 'confirmed', 'baking', 'out_for_delivery', 'delivered', 'cancelled')
+PAYMENT_STATUSES = ('pending', 'paid', 'refunded', 'failed')
 
 # Database Models
 class Pastry(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    # Natural key for catalog loads (flask load-catalog); pastries added by hand may have none
+    sku = db.Column(db.String(64))
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
     price = db.Column(db.Float, nullable=False)
@@ -29,6 +67,20 @@ class Pastry(db.Model):
     category = db.Column(db.String(50))
     available = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))  # Fixed deprecation warning
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc),
+                           onupdate=lambda: datetime.now(timezone.utc))
+    
+    # Storefront reads only ever list available pastries, in id order, optionally by category.
+    # The partial-index predicates match how filter(Pastry.available) compiles on each dialect.
+    __table_args__ = (
+        db.Index('ix_pastry_available_id', 'id',
+                 postgresql_where=db.text('available'), sqlite_where=db.text('available = 1')),
+        db.Index('ix_pastry_available_category_id', 'category', 'id',
+                 postgresql_where=db.text('available'), sqlite_where=db.text('available = 1')),
+        db.Index('ix_pastry_category', 'category'),
+        db.Index('ix_pastry_updated_at', 'updated_at'),
+        db.UniqueConstraint('sku', name='uq_pastry_sku'),
+    )
 
 class Customer(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -50,19 +102,850 @@ class Order(db.Model):
     payment_status = db.Column(db.String(20), default='pending')
     special_instructions = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))  # Fixed deprecation warning
+    # Set once the order has been counted into the sales rollup tables
+    sales_rolled_up = db.Column(db.Boolean, nullable=False, default=False)
     
     customer = db.relationship('Customer', backref=db.backref('orders', lazy=True))
+    
+    # Lets the rollup catch-up job find orders it hasn't counted yet without scanning history.
+    # As with Pastry, the predicates match how ~Order.sales_rolled_up compiles on each dialect.
+    __table_args__ = (
+        # Order history pages are range reads on (customer_id, created_at, id); on Postgres the
+        # summary columns are included so a page never touches the table
+        db.Index('ix_order_customer_history', 'customer_id', 'created_at', 'id',
+                 postgresql_include=['order_number', 'status', 'total_amount', 'delivery_date']),
+        db.Index('ix_order_not_rolled_up', 'id',
+                 postgresql_where=db.text('NOT sales_rolled_up'), sqlite_where=db.text('sales_rolled_up = 0')),
+    )
 
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
-    pastry_id = db.Column(db.Integer, db.ForeignKey('pastry.id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
+    pastry_id = db.Column(db.Integer, db.ForeignKey('pastry.id'), nullable=False, index=True)
     quantity = db.Column(db.Integer, nullable=False)
     unit_price = db.Column(db.Float, nullable=False)
     
     order = db.relationship('Order', backref=db.backref('items', lazy=True))
     pastry = db.relationship('Pastry', backref=db.backref('order_items', lazy=True))
 
+class DeliverySlot(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    delivery_date = db.Column(db.Date, nullable=False)
+    # '' is the day's shared counter; cities with their own capacity get a row each
+    city = db.Column(db.String(100), nullable=False, default='')
+    capacity = db.Column(db.Integer, nullable=False)
+    reserved = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (db.UniqueConstraint('city', 'delivery_date', name='uq_delivery_slot_city_date'),)
+
+# Units left to sell. Pastries with no rows aren't stock-tracked; a hot pastry's stock can be split
+# over several stripes so concurrent orders for it update different rows
+class PastryStock(db.Model):
+    pastry_id = db.Column(db.Integer, db.ForeignKey('pastry.id'), primary_key=True)
+    stripe = db.Column(db.Integer, primary_key=True, default=0)
+    quantity = db.Column(db.Integer, nullable=False)
+    
+    __table_args__ = (db.CheckConstraint('quantity >= 0', name='ck_pastry_stock_quantity'),)
+
+# Sales rollups: revenue and units per day, per pastry per day and per category per day.
+# Revenue is item revenue (quantity * unit price), excluding delivery fees.
+class DailySales(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+class PastryDailySales(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    pastry_id = db.Column(db.Integer, db.ForeignKey('pastry.id'), primary_key=True)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+class CategoryDailySales(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    category = db.Column(db.String(50), primary_key=True)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+install_search_ddl(Pastry.__table__)
+
+# Catalog cache: compact immutable pastry rows, invalidated on every Pastry write
+PastryRow = namedtuple('PastryRow', ['id', 'name', 'description', 'price', 'image_url',
+                                     'category', 'available', 'created_at'])
+PASTRY_COLUMNS = [getattr(Pastry, field) for field in PastryRow._fields]
+
+@event.listens_for(Pastry, 'after_insert')
+@event.listens_for(Pastry, 'after_update')
+@event.listens_for(Pastry, 'after_delete')
+def _mark_catalog_changed(mapper, connection, target):
+    session_ = object_session(target)
+    if session_ is not None:
+        session_.info['catalog_changed'] = True
+
+@event.listens_for(Session, 'after_commit')
+def _bump_catalog_version(session_):
+    if session_.info.pop('catalog_changed', False) and has_app_context():
+        # Other processes' caches notice through the shared version within its check interval
+        shared_version = current_app.extensions.get('catalog_version')
+        if shared_version is not None:
+            shared_version.bump()
+        for name in ('catalog_cache', 'fragment_cache'):
+            cache = current_app.extensions.get(name)
+            if cache is not None:
+                cache.bump_version()
+        # Refill the caches from the primary until replicas have had time to replay the change
+        router = current_app.extensions.get('replica_router')
+        if router is not None:
+            router.hold_primary()
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_catalog_change(session_):
+    session_.info.pop('catalog_changed', None)
+
+def order_status_event(order_number, status, payment_status):
+    """The status payload shared by the JSON status endpoint and the order event stream"""
+    return {'order_number': order_number, 'status': status, 'payment_status': payment_status}
+
+def queue_order_event(session_, order_number, status, payment_status):
+    """Publish an order's new status once session_ commits (and never if it rolls back)"""
+    session_.info.setdefault('order_events', []).append(order_status_event(order_number, status, payment_status))
+
+@event.listens_for(Order, 'after_update')
+def _note_order_status_change(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.status.history.has_changes() or state.attrs.payment_status.history.has_changes():
+        session_ = object_session(target)
+        if session_ is not None:
+            queue_order_event(session_, target.order_number, target.status, target.payment_status)
+
+@event.listens_for(Session, 'after_commit')
+def _publish_order_events(session_):
+    events = session_.info.pop('order_events', None)
+    broker = current_app.extensions.get('order_events') if events and has_app_context() else None
+    if broker is not None:
+        for order_event in events:
+            try:
+                broker.publish(order_event['order_number'], order_event)
+            except Exception:
+                # The change is committed; customers pick it up from the status endpoint instead
+                current_app.logger.exception('Could not publish status of order %s', order_event['order_number'])
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_order_events(session_):
+    session_.info.pop('order_events', None)
+
+def _load_pastry_rows(query):
+    return tuple(PastryRow(*row) for row in query.all())
+
+def available_pastries(category=None, limit=None):
+    """Available pastries in id order as immutable rows, served from the catalog cache"""
+    def load():
+        query = db.session.query(*PASTRY_COLUMNS).filter(Pastry.available)
+        if category:
+            query = query.filter(Pastry.category == category)
+        return _load_pastry_rows(query.order_by(Pastry.id).limit(limit))
+    return current_app.extensions['catalog_cache'].get_or_load(('available', category, limit), load)
+
+def pastry_categories():
+    """Distinct pastry categories, served from the catalog cache"""
+    return current_app.extensions['catalog_cache'].get_or_load('categories', lambda: tuple(
+        category for (category,) in db.session.query(Pastry.category).distinct().order_by(Pastry.category)
+        if category
+    ))
+
+def get_pastry_row(pastry_id):
+    """A single pastry row by id (or None), served from the catalog cache"""
+    def load():
+        rows = _load_pastry_rows(db.session.query(*PASTRY_COLUMNS).filter(Pastry.id == pastry_id))
+        return rows[0] if rows else None
+    return current_app.extensions['catalog_cache'].get_or_load(('pastry', pastry_id), load)
+
+def render_fragment(template_name, key, load_context):
+    """Render a catalog-only template fragment once per catalog version.
+
+    load_context is only called on a miss, so a cached fragment costs no
+    catalog lookups at all. Fragments must not contain per-user state.
+    """
+    return current_app.extensions['fragment_cache'].get_or_load(
+        (template_name,) + key, lambda: Markup(render_template(template_name, **load_context()))
+    )
+
+def catalog_fingerprint():
+    """Row count, max id and last modification time of the pastry table, read from the primary"""
+    # Separate scalar subqueries let max() be answered from an index instead of a table scan.
+    # updated_at is set on insert too, so it also covers created_at.
+    count, max_id, last_modified = db.session.execute(select(
+        select(func.count()).select_from(Pastry).scalar_subquery(),
+        select(func.max(Pastry.id)).scalar_subquery(),
+        select(func.max(Pastry.updated_at)).scalar_subquery()
+    ), bind_arguments={'bind': db.engine}).one()
+    if last_modified is not None and last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    return count, max_id, last_modified
+
+def catalog_state():
+    """catalog_fingerprint(), served from the catalog cache"""
+    return current_app.extensions['catalog_cache'].get_or_load('state', catalog_fingerprint)
+
+def create_catalog_version(app):
+    """The shared catalog version the caches poll, or None to rely on their TTL alone"""
+    backend = app.config.get('CATALOG_VERSION_BACKEND')
+    interval = app.config.get('CATALOG_VERSION_CHECK_SECONDS', 5)
+    if backend == 'redis':
+        return redis_catalog_version(app.config['REDIS_URL'], check_interval=interval)
+    if backend == 'database':
+        # Writers move the fingerprint themselves (every pastry write sets updated_at), so there is nothing to bump
+        return CatalogVersion(catalog_fingerprint, check_interval=interval)
+    if backend:
+        raise ValueError(f'Unknown CATALOG_VERSION_BACKEND: {backend}')
+    return None
+
+def conditional_catalog_response(view):
+    """Add catalog-derived ETag/Last-Modified validators to a view and answer 304s before it runs.
+
+    HTML pages also carry the per-user cart badge and flash messages, so the
+    session cart is folded into their ETag, and pages with pending flashes
+    are never served from a validator. A date can't tell that the cart
+    changed, so HTML pages get no Last-Modified and ignore If-Modified-Since;
+    only the API is revalidated by date.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        config = current_app.config
+        is_api = request.path.startswith('/api/')
+        if not is_api and session.get('_flashes'):
+            response = current_app.make_response(view(*args, **kwargs))
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        
+        count, max_id, last_modified = catalog_state()
+        cart = sorted(get_cart().items()) if not is_api else []
+        etag = hashlib.sha1(repr((count, max_id, last_modified, request.full_path, cart)).encode()).hexdigest()
+        
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag)
+        else:
+            not_modified = (is_api and last_modified is not None and request.if_modified_since is not None
+                            and request.if_modified_since >= last_modified.replace(microsecond=0))
+        
+        response = current_app.response_class(status=304) if not_modified \
+            else current_app.make_response(view(*args, **kwargs))
+        if response.status_code not in (200, 304):
+            return response
+        
+        # Weak: the validator tracks the catalog and cart, not the bytes, which vary with Content-Encoding
+        response.set_etag(etag, weak=True)
+        if is_api and last_modified is not None:
+            response.last_modified = last_modified
+        if cart:
+            response.cache_control.private = True
+        else:
+            response.cache_control.public = True
+            response.cache_control.s_maxage = config.get('CATALOG_SHARED_MAX_AGE', 300)
+        response.cache_control.max_age = config.get('CATALOG_MAX_AGE', 60)
+        response.vary.add('Cookie')
+        return response
+    return wrapper
+
+def require_reports_token(view):
+    """Require 'Authorization: Bearer <REPORTS_API_TOKEN>' on a reporting endpoint.
+
+    Without a configured token the reports are refused, except in testing or
+    debug mode where they are open.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = current_app.config.get('REPORTS_API_TOKEN')
+        if not token:
+            if not (current_app.testing or current_app.debug):
+                return jsonify({'error': 'The reports API is disabled until REPORTS_API_TOKEN is set'}), 403
+        elif not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return jsonify({'error': 'A valid reports API token is required'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+def report_range(args):
+    """Inclusive (start, end) dates from ?start=&end= (YYYY-MM-DD), defaulting to the last 30 days"""
+    today = datetime.now(timezone.utc).date()
+    end = datetime.strptime(args['end'], '%Y-%m-%d').date() if args.get('end') else today
+    start = (datetime.strptime(args['start'], '%Y-%m-%d').date() if args.get('start')
+             else end - timedelta(days=REPORT_DEFAULT_DAYS - 1))
+    if start > end:
+        raise ValueError('start must not be after end')
+    if (end - start).days >= REPORT_MAX_DAYS:
+        raise ValueError(f'ranges are limited to {REPORT_MAX_DAYS} days')
+    return start, end
+
+def search_catalog(search, category='', page=1):
+    """One ranked page of search results as pastry rows, served from the catalog cache"""
+    per_page = current_app.config.get('SEARCH_PAGE_SIZE', 24)
+    
+    def load():
+        results = search_pastries(db.session, search, category, page, per_page)
+        rows = {row.id: row for row in _load_pastry_rows(
+            db.session.query(*PASTRY_COLUMNS).filter(Pastry.id.in_(results['ids']))
+        )} if results['ids'] else {}
+        results['pastries'] = tuple(rows[pastry_id] for pastry_id in results['ids'] if pastry_id in rows)
+        return results
+    
+    key = ('search', normalize_search_term(search), category, page, per_page)
+    return current_app.extensions['catalog_cache'].get_or_load(key, load)
+
+def api_pastry_query(fields, after=None, limit=None):
+    """Keyset query over available pastries, selecting only the requested columns"""
+    query = select(*[getattr(Pastry, field) for field in fields]) \
+        .where(Pastry.available).order_by(Pastry.id)
+    if after is not None:
+        query = query.where(Pastry.id > after)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+def stream_api_pastries(fields, after=None, limit=None, fmt='ndjson'):
+    """Yield pastries as NDJSON lines or a JSON array straight from a server-side cursor"""
+    dumps = current_app.json.dumps
+    result = db.session.execute(api_pastry_query(fields, after, limit).execution_options(yield_per=API_STREAM_CHUNK))
+    
+    if fmt == 'ndjson':
+        for rows in result.partitions():
+            yield ''.join(dumps(dict(zip(fields, row))) + '\n' for row in rows)
+        return
+    
+    yield '['
+    separator = ''
+    for rows in result.partitions():
+        yield separator + ','.join(dumps(dict(zip(fields, row))) for row in rows)
+        separator = ','
+    yield ']'
+
+def _server_side_sessions():
+    interface = current_app.session_interface
+    return interface if isinstance(interface, ServerSideSessionInterface) else None
+
+def get_cart():
+    """The current cart as {pastry_id: quantity}, from the session store or the cookie"""
+    interface = _server_side_sessions()
+    if interface:
+        return interface.cart(session)
+    return session.get('cart', {})
+
+def add_cart_item(pastry_id, quantity):
+    if quantity < 1:
+        raise ValueError('quantity must be at least 1')
+    interface = _server_side_sessions()
+    if interface:
+        interface.cart_add(current_app, session, str(pastry_id), quantity)
+        return
+    cart = session.get('cart', {})
+    cart[str(pastry_id)] = cart.get(str(pastry_id), 0) + quantity
+    session['cart'] = cart
+
+def set_cart_item(pastry_id, quantity):
+    """Set a line's quantity, removing it when quantity drops to zero"""
+    if quantity <= 0:
+        remove_cart_item(pastry_id)
+        return
+    interface = _server_side_sessions()
+    if interface:
+        interface.cart_set(current_app, session, str(pastry_id), quantity)
+    elif 'cart' in session:
+        session['cart'][str(pastry_id)] = quantity
+        session.modified = True
+
+def remove_cart_item(pastry_id):
+    interface = _server_side_sessions()
+    if interface:
+        interface.cart_remove(current_app, session, str(pastry_id))
+    elif 'cart' in session:
+        session['cart'].pop(str(pastry_id), None)
+        session.modified = True
+
+def clear_cart():
+    interface = _server_side_sessions()
+    if interface:
+        interface.cart_clear(current_app, session)
+    else:
+        session.pop('cart', None)
+
+def upsert_customer(name, email, phone):
+    """Return the id of the customer with this email, creating it if needed, in one statement"""
+    table = Customer.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect not in ('postgresql', 'sqlite'):
+        customer = Customer.query.filter_by(email=email).first()
+        if not customer:
+            customer = Customer(name=name, email=email, phone=phone)
+            db.session.add(customer)
+            db.session.flush()
+        return customer.id
+    
+    dialect_insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+    stmt = dialect_insert(table).values(name=name, email=email, phone=phone)
+    # A no-op update on conflict keeps the existing customer's details but still RETURNs its id
+    stmt = stmt.on_conflict_do_update(index_elements=[table.c.email], set_={'email': stmt.excluded.email})
+    return db.session.execute(stmt.returning(table.c.id)).scalar_one()
+
+def order_lines(priced):
+    """Order item rows for a priced cart, with prices fixed at the time of pricing"""
+    return [
+        {'pastry_id': item['pastry'].id, 'quantity': item['quantity'], 'unit_price': item['pastry'].price}
+        for item in priced['items']
+    ]
+
+def write_order(customer_id, total_amount, lines, **order_fields):
+    """Insert an order and all of its items, returning (order id, order number).
+
+    The order is inserted with RETURNING and the items in one executemany,
+    so the write path costs two statements regardless of cart size. With
+    SALES_ROLLUP=inline the order is also counted into the rollup tables in
+    the same transaction, at three more statements; by default (deferred)
+    `flask rollup-sales` counts it later, since inline every checkout in the
+    store would queue on the same daily_sales row.
+    """
+    inline_rollup = current_app.config.get('SALES_ROLLUP', 'deferred') == 'inline'
+    orders = Order.__table__
+    order_id, order_number = db.session.execute(
+        insert(orders).values(customer_id=customer_id, total_amount=total_amount,
+                              sales_rolled_up=inline_rollup, **order_fields)
+        .returning(orders.c.id, orders.c.order_number)
+    ).one()
+    
+    if lines:
+        db.session.execute(insert(OrderItem.__table__), [dict(line, order_id=order_id) for line in lines])
+    if inline_rollup:
+        rollup_orders([order_id])
+    return order_id, order_number
+
+def rollup_orders(order_ids):
+    """Add the given orders' sales to the daily, pastry and category rollups, one upsert per table"""
+    dialect_insert = postgresql.insert if db.session.get_bind().dialect.name == 'postgresql' else sqlite.insert
+    orders, items, pastries = Order.__table__, OrderItem.__table__, Pastry.__table__
+    day = func.date(orders.c.created_at)
+    units = func.sum(items.c.quantity)
+    revenue = func.sum(items.c.quantity * items.c.unit_price)
+    counted = orders.join(items, items.c.order_id == orders.c.id)
+    
+    rollups = [
+        (DailySales.__table__, ['day', 'orders', 'units', 'revenue'],
+         select(day, func.count(func.distinct(orders.c.id)), units, revenue).select_from(counted)
+         .where(orders.c.id.in_(order_ids)).group_by(day)),
+        (PastryDailySales.__table__, ['day', 'pastry_id', 'units', 'revenue'],
+         select(day, items.c.pastry_id, units, revenue).select_from(counted)
+         .where(orders.c.id.in_(order_ids)).group_by(day, items.c.pastry_id)),
+        (CategoryDailySales.__table__, ['day', 'category', 'units', 'revenue'],
+         select(day, func.coalesce(pastries.c.category, ''), units, revenue)
+         .select_from(counted.join(pastries, pastries.c.id == items.c.pastry_id))
+         .where(orders.c.id.in_(order_ids)).group_by(day, func.coalesce(pastries.c.category, ''))),
+    ]
+    for table, columns, query in rollups:
+        stmt = dialect_insert(table).from_select(columns, query)
+        counters = [column for column in ('orders', 'units', 'revenue') if column in columns]
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=list(table.primary_key.columns),
+            set_={column: table.c[column] + stmt.excluded[column] for column in counters}
+        ))
+
+def catch_up_sales_rollups(batch_size=1000, rebuild=False):
+    """Count every order not yet in the rollups, a batch per transaction; returns the number counted.
+
+    With rebuild=True the rollups are emptied and every order is counted again.
+    """
+    if rebuild:
+        for model in (DailySales, PastryDailySales, CategoryDailySales):
+            db.session.execute(model.__table__.delete())
+        db.session.execute(update(Order.__table__).values(sales_rolled_up=False))
+        db.session.commit()
+    
+    counted = 0
+    while True:
+        # SKIP LOCKED lets several catch-up jobs (or one racing a rebuild) share the backlog on Postgres
+        order_ids = db.session.scalars(
+            select(Order.id).where(~Order.sales_rolled_up).order_by(Order.id).limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ).all()
+        if not order_ids:
+            return counted
+        rollup_orders(order_ids)
+        db.session.execute(update(Order.__table__).where(Order.id.in_(order_ids)).values(sales_rolled_up=True))
+        db.session.commit()
+        counted += len(order_ids)
+
+def _write_queued_orders(orders):
+    existing = set(db.session.scalars(select(Order.order_number).where(Order.order_number.in_(orders))))
+    for order_number, payload in orders.items():
+        if order_number in existing:
+            continue
+        fields = dict(payload['order'])
+        fields['delivery_date'] = datetime.strptime(fields['delivery_date'], '%Y-%m-%d').date()
+        customer_id = upsert_customer(**payload['customer'])
+        write_order(customer_id, payload['total'], payload['lines'], order_number=order_number, **fields)
+        # Tells the customer's processing page the order is in
+        queue_order_event(db.session, order_number, 'pending', 'pending')
+
+def write_queued_orders(jobs):
+    """Write a batch of queued (order_number, payload) jobs, returning (written, {order_number: error}).
+
+    The whole batch commits in one transaction. Orders already in the database
+    (a batch replayed after a worker restart) are skipped, so each order is
+    written exactly once. If the batch fails it is retried one order per
+    transaction, so a single bad order can't hold up the others.
+    """
+    orders = {order_number: json.loads(payload) for order_number, payload in jobs}
+    try:
+        _write_queued_orders(orders)
+        db.session.commit()
+        return list(orders), {}
+    except Exception:
+        db.session.rollback()
+    
+    written, failed = [], {}
+    for order_number, payload in orders.items():
+        try:
+            _write_queued_orders({order_number: payload})
+            db.session.commit()
+            written.append(order_number)
+        except Exception as e:
+            db.session.rollback()
+            failed[order_number] = repr(e)
+    return written, failed
+
+def abandon_queued_order(order_number, payload):
+    """Give back the delivery slot and stock a queued order held, and tell its processing page it failed"""
+    try:
+        order = json.loads(payload)
+        delivery_date = datetime.strptime(order['order']['delivery_date'], '%Y-%m-%d').date()
+        city, lines = order['order']['delivery_city'], order['lines']
+    except (ValueError, KeyError, TypeError):
+        # Nothing was reserved from a payload place_order couldn't have written
+        current_app.logger.warning('Abandoned queued order %s has no readable reservation', order_number)
+    else:
+        release_delivery_slot(delivery_date, city)
+        return_stock(lines)
+        db.session.commit()
+    current_app.extensions['order_events'].publish(order_number, order_status_event(order_number, 'failed', None))
+
+def update_order_status(order_number, status=None, payment_status=None):
+    """Change an order's status and/or payment status, returning the order (None if unknown).
+
+    The change is published to the order's event stream when the caller commits.
+    """
+    order = Order.query.filter_by(order_number=order_number).first()
+    if order is None:
+        return None
+    if status is not None:
+        order.status = status
+    if payment_status is not None:
+        order.payment_status = payment_status
+    return order
+
+def customer_history_token(customer_id):
+    """Unguessable token for a customer's order history link, handed out on their order confirmations"""
+    return URLSafeSerializer(current_app.secret_key, salt='order-history').dumps(customer_id)
+
+def customer_from_history_token(token):
+    try:
+        return URLSafeSerializer(current_app.secret_key, salt='order-history').loads(token)
+    except BadSignature:
+        return None
+
+def encode_history_cursor(created_at, order_id):
+    return base64.urlsafe_b64encode(f'{created_at.isoformat()}|{order_id}'.encode()).decode().rstrip('=')
+
+def decode_history_cursor(cursor):
+    """(created_at, id) from an encode_history_cursor() value; raises ValueError if it is malformed"""
+    created_at, _, order_id = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().partition('|')
+    return datetime.fromisoformat(created_at), int(order_id)
+
+def order_history_page(customer_id, after=None, limit=ORDER_HISTORY_PAGE_SIZE):
+    """A page of a customer's order summaries, newest first, and the cursor for the next page (or None).
+
+    Pages are keyed on (created_at, id), so each one is a range read on the
+    customer's slice of the history index however many orders they have.
+    Item counts come from a correlated subquery in the same statement.
+    """
+    item_count = select(func.coalesce(func.sum(OrderItem.quantity), 0)) \
+        .where(OrderItem.order_id == Order.id).scalar_subquery()
+    query = select(Order.id, Order.order_number, Order.created_at, Order.status, Order.total_amount,
+                   Order.delivery_date, item_count.label('item_count')) \
+        .where(Order.customer_id == customer_id) \
+        .order_by(Order.created_at.desc(), Order.id.desc()).limit(limit + 1)
+    if after is not None:
+        query = query.where(tuple_(Order.created_at, Order.id) < after)
+    
+    rows = db.session.execute(query).all()
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_history_cursor(rows[limit - 1].created_at, rows[limit - 1].id)
+    return rows[:limit], next_cursor
+
+def order_with_details():
+    """Order query that eager-loads the customer, items and their pastries.
+
+    The customer is joined in and the items plus pastries come from one
+    selectin query, so rendering an order costs two queries whatever its size.
+    Shared by every order read path (confirmation, status, history).
+    """
+    return Order.query.options(
+        joinedload(Order.customer),
+        selectinload(Order.items).joinedload(OrderItem.pastry)
+    )
+
+def price_cart(cart):
+    """Price a session cart, loading every pastry in one IN (...) query"""
+    items = []
+    subtotal = 0
+    
+    if cart:
+        pastry_ids = [int(pastry_id) for pastry_id in cart]
+        # Stock left (None when untracked) and its stripe count come back in the same query
+        stock = (select(PastryStock.pastry_id, func.sum(PastryStock.quantity).label('quantity'),
+                        func.count().label('stripes'))
+                 .where(PastryStock.pastry_id.in_(pastry_ids))
+                 .group_by(PastryStock.pastry_id).subquery())
+        rows = (db.session.query(Pastry, stock.c.quantity, stock.c.stripes)
+                .outerjoin(stock, stock.c.pastry_id == Pastry.id)
+                .filter(Pastry.id.in_(pastry_ids)).all())
+        pastries = {pastry.id: (pastry, quantity, stripes) for pastry, quantity, stripes in rows}
+        
+        for pastry_id, quantity in cart.items():
+            if int(pastry_id) in pastries:
+                pastry, stock_left, stripes = pastries[int(pastry_id)]
+                item_total = pastry.price * quantity
+                subtotal += item_total
+                items.append({
+                    'pastry': pastry,
+                    'quantity': quantity,
+                    'item_total': item_total,
+                    'stock': stock_left,
+                    'stripes': stripes or 0
+                })
+    
+    return {
+        'items': items,
+        'subtotal': subtotal,
+        'delivery_fee': DELIVERY_FEE,
+        'total': subtotal + DELIVERY_FEE
+    }
+
+def reserve_stock(priced):
+    """Take stock for every stock-tracked line of a priced cart, returning the lines that are short.
+
+    Every tracked line is decremented by one conditional UPDATE, each against
+    one randomly chosen stripe of its pastry, so orders for a hot pastry
+    spread over its stripes rather than queueing on a single row. A line whose
+    stripe can't cover it falls back to drawing on all of that pastry's
+    stripes under lock. Stock is never read and written back unlocked; when
+    any line comes back short the caller must roll the transaction back.
+    """
+    # A non-positive line would put stock back (and drag the order total down), so it is never filled
+    short = [item for item in priced['items'] if item['quantity'] < 1]
+    tracked = [item for item in priced['items'] if item['stock'] is not None]
+    # Lines already short when the cart was priced can't succeed
+    short += [item for item in tracked if item['quantity'] > item['stock'] and item not in short]
+    if not tracked or short:
+        return short
+    
+    table = PastryStock.__table__
+    targets = [(item['pastry'].id, random.randrange(item['stripes']), item['quantity']) for item in tracked]
+    amount = case(*[(and_(table.c.pastry_id == pastry_id, table.c.stripe == stripe), quantity)
+                    for pastry_id, stripe, quantity in targets])
+    taken = set(db.session.scalars(
+        update(table)
+        .where(tuple_(table.c.pastry_id, table.c.stripe).in_([target[:2] for target in targets]),
+               table.c.quantity >= amount)
+        .values(quantity=table.c.quantity - amount)
+        .returning(table.c.pastry_id)
+    ))
+    return [item for item in tracked
+            if item['pastry'].id not in taken
+            and not (item['stripes'] > 1 and _take_from_stripes(item['pastry'].id, item['quantity']))]
+
+def _take_from_stripes(pastry_id, quantity):
+    """Take quantity from a pastry's stripes together, largest first, returning False if they can't cover it"""
+    table = PastryStock.__table__
+    stripes = db.session.execute(
+        select(table.c.stripe, table.c.quantity).where(table.c.pastry_id == pastry_id)
+        .order_by(table.c.stripe).with_for_update()
+    ).all()
+    if sum(available for _, available in stripes) < quantity:
+        return False
+    
+    takes = []
+    for stripe, available in sorted(stripes, key=lambda row: -row[1]):
+        take = min(available, quantity)
+        if take:
+            takes.append({'p': pastry_id, 's': stripe, 'take': take})
+            quantity -= take
+    db.session.execute(
+        update(table).where(table.c.pastry_id == bindparam('p'), table.c.stripe == bindparam('s'))
+        .values(quantity=table.c.quantity - bindparam('take')),
+        takes
+    )
+    return True
+
+def return_stock(lines):
+    """Give back stock taken by reserve_stock for order lines, onto each pastry's first stripe"""
+    table = PastryStock.__table__
+    db.session.execute(
+        update(table).where(table.c.pastry_id == bindparam('p'), table.c.stripe == 0)
+        .values(quantity=table.c.quantity + bindparam('q')),
+        [{'p': line['pastry_id'], 'q': line['quantity']} for line in lines]
+    )
+
+def set_stock(pastry_id, quantity, stripes=1):
+    """Set a pastry's stock, split evenly over stripes rows; None stops tracking it"""
+    table = PastryStock.__table__
+    db.session.execute(delete(table).where(table.c.pastry_id == pastry_id))
+    if quantity is None:
+        return
+    per_stripe, extra = divmod(quantity, stripes)
+    db.session.execute(insert(table), [
+        {'pastry_id': pastry_id, 'stripe': stripe, 'quantity': per_stripe + (stripe < extra)}
+        for stripe in range(stripes)
+    ])
+
+def delivery_window():
+    """Delivery dates offered at checkout: the next DELIVERY_WINDOW_DAYS days, excluding today"""
+    today = datetime.now().date()
+    return [today + timedelta(days=i) for i in range(1, DELIVERY_WINDOW_DAYS + 1)]
+
+def delivery_slot_city(city):
+    """The slot counter a delivery city books against: its own if it has a capacity, else the shared one"""
+    city = (city or '').strip().lower()
+    return city if city in current_app.config.get('DELIVERY_CITY_CAPACITY', {}) else ''
+
+def delivery_capacity(slot_city):
+    if slot_city:
+        return current_app.config['DELIVERY_CITY_CAPACITY'][slot_city]
+    return current_app.config.get('DELIVERY_SLOT_CAPACITY', 50)
+
+def delivery_availability(city=''):
+    """((date, remaining), ...) across the delivery window, served from the delivery slot cache"""
+    slot_city = delivery_slot_city(city)
+    window = delivery_window()
+    
+    def load():
+        # Days nobody has booked yet have no row and so still have their full capacity
+        remaining = dict(db.session.query(DeliverySlot.delivery_date, DeliverySlot.capacity - DeliverySlot.reserved)
+                         .filter(DeliverySlot.city == slot_city,
+                                 DeliverySlot.delivery_date.between(window[0], window[-1])).all())
+        capacity = delivery_capacity(slot_city)
+        return tuple((day, max(remaining.get(day, capacity), 0)) for day in window)
+    return current_app.extensions['delivery_slot_cache'].get_or_load(('availability', slot_city, window[0]), load)
+
+def reserve_delivery_slot(delivery_date, city):
+    """Book one order onto a delivery day, returning False if the day is full.
+
+    A single upsert creates the day's counter on first use and otherwise
+    increments it only while it is under capacity, so concurrent checkouts
+    contend on that one row and never lock the orders table.
+    """
+    slot_city = delivery_slot_city(city)
+    capacity = delivery_capacity(slot_city)
+    if capacity < 1:
+        return False
+    
+    table = DeliverySlot.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect not in ('postgresql', 'sqlite'):
+        booked = db.session.execute(
+            update(table).where(table.c.city == slot_city, table.c.delivery_date == delivery_date,
+                                table.c.reserved < table.c.capacity)
+            .values(reserved=table.c.reserved + 1)
+        ).rowcount
+        exists = db.session.query(table.c.id).filter_by(city=slot_city, delivery_date=delivery_date).first()
+        if not booked and exists is None:
+            db.session.execute(insert(table).values(delivery_date=delivery_date, city=slot_city,
+                                                    capacity=capacity, reserved=1))
+            booked = 1
+        return bool(booked)
+    
+    dialect_insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+    stmt = dialect_insert(table).values(delivery_date=delivery_date, city=slot_city, capacity=capacity, reserved=1)
+    # The conditional update returns no row when the day is already full
+    stmt = stmt.on_conflict_do_update(index_elements=[table.c.city, table.c.delivery_date],
+                                      set_={'reserved': table.c.reserved + 1},
+                                      where=table.c.reserved < table.c.capacity)
+    return db.session.execute(stmt.returning(table.c.id)).first() is not None
+
+def release_delivery_slot(delivery_date, city):
+    """Give back a slot taken by reserve_delivery_slot"""
+    table = DeliverySlot.__table__
+    db.session.execute(
+        update(table).where(table.c.city == delivery_slot_city(city), table.c.delivery_date == delivery_date,
+                            table.c.reserved > 0)
+        .values(reserved=table.c.reserved - 1)
+    )
+
+def city_capacity_from_env(value):
+    """Parse DELIVERY_CITY_CAPACITY, e.g. 'Nairobi=40,Mombasa=20', into {'nairobi': 40, 'mombasa': 20}"""
+    capacities = {}
+    for entry in filter(None, (part.strip() for part in (value or '').split(','))):
+        city, _, capacity = entry.partition('=')
+        capacities[city.strip().lower()] = int(capacity)
+    return capacities
+
+def engine_options_from_env(database_url):
+    """SQLAlchemy engine/pool options for SQLALCHEMY_ENGINE_OPTIONS, driven by environment variables"""
+    options = {
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'True').lower() == 'true',
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+    }
+    if database_url.startswith('sqlite'):
+        return options
+    
+    options['pool_size'] = int(os.getenv('DB_POOL_SIZE', 5))
+    options['max_overflow'] = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    options['pool_timeout'] = int(os.getenv('DB_POOL_TIMEOUT', 30))
+    
+    statement_timeout = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 30000))
+    if database_url.startswith('postgres') and statement_timeout:
+        options['connect_args'] = {'options': f'-c statement_timeout={statement_timeout}'}
+    return options
+
+def init_migrations(app):
+    """Register Flask-Migrate (the `flask db` commands and flask_migrate.upgrade()) with the app"""
+    from flask_migrate import Migrate
+    # Extra keyword arguments reach context.configure() in migrations/env.py
+    Migrate(app, db, directory=os.path.join(app.root_path, 'migrations'), include_object=include_in_autogenerate)
+
+def warm_up(app):
+    """Open pooled connections, fill the catalog caches and load every template, logging what it cost.
+
+    Runs in each worker after it starts (see start_warmup), so the first
+    customer requests don't pay for connecting, catalog queries or template
+    compilation. Failures are logged, never raised: a cold cache is only slower.
+    """
+    started = time.perf_counter()
+    with app.app_context():
+        try:
+            connections = [engine.connect() for engine in db.engines.values()
+                           for _ in range(app.config.get('WARMUP_CONNECTIONS', 2))]
+            for connection in connections:
+                connection.exec_driver_sql('SELECT 1')
+            for connection in connections:
+                connection.close()
+            for replica in app.extensions['replica_router'].replicas:
+                app.extensions['replica_router'].check(replica)
+            catalog_state()
+            available_pastries(limit=6)
+            available_pastries()
+            pastry_categories()
+        except Exception:
+            app.logger.exception('Warm-up could not prime the database and catalog caches')
+        finally:
+            db.session.remove()
+        for name in app.jinja_env.list_templates():
+            app.jinja_env.get_template(name)
+    app.logger.info('Warm-up finished in %.0fms', (time.perf_counter() - started) * 1000)
+
+def start_warmup(app):
+    """Run warm_up in a background thread, so the worker can accept requests straight away"""
+    thread = threading.Thread(target=warm_up, args=(app,), name='warmup', daemon=True)
+    thread.start()
+    return thread
+
 def create_app(test_config=None):
     """Application factory pattern for testing"""
     app = Flask(__name__)
@@ -85,148 +968,336 @@ def create_app(test_config=None):
         
         app.config['SQLALCHEMY_DATABASE_URI'] = database_url
         app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options_from_env(database_url)
+        
+        # Read replicas become binds replica_0, replica_1, ...; read-only views spread their reads over them
+        replica_urls = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+        app.config['SQLALCHEMY_BINDS'] = {f'{BIND_PREFIX}{i}': dict(engine_options_from_env(url), url=url)
+                                          for i, url in enumerate(replica_urls)}
+        app.config['REPLICA_CHECK_INTERVAL'] = float(os.getenv('REPLICA_CHECK_INTERVAL', 5))
+        app.config['REPLICA_MAX_LAG_SECONDS'] = float(os.getenv('REPLICA_MAX_LAG_SECONDS', 30))
+        app.config['REPLICA_STICKY_SECONDS'] = float(os.getenv('REPLICA_STICKY_SECONDS', 5))
         
         # Additional configuration
         app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', 16777216))
         app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', 'static/uploads')
+        app.config['AUTO_CREATE_SCHEMA'] = os.getenv('AUTO_CREATE_SCHEMA', 'False').lower() == 'true'
+        app.config['JINJA_BYTECODE_CACHE_DIR'] = os.getenv('JINJA_BYTECODE_CACHE_DIR',
+                                                           os.path.join(app.instance_path, 'jinja-cache'))
+        app.config['WARMUP_ON_START'] = os.getenv('WARMUP_ON_START', 'True').lower() == 'true'
+        app.config['WARMUP_CONNECTIONS'] = int(os.getenv('WARMUP_CONNECTIONS', 2))
+        app.config['COMPRESS_ENABLED'] = os.getenv('COMPRESS_ENABLED', 'True').lower() == 'true'
+        app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', 500))
+        app.config['COMPRESS_LEVEL'] = int(os.getenv('COMPRESS_LEVEL', 6))
+        app.config['COMPRESS_BROTLI_QUALITY'] = int(os.getenv('COMPRESS_BROTLI_QUALITY', 4))
+        app.config['IMAGE_STORE_DIR'] = os.getenv('IMAGE_STORE_DIR')
+        app.config['IMAGE_WIDTHS'] = [int(width) for width in os.getenv('IMAGE_WIDTHS', '160,320,640,1000').split(',')]
+        app.config['IMAGE_QUALITY'] = int(os.getenv('IMAGE_QUALITY', 80))
+        app.config['IMAGE_WORKERS'] = int(os.getenv('IMAGE_WORKERS', 2))
+        app.config['IMAGE_MAX_PENDING'] = int(os.getenv('IMAGE_MAX_PENDING', 32))
         app.config['SESSION_COOKIE_HTTPONLY'] = os.getenv('SESSION_COOKIE_HTTPONLY', 'True').lower() == 'true'
         app.config['PERMANENT_SESSION_LIFETIME'] = int(os.getenv('PERMANENT_SESSION_LIFETIME', 3600))
+        app.config['REDIS_URL'] = os.getenv('REDIS_URL')
+        app.config['SESSION_BACKEND'] = os.getenv('SESSION_BACKEND', 'redis' if app.config['REDIS_URL'] else 'cookie')
+        app.config['CATALOG_CACHE_SIZE'] = int(os.getenv('CATALOG_CACHE_SIZE', 256))
+        app.config['CATALOG_CACHE_TTL'] = int(os.getenv('CATALOG_CACHE_TTL', 300))
+        app.config['CATALOG_VERSION_BACKEND'] = os.getenv('CATALOG_VERSION_BACKEND',
+                                                          'redis' if app.config['REDIS_URL'] else 'database')
+        app.config['CATALOG_VERSION_CHECK_SECONDS'] = float(os.getenv('CATALOG_VERSION_CHECK_SECONDS', 5))
+        app.config['SEARCH_PAGE_SIZE'] = int(os.getenv('SEARCH_PAGE_SIZE', 24))
+        app.config['FRAGMENT_CACHE_SIZE'] = int(os.getenv('FRAGMENT_CACHE_SIZE', 512))
+        app.config['FRAGMENT_CACHE_BYTES'] = int(os.getenv('FRAGMENT_CACHE_BYTES', 8 * 1024 * 1024))
+        app.config['FRAGMENT_CACHE_TTL'] = int(os.getenv('FRAGMENT_CACHE_TTL', 300))
+        app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', 'False').lower() == 'true'
+        app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+        app.config['PROFILE_SLOW_REQUESTS_MS'] = int(os.getenv('PROFILE_SLOW_REQUESTS_MS', 0))
+        app.config['PROFILE_SAMPLE_RATE'] = float(os.getenv('PROFILE_SAMPLE_RATE', 0.01))
+        app.config['PROFILE_DIR'] = os.getenv('PROFILE_DIR', 'logs/profiles')
+        app.config['CATALOG_MAX_AGE'] = int(os.getenv('CATALOG_MAX_AGE', 60))
+        app.config['CATALOG_SHARED_MAX_AGE'] = int(os.getenv('CATALOG_SHARED_MAX_AGE', 300))
+        app.config['DELIVERY_SLOT_CAPACITY'] = int(os.getenv('DELIVERY_SLOT_CAPACITY', 50))
+        app.config['DELIVERY_CITY_CAPACITY'] = city_capacity_from_env(os.getenv('DELIVERY_CITY_CAPACITY'))
+        app.config['DELIVERY_SLOT_CACHE_TTL'] = int(os.getenv('DELIVERY_SLOT_CACHE_TTL', 15))
+        app.config['SALES_ROLLUP'] = os.getenv('SALES_ROLLUP', 'deferred')
+        app.config['REPORTS_API_TOKEN'] = os.getenv('REPORTS_API_TOKEN')
+        app.config['ORDER_INTAKE'] = os.getenv('ORDER_INTAKE', 'sync')
+        app.config['ORDER_QUEUE_BACKEND'] = os.getenv('ORDER_QUEUE_BACKEND', 'sqlite')
+        app.config['ORDER_QUEUE_PATH'] = os.getenv('ORDER_QUEUE_PATH')
+        app.config['ORDER_QUEUE_WORKERS'] = int(os.getenv('ORDER_QUEUE_WORKERS', 2))
+        app.config['ORDER_QUEUE_BATCH_SIZE'] = int(os.getenv('ORDER_QUEUE_BATCH_SIZE', 50))
+        app.config['ORDER_QUEUE_LEASE_SECONDS'] = int(os.getenv('ORDER_QUEUE_LEASE_SECONDS', 60))
+        app.config['ORDER_QUEUE_MAX_ATTEMPTS'] = int(os.getenv('ORDER_QUEUE_MAX_ATTEMPTS', 5))
+        app.config['ORDER_EVENTS_BACKEND'] = os.getenv('ORDER_EVENTS_BACKEND',
+                                                       'redis' if app.config['REDIS_URL'] else 'memory')
+        app.config['ORDER_EVENTS_TTL'] = int(os.getenv('ORDER_EVENTS_TTL', 86400))
+        app.config['ORDER_EVENTS_STREAM_URL'] = os.getenv('ORDER_EVENTS_STREAM_URL')
+        app.config['ORDER_STATUS_POLL_SECONDS'] = int(os.getenv('ORDER_STATUS_POLL_SECONDS', 5))
     
     # Initialize extensions
     db.init_app(app)
-    migrate.init_app(app, db)
+    # Flask-Migrate pulls in Alembic, a sixth of import time, and only `flask db` needs it
+    if os.getenv('FLASK_RUN_FROM_CLI') == 'true':
+        init_migrations(app)
+    # Catalog writes usually come from other processes (load-catalog, ingest-images), so the caches poll a shared version
+    catalog_version = create_catalog_version(app)
+    if catalog_version is not None:
+        app.extensions['catalog_version'] = catalog_version
+    CatalogCache().init_app(app)
+    FragmentCache().init_app(app)
+    DeliverySlotCache().init_app(app)
     
-    # Register routes
+    # Resized pastry image derivatives under /images/, rendered on first request
+    ImageStore().init_app(app)
+    
+    # Hashed, precompressed static assets, and gzip/brotli for rendered responses
+    AssetManifest().init_app(app)
+    ResponseCompressor().init_app(app)
+    
+    # Compiled templates are cached on disk, so new workers skip parsing them (see `flask compile-templates`)
+    bytecode_cache_dir = app.config.get('JINJA_BYTECODE_CACHE_DIR')
+    if bytecode_cache_dir:
+        try:
+            os.makedirs(bytecode_cache_dir, exist_ok=True)
+            app.jinja_env.bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
+        except OSError as e:
+            app.logger.warning('Jinja bytecode cache disabled: %s', e)
+    
+    # Keep sessions server-side when a session store is configured
+    session_interface = create_session_interface(app)
+    if session_interface is not None:
+        app.session_interface = session_interface
+    
+    # Order status changes are published here and streamed to customers by order_events.OrderEventStream
+    app.extensions['order_events'] = create_event_broker(app)
+    
+    # Optionally take orders onto a durable queue and write them in background batches
+    order_queue = create_order_queue(app)
+    if order_queue is not None:
+        OrderIntakeWorkers(
+            order_queue, write_queued_orders,
+            workers=app.config.get('ORDER_QUEUE_WORKERS', 2),
+            batch_size=app.config.get('ORDER_QUEUE_BATCH_SIZE', 50),
+            lease_seconds=app.config.get('ORDER_QUEUE_LEASE_SECONDS', 60),
+            on_failed=abandon_queued_order
+        ).init_app(app)
+    
+    # Register routes and CLI commands
     register_routes(app)
+    register_commands(app)
     
-    # Create tables if they don't exist
+    # Request latency, SQL and template instrumentation, exported on /metrics
     with app.app_context():
-        db.create_all()
+        metrics = RequestMetrics()
+        metrics.init_app(app, db.engine)
+        router = ReplicaRouter()
+        router.init_app(app, db.engines)
+        for replica in router.replicas:
+            metrics.instrument_engine(replica.engine)
+    
+    @app.context_processor
+    def inject_cart_count():
+        return {'cart_count': sum(get_cart().values())}
+    
+    # Schema changes belong to `flask db upgrade`; creating tables on boot is opt-in (local development)
+    if app.config.get('AUTO_CREATE_SCHEMA', False):
+        with app.app_context():
+            db.create_all()
     
     return app
 
 
+def register_commands(app):
+    """Register flask CLI commands with the Flask app"""
+    app.cli.add_command(load_catalog_command)
+    app.cli.add_command(build_assets_command)
+    
+    @app.cli.command('compile-templates')
+    def compile_templates():
+        """Compile every template into the Jinja bytecode cache (JINJA_BYTECODE_CACHE_DIR)."""
+        if app.jinja_env.bytecode_cache is None:
+            raise click.ClickException('JINJA_BYTECODE_CACHE_DIR is not set')
+        names = app.jinja_env.list_templates()
+        for name in names:
+            app.jinja_env.get_template(name)
+        click.echo(f"Compiled {len(names)} templates into {app.config['JINJA_BYTECODE_CACHE_DIR']}")
+    
+    @app.cli.command('rollup-sales')
+    @click.option('--rebuild', is_flag=True, help='Empty the rollups and count every order again.')
+    @click.option('--batch-size', default=1000, show_default=True, help='Orders counted per transaction.')
+    def rollup_sales(rebuild, batch_size):
+        """Count orders not yet in the sales rollups (run from cron unless SALES_ROLLUP=inline)."""
+        started = time.perf_counter()
+        counted = catch_up_sales_rollups(batch_size, rebuild)
+        click.echo(f'Rolled up {counted} orders in {time.perf_counter() - started:.2f}s')
+    
+    @app.cli.command('ingest-image')
+    @click.argument('pastry_id', type=int)
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    def ingest_image(pastry_id, path):
+        """Add an image file to the image store and make it the pastry's image."""
+        pastry = db.session.get(Pastry, pastry_id)
+        if pastry is None:
+            raise click.ClickException(f'No pastry with id {pastry_id}')
+        with open(path, 'rb') as f:
+            try:
+                pastry.image_url = app.extensions['image_store'].ingest(f.read())
+            except ValueError as e:
+                raise click.ClickException(f'{path}: {e}')
+        db.session.commit()
+        click.echo(f'Pastry {pastry_id}: {pastry.image_url}')
+    
+    @app.cli.command('ingest-images')
+    def ingest_images():
+        """Move every pastry image that is a local file (under UPLOAD_FOLDER or static/) into the image store."""
+        store = app.extensions['image_store']
+        upload_folder = os.path.join(app.root_path, app.config.get('UPLOAD_FOLDER', 'static/uploads'))
+        ingested = skipped = 0
+        for pastry in Pastry.query.filter(Pastry.image_url.isnot(None)).order_by(Pastry.id):
+            url = pastry.image_url
+            if image_digest(url) or '://' in url:
+                continue
+            relative = url.lstrip('/')
+            path = os.path.join(app.root_path if relative.startswith('static/') else upload_folder, relative)
+            try:
+                with open(path, 'rb') as f:
+                    pastry.image_url = store.ingest(f.read())
+                ingested += 1
+            except (OSError, ValueError) as e:
+                click.echo(f'Pastry {pastry.id}: skipped {url} ({e})', err=True)
+                skipped += 1
+        db.session.commit()
+        click.echo(f'Ingested {ingested} images, skipped {skipped}')
+    
+    @app.cli.command('set-order-status')
+    @click.argument('order_number')
+    @click.option('--status', type=click.Choice(ORDER_STATUSES))
+    @click.option('--payment-status', type=click.Choice(PAYMENT_STATUSES))
+    def set_order_status(order_number, status, payment_status):
+        """Change an order's status, pushing the update to customers watching it."""
+        if status is None and payment_status is None:
+            raise click.UsageError('Give --status and/or --payment-status.')
+        order = update_order_status(order_number, status, payment_status)
+        if order is None:
+            raise click.ClickException(f'No order {order_number}')
+        db.session.commit()
+        click.echo(f'Order {order_number}: {order.status}, payment {order.payment_status}')
+    
+    @app.cli.command('set-stock')
+    @click.argument('pastry_id', type=int)
+    @click.argument('quantity', type=click.IntRange(min=0), required=False)
+    @click.option('--stripes', default=1, show_default=True, type=click.IntRange(min=1),
+                  help='Rows to split the stock over; use more for pastries many customers order at once.')
+    @click.option('--untrack', is_flag=True, help='Stop tracking stock for the pastry.')
+    def set_stock_command(pastry_id, quantity, stripes, untrack):
+        """Set how many of a pastry are left to sell."""
+        if (quantity is None) != untrack:
+            raise click.UsageError('Give either QUANTITY or --untrack.')
+        if db.session.get(Pastry, pastry_id) is None:
+            raise click.ClickException(f'No pastry with id {pastry_id}')
+        set_stock(pastry_id, quantity, stripes)
+        db.session.commit()
+        click.echo(f'Pastry {pastry_id}: ' + ('stock not tracked' if untrack else
+                                              f'{quantity} in stock over {stripes} stripe(s)'))
+
+
 def register_routes(app):
     """Register all routes with the Flask app"""
     
     @app.route('/')
+    @replica_reads
+    @conditional_catalog_response
     def index():
-        featured_pastries = Pastry.query.filter_by(available=True).limit(6).all()
-        return render_template('index.html', pastries=featured_pastries)
+        pastry_grid = render_fragment('partials/featured_grid.html', (),
+                                      lambda: {'pastries': available_pastries(limit=6)})
+        return render_template('index.html', pastry_grid=pastry_grid)
 
     @app.route('/browse')
+    @replica_reads
+    @conditional_catalog_response
     def browse():
         category = request.args.get('category', '')
         search = request.args.get('search', '')
         
-        query = Pastry.query.filter_by(available=True)
+        page = request.args.get('page', 1, type=int)
+        search_term = normalize_search_term(search)
         
-        if category:
-            query = query.filter_by(category=category)
-        
-        if search:
-            query = query.filter(Pastry.name.ilike(f'%{search}%'))
+        def grid_context():
+            pagination = None
+            if search_term:
+                pagination = search_catalog(search_term, category, page)
+                pastries = pagination['pastries']
+            else:
+                pastries = available_pastries(category)
+            return {'pastries': pastries, 'pagination': pagination,
+                    'current_category': category, 'search_term': search_term}
         
-        pastries = query.all()
-        categories = db.session.query(Pastry.category).distinct().all()
-        categories = [cat[0] for cat in categories if cat[0]]
+        pastry_grid = render_fragment('partials/browse_grid.html', (category, search_term, page), grid_context)
+        category_list = render_fragment('partials/category_list.html', (),
+                                        lambda: {'categories': pastry_categories()})
         
-        return render_template('browse.html', pastries=pastries, categories=categories, 
+        return render_template('browse.html', pastry_grid=pastry_grid, category_list=category_list, 
                              current_category=category, search_term=search)
 
     @app.route('/pastry/<int:pastry_id>')
+    @replica_reads
+    @conditional_catalog_response
     def pastry_detail(pastry_id):
-        pastry = Pastry.query.get_or_404(pastry_id)
+        pastry = get_pastry_row(pastry_id)
+        if pastry is None:
+            abort(404)
         return render_template('pastry_detail.html', pastry=pastry)
 
     @app.route('/add_to_cart', methods=['POST'])
     def add_to_cart():
         pastry_id = int(request.form['pastry_id'])
         quantity = int(request.form['quantity'])
+        if quantity < 1:
+            flash('Please choose a quantity of at least 1.', 'error')
+            return redirect(request.referrer or url_for('browse'))
         
-        if 'cart' not in session:
-            session['cart'] = {}
-        
-        cart = session['cart']
-        if str(pastry_id) in cart:
-            cart[str(pastry_id)] += quantity
-        else:
-            cart[str(pastry_id)] = quantity
-        
-        session['cart'] = cart
+        add_cart_item(pastry_id, quantity)
         flash('Item added to cart!', 'success')
         return redirect(request.referrer or url_for('browse'))
 
     @app.route('/cart')
+    @replica_reads
     def cart():
-        if 'cart' not in session or not session['cart']:
+        cart = get_cart()
+        if not cart:
             return render_template('cart.html', cart_items=[], total=0)
         
-        cart_items = []
-        total = 0
-        
-        for pastry_id, quantity in session['cart'].items():
-            pastry = Pastry.query.get(int(pastry_id))
-            if pastry:
-                item_total = pastry.price * quantity
-                total += item_total
-                cart_items.append({
-                    'pastry': pastry,
-                    'quantity': quantity,
-                    'item_total': item_total
-                })
-        
-        return render_template('cart.html', cart_items=cart_items, total=total, delivery_fee=DELIVERY_FEE)
+        priced = price_cart(cart)
+        return render_template('cart.html', cart_items=priced['items'], total=priced['subtotal'],
+                             delivery_fee=priced['delivery_fee'])
 
     @app.route('/update_cart', methods=['POST'])
     def update_cart():
         pastry_id = request.form['pastry_id']
         quantity = int(request.form['quantity'])
         
-        if 'cart' in session:
-            if quantity > 0:
-                session['cart'][pastry_id] = quantity
-            else:
-                session['cart'].pop(pastry_id, None)
-            session.modified = True
-        
+        set_cart_item(pastry_id, quantity)
         return redirect(url_for('cart'))
 
     @app.route('/remove_from_cart/<int:pastry_id>')
     def remove_from_cart(pastry_id):
-        if 'cart' in session:
-            session['cart'].pop(str(pastry_id), None)
-            session.modified = True
+        remove_cart_item(pastry_id)
         return redirect(url_for('cart'))
 
     @app.route('/checkout')
+    @replica_reads
     def checkout():
-        if 'cart' not in session or not session['cart']:
+        cart = get_cart()
+        if not cart:
             flash('Your cart is empty!', 'error')
             return redirect(url_for('browse'))
         
-        cart_items = []
-        total = 0
+        priced = price_cart(cart)
         
-        for pastry_id, quantity in session['cart'].items():
-            pastry = Pastry.query.get(int(pastry_id))
-            if pastry:
-                item_total = pastry.price * quantity
-                total += item_total
-                cart_items.append({
-                    'pastry': pastry,
-                    'quantity': quantity,
-                    'item_total': item_total
-                })
+        # Remaining capacity for each delivery day, from the cached slot counters
+        delivery_slots = delivery_availability()
         
-        # Generate delivery date options (next 14 days, excluding today)
-        delivery_dates = []
-        for i in range(1, 15):
-            date = datetime.now().date() + timedelta(days=i)
-            delivery_dates.append(date)
-        
-        return render_template('checkout.html', cart_items=cart_items, total=total, 
-                             delivery_dates=delivery_dates, delivery_fee=DELIVERY_FEE)
+        return render_template('checkout.html', cart_items=priced['items'], total=priced['subtotal'], 
+                             delivery_slots=delivery_slots, delivery_fee=priced['delivery_fee'])
 
     @app.route('/place_order', methods=['POST'])
     def place_order():
@@ -241,54 +1312,71 @@ def register_routes(app):
             postal_code = request.form['postal_code']
             special_instructions = request.form.get('special_instructions', '')
             
-            # Create or get customer
-            customer = Customer.query.filter_by(email=email).first()
-            if not customer:
-                customer = Customer(name=name, email=email, phone=phone)
-                db.session.add(customer)
-                db.session.flush()
+            # Price every cart line with a single query
+            priced = price_cart(get_cart())
+            order_fields = {
+                'delivery_date': delivery_date,
+                'delivery_address': address,
+                'delivery_city': city,
+                'delivery_postal_code': postal_code,
+                'special_instructions': special_instructions
+            }
             
-            # Calculate total
-            total = 0
-            for pastry_id, quantity in session['cart'].items():
-                pastry = Pastry.query.get(int(pastry_id))
-                if pastry:
-                    total += pastry.price * quantity
+            # Nothing to order: don't book a slot or write an order without items
+            if not priced['items']:
+                flash('Your cart is empty!', 'error')
+                return redirect(url_for('browse'))
             
-            total += DELIVERY_FEE  # Add delivery fee
+            intake = app.extensions.get('order_intake')
             
-            # Create order
-            order = Order(
-                customer_id=customer.id,
-                total_amount=total,
-                delivery_date=delivery_date,
-                delivery_address=address,
-                delivery_city=city,
-                delivery_postal_code=postal_code,
-                special_instructions=special_instructions
-            )
-            db.session.add(order)
-            db.session.flush()
+            # Take stock for every tracked line at once
+            short = reserve_stock(priced)
+            if short:
+                names = ', '.join(item['pastry'].name for item in short)
+                db.session.rollback()
+                flash(f"Sorry, we don't have enough {names} left. Please update your cart.", 'error')
+                return redirect(url_for('cart'))
             
-            # Create order items
-            for pastry_id, quantity in session['cart'].items():
-                pastry = Pastry.query.get(int(pastry_id))
-                if pastry:
-                    order_item = OrderItem(
-                        order_id=order.id,
-                        pastry_id=pastry.id,
-                        quantity=quantity,
-                        unit_price=pastry.price
-                    )
-                    db.session.add(order_item)
+            if intake is None:
+                customer_id = upsert_customer(name, email, phone)
+                order_id, order_number = write_order(customer_id, priced['total'], order_lines(priced),
+                                                     **order_fields)
+            
+            # Book the delivery day last: every order for that day and city shares its one row, so its lock is
+            # held only for the commit. A full day undoes the stock (and order) above and sends the customer back.
+            if not reserve_delivery_slot(delivery_date, city):
+                db.session.rollback()
+                flash(f"Sorry, {delivery_date.strftime('%A, %B %d')} is fully booked. "
+                      "Please choose another delivery date.", 'error')
+                return redirect(url_for('checkout'))
+            
+            if intake is not None:
+                # Keep the slot and stock, then queue the validated, priced order; a background worker writes it
+                db.session.commit()
+                order_number = str(uuid.uuid4())
+                try:
+                    intake.queue.put(order_number, json.dumps({
+                        'customer': {'name': name, 'email': email, 'phone': phone},
+                        'order': dict(order_fields, delivery_date=delivery_date.isoformat()),
+                        'total': priced['total'],
+                        'lines': order_lines(priced)
+                    }))
+                except Exception:
+                    release_delivery_slot(delivery_date, city)
+                    return_stock(order_lines(priced))
+                    db.session.commit()
+                    raise
+                clear_cart()
+                flash('Order received! We are processing it now.', 'success')
+                return redirect(url_for('order_confirmation', order_number=order_number))
             
             db.session.commit()
             
             # Clear cart
-            session.pop('cart', None)
+            clear_cart()
             
             flash('Order placed successfully!', 'success')
-            return redirect(url_for('order_confirmation', order_number=order.order_number))
+            return redirect(url_for('order_confirmation', order_number=order_number))
         
         except Exception as e:
             db.session.rollback()
@@ -296,25 +1384,223 @@ def register_routes(app):
             return redirect(url_for('checkout'))
 
     @app.route('/order/<order_number>')
+    @replica_reads
     def order_confirmation(order_number):
-        order = Order.query.filter_by(order_number=order_number).first_or_404()
-        return render_template('order_confirmation.html', order=order, delivery_fee=DELIVERY_FEE)
+        order = order_with_details().filter_by(order_number=order_number).first()
+        if order is None:
+            intake = app.extensions.get('order_intake')
+            status = intake.queue.status(order_number) if intake is not None else None
+            if status is None:
+                abort(404)
+            return render_template('order_processing.html', order_number=order_number, status=status,
+                                   **order_status_urls(order_number))
+        return render_template('order_confirmation.html', order=order, delivery_fee=DELIVERY_FEE,
+                               history_token=customer_history_token(order.customer_id),
+                               **order_status_urls(order_number))
+
+    def order_status_urls(order_number):
+        """Where an order page follows its status: the event stream when one is deployed, else the JSON endpoint"""
+        stream_url = app.config.get('ORDER_EVENTS_STREAM_URL')
+        return {'status_url': url_for('order_status', order_number=order_number),
+                'status_stream_url': stream_url.format(order_number=order_number) if stream_url else None,
+                'status_poll_seconds': app.config.get('ORDER_STATUS_POLL_SECONDS', 5)}
+
+    @app.route('/api/orders/<order_number>/status')
+    @replica_reads
+    def order_status(order_number):
+        row = db.session.execute(
+            select(Order.status, Order.payment_status).where(Order.order_number == order_number)
+        ).first()
+        if row is not None:
+            payload = order_status_event(order_number, row.status, row.payment_status)
+        else:
+            intake = app.extensions.get('order_intake')
+            status = intake.queue.status(order_number) if intake is not None else None
+            if status is None:
+                abort(404)
+            payload = order_status_event(order_number, status, None)
+        # Polled every few seconds as the fallback to the event stream, so unchanged answers are 304s
+        response = jsonify(payload)
+        response.set_etag(hashlib.sha1(response.get_data()).hexdigest())
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    def history_request(token):
+        """(customer id, after cursor, limit) for an order history request, aborting on a bad token or cursor"""
+        customer_id = customer_from_history_token(token)
+        if customer_id is None:
+            abort(404)
+        after = None
+        if request.args.get('after'):
+            try:
+                after = decode_history_cursor(request.args['after'])
+            except ValueError:
+                abort(400)
+        limit = max(1, min(request.args.get('limit', ORDER_HISTORY_PAGE_SIZE, type=int), ORDER_HISTORY_MAX_LIMIT))
+        return customer_id, after, limit
+
+    @app.route('/orders/history/<token>')
+    @replica_reads
+    def order_history(token):
+        customer_id, after, limit = history_request(token)
+        orders, next_cursor = order_history_page(customer_id, after, limit)
+        return render_template('order_history.html', orders=orders, token=token, next_cursor=next_cursor,
+                               limit=limit, first_page=after is None)
+
+    @app.route('/api/orders/history/<token>')
+    @replica_reads
+    def api_order_history(token):
+        customer_id, after, limit = history_request(token)
+        orders, next_cursor = order_history_page(customer_id, after, limit)
+        response = jsonify({
+            'orders': [{
+                'order_number': row.order_number,
+                'created_at': row.created_at.isoformat(),
+                'status': row.status,
+                'total_amount': row.total_amount,
+                'delivery_date': row.delivery_date.isoformat(),
+                'item_count': row.item_count
+            } for row in orders],
+            'next_cursor': next_cursor
+        })
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+            response.headers['Link'] = '<{}>; rel="next"'.format(url_for(
+                'api_order_history', token=token, after=next_cursor, limit=limit
+            ))
+        return response
 
     @app.route('/api/pastries')
+    @replica_reads
+    @conditional_catalog_response
     def api_pastries():
-        pastries = Pastry.query.filter_by(available=True).all()
-        return jsonify([{
-            'id': p.id,
-            'name': p.name,
-            'description': p.description,
-            'price': p.price,
-            'image_url': p.image_url,
-            'category': p.category
-        } for p in pastries])
-
-# Create the app instance for production
-app = create_app()
+        fields = API_FIELDS
+        if request.args.get('fields'):
+            requested = [field.strip() for field in request.args['fields'].split(',') if field.strip()]
+            unknown = sorted(set(requested) - set(API_FIELDS))
+            if unknown:
+                return jsonify({'error': f"Unknown fields: {', '.join(unknown)}"}), 400
+            # The id is always returned so clients can page with ?after=
+            fields = tuple(dict.fromkeys(['id'] + requested))
+        
+        after = request.args.get('after', type=int)
+        limit = request.args.get('limit', type=int)
+        if limit is not None:
+            limit = max(1, min(limit, API_MAX_LIMIT))
+        
+        stream = request.args.get('stream')
+        if stream:
+            if stream not in ('ndjson', 'json'):
+                return jsonify({'error': 'stream must be ndjson or json'}), 400
+            mimetype = 'application/x-ndjson' if stream == 'ndjson' else 'application/json'
+            return Response(stream_with_context(stream_api_pastries(fields, after, limit, stream)),
+                            mimetype=mimetype)
+        
+        if after is None and limit is None:
+            # Unpaged requests keep the original full listing, served from the catalog cache
+            return jsonify([{field: getattr(p, field) for field in fields} for p in available_pastries()])
+        
+        limit = limit or API_MAX_LIMIT
+        rows = db.session.execute(api_pastry_query(fields, after, limit + 1)).all()
+        response = jsonify([dict(zip(fields, row)) for row in rows[:limit]])
+        if len(rows) > limit:
+            next_cursor = rows[limit - 1][0]
+            response.headers['X-Next-Cursor'] = str(next_cursor)
+            response.headers['Link'] = '<{}>; rel="next"'.format(url_for(
+                'api_pastries', after=next_cursor, limit=limit, fields=request.args.get('fields')
+            ))
+        return response
+
+    @app.route('/api/reports/sales')
+    @replica_reads
+    @require_reports_token
+    def sales_report():
+        try:
+            start, end = report_range(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        rows = {row.day: row for row in DailySales.query.filter(DailySales.day.between(start, end))}
+        days = []
+        for offset in range((end - start).days + 1):
+            day = start + timedelta(days=offset)
+            row = rows.get(day)
+            days.append({
+                'day': day.isoformat(),
+                'orders': row.orders if row else 0,
+                'units': row.units if row else 0,
+                'revenue': round(row.revenue, 2) if row else 0
+            })
+        totals = {key: sum(day[key] for day in days) for key in ('orders', 'units', 'revenue')}
+        totals['revenue'] = round(totals['revenue'], 2)
+        return jsonify({'start': start.isoformat(), 'end': end.isoformat(), 'days': days, 'totals': totals})
+
+    @app.route('/api/reports/top-pastries')
+    @replica_reads
+    @require_reports_token
+    def top_pastries_report():
+        try:
+            start, end = report_range(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        rank_by = request.args.get('by', 'units')
+        if rank_by not in ('units', 'revenue'):
+            return jsonify({'error': 'by must be units or revenue'}), 400
+        limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+        
+        units = func.sum(PastryDailySales.units).label('units')
+        revenue = func.sum(PastryDailySales.revenue).label('revenue')
+        rows = db.session.execute(
+            select(PastryDailySales.pastry_id, Pastry.name, units, revenue)
+            .join(Pastry, Pastry.id == PastryDailySales.pastry_id)
+            .where(PastryDailySales.day.between(start, end))
+            .group_by(PastryDailySales.pastry_id, Pastry.name)
+            .order_by((units if rank_by == 'units' else revenue).desc(), PastryDailySales.pastry_id)
+            .limit(limit)
+        ).all()
+        return jsonify({'start': start.isoformat(), 'end': end.isoformat(), 'pastries': [
+            {'pastry_id': row.pastry_id, 'name': row.name, 'units': row.units, 'revenue': round(row.revenue, 2)}
+            for row in rows
+        ]})
+
+    @app.route('/api/reports/categories')
+    @replica_reads
+    @require_reports_token
+    def category_report():
+        try:
+            start, end = report_range(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        revenue = func.sum(CategoryDailySales.revenue).label('revenue')
+        rows = db.session.execute(
+            select(CategoryDailySales.category, func.sum(CategoryDailySales.units).label('units'), revenue)
+            .where(CategoryDailySales.day.between(start, end))
+            .group_by(CategoryDailySales.category)
+            .order_by(revenue.desc(), CategoryDailySales.category)
+        ).all()
+        return jsonify({'start': start.isoformat(), 'end': end.isoformat(), 'categories': [
+            {'category': row.category or None, 'units': row.units, 'revenue': round(row.revenue, 2)}
+            for row in rows
+        ]})
+
+# The production app is built on first access (gunicorn's app:app, `flask --app app`, `from app import app`)
+# rather than at import, so importing models and helpers never constructs an app or touches the database
+_app = None
+_app_lock = threading.Lock()
+
+def __getattr__(name):
+    global _app
+    if name != 'app':
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                _app = create_app()
+    return _app
 
 if __name__ == '__main__':
+    app = create_app()
     debug_mode = os.getenv('FLASK_DEBUG', 'True').lower() == 'true'
     app.run(debug=debug_mode, host='0.0.0.0', port=int(os.getenv('PORT', 5000)))
\ No newline at end of file
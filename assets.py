@@ -0,0 +1,152 @@
+"""Fingerprinted, precompressed static assets.
+
+The build step copies every file under static/ (except uploads/ and its own
+output) into static/dist/ under a name carrying a hash of its contents, writes
+.gz and .br siblings for text assets, and records the mapping in
+static/dist/manifest.json:
+
+    python assets.py                         # or: flask --app app build-assets
+
+Templates link assets with asset_url('css/site.css'), which resolves the
+hashed name from the manifest (or falls back to the plain /static/ URL when no
+build has been run), so asset URLs change whenever their contents do and can be
+cached forever. /static/dist/ serves the precompressed sibling the client
+accepts straight from disk, with no compression work per request; nginx's
+gzip_static/brotli_static can serve the same files.
+
+Earlier builds' files are left in place, so pages rendered by the previous
+release keep working during a rolling deploy.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import sys
+
+import click
+from flask import abort, current_app, request, send_file, url_for
+from flask.cli import with_appcontext
+from werkzeug.security import safe_join
+
+from compression import load_brotli
+
+OUTPUT_DIR = 'dist'
+EXCLUDED_DIRS = ('uploads', OUTPUT_DIR)
+PRECOMPRESSED_EXTENSIONS = ('.css', '.js', '.mjs', '.svg', '.json', '.txt', '.html', '.xml', '.map')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def fingerprinted_name(path, data):
+    """css/site.css -> css/site.<first 12 hex digits of its sha256>.css"""
+    stem, ext = os.path.splitext(path)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
+
+def build_assets(static_folder):
+    """Fingerprint and precompress every static asset, returning the manifest written"""
+    brotli = load_brotli()
+    output = os.path.join(static_folder, OUTPUT_DIR)
+    manifest = {}
+    for directory, subdirs, files in os.walk(static_folder):
+        if directory == static_folder:
+            subdirs[:] = [subdir for subdir in subdirs if subdir not in EXCLUDED_DIRS]
+        for filename in sorted(files):
+            source = os.path.join(directory, filename)
+            logical = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+            hashed = fingerprinted_name(logical, data)
+            target = os.path.join(output, hashed)
+            manifest[logical] = hashed
+            if os.path.exists(target):
+                continue
+            _write(target, data)
+            if not logical.endswith(PRECOMPRESSED_EXTENSIONS):
+                continue
+            # Maximum effort is affordable once per build; mtime=0 keeps .gz output reproducible
+            gzipped = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(gzipped) < len(data):
+                _write(target + '.gz', gzipped)
+            if brotli is not None:
+                compressed = brotli.compress(data, quality=11)
+                if len(compressed) < len(data):
+                    _write(target + '.br', compressed)
+    _write(os.path.join(output, 'manifest.json'), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+class AssetManifest:
+    """Resolves asset_url() through the build manifest and serves built assets precompressed"""
+
+    def __init__(self):
+        self.manifest = {}
+        self.output = None
+        self._mtime = None
+
+    def init_app(self, app):
+        self.output = os.path.join(app.static_folder, OUTPUT_DIR)
+        self.reload()
+        app.extensions['asset_manifest'] = self
+        app.add_url_rule(f'{app.static_url_path}/{OUTPUT_DIR}/<path:filename>', 'asset', self.asset_view)
+        app.jinja_env.globals['asset_url'] = self.asset_url
+
+    def reload(self):
+        path = os.path.join(self.output, 'manifest.json')
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            self.manifest, self._mtime = {}, None
+            return
+        if mtime != self._mtime:
+            with open(path) as f:
+                self.manifest = json.load(f)
+            self._mtime = mtime
+
+    def asset_url(self, path):
+        if current_app.debug:
+            # Pick up rebuilds without a restart while developing
+            self.reload()
+        hashed = self.manifest.get(path)
+        if hashed is None:
+            return url_for('static', filename=path)
+        return url_for('asset', filename=hashed)
+
+    def asset_view(self, filename):
+        path = safe_join(self.output, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        encoding = None
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[candidate] and os.path.isfile(path + suffix):
+                encoding, path = candidate, path + suffix
+                break
+        # send_file hands the open file to the server's wsgi.file_wrapper (sendfile under gunicorn)
+        response = send_file(path, mimetype=mimetype)
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = IMMUTABLE
+        return response
+
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets_command():
+    """Fingerprint and precompress static assets into static/dist."""
+    manifest = build_assets(current_app.static_folder)
+    click.echo(f'Built {len(manifest)} assets into {os.path.join(current_app.static_folder, OUTPUT_DIR)}')
+
+
+if __name__ == '__main__':
+    default_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    static_folder = sys.argv[1] if len(sys.argv) > 1 else default_folder
+    print(f'Built {len(build_assets(static_folder))} assets into {os.path.join(static_folder, OUTPUT_DIR)}')
@@ -0,0 +1,176 @@
+"""EXPLAIN every query the storefront routes issue and flag sequential scans.
+
+Seeds pastries, customers, orders and order items at the requested scale,
+requests each route once with cold caches, captures the SELECTs it sends and
+runs EXPLAIN on them (EXPLAIN QUERY PLAN on SQLite, EXPLAIN (FORMAT JSON) on
+Postgres). Exits non-zero if any unexpected sequential scan remains.
+
+Usage:
+    python benchmarks/explain_queries.py --rows 100000
+    python benchmarks/explain_queries.py --rows 100000 --database-url postgresql://localhost/pastry_bench
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+
+from sqlalchemy import event, insert, text
+
+from app import create_app, db, customer_history_token, Order, OrderItem
+from benchmarks.storefront import seed
+
+# Scans that are the cheapest correct plan; reported but not failed
+ALLOWED_SCANS = {
+    ('browse', 'pastry'): 'lists the entire available catalog, once per catalog version',
+    ('index', 'pastry'): 'reads the first few available rows in primary-key order and stops at the LIMIT',
+}
+
+
+def seed_orders(app, rows, pastry_count, customer_count, seed_value=0):
+    rng = random.Random(seed_value)
+    with app.app_context():
+        db.session.execute(insert(Order.__table__), [
+            {
+                'customer_id': rng.randint(1, customer_count),
+                'total_amount': 10.0,
+                'delivery_date': date(2030, 1, 1),
+                'delivery_address': '1 Main St',
+                'delivery_city': 'Nairobi'
+            }
+            for _ in range(rows)
+        ])
+        db.session.execute(insert(OrderItem.__table__), [
+            {'order_id': i % rows + 1, 'pastry_id': rng.randint(1, pastry_count), 'quantity': 1, 'unit_price': 2.5}
+            for i in range(rows)
+        ])
+        db.session.commit()
+        return db.session.execute(text('SELECT order_number FROM "order" ORDER BY id DESC LIMIT 1')).scalar()
+
+
+def route_requests(order_number, history_token):
+    """(name, method, url, form) for every storefront route worth explaining"""
+    order_form = {
+        'name': 'Explain', 'email': 'customer1@example.com', 'phone': '555',
+        'delivery_date': '2030-01-01', 'address': '1 Main St', 'city': 'Nairobi', 'postal_code': '00100'
+    }
+    return [
+        ('index', 'get', '/', None),
+        ('browse', 'get', '/browse', None),
+        ('browse_category', 'get', '/browse?category=Tarts', None),
+        ('browse_search', 'get', '/browse?search=almond+tart', None),
+        ('pastry_detail', 'get', '/pastry/42', None),
+        ('api_page', 'get', '/api/pastries?limit=50&after=500', None),
+        ('cart', 'get', '/cart', None),
+        ('checkout', 'get', '/checkout', None),
+        ('place_order', 'post', '/place_order', order_form),
+        ('order_confirmation', 'get', f'/order/{order_number}', None),
+        ('order_history', 'get', f'/api/orders/history/{history_token}', None),
+        ('sales_report', 'get', '/api/reports/sales', None),
+        ('top_pastries_report', 'get', '/api/reports/top-pastries', None),
+        ('category_report', 'get', '/api/reports/categories', None),
+    ]
+
+
+def sqlite_scans(connection, statement, parameters):
+    plan = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+    scans = []
+    for row in plan:
+        detail = row[-1]
+        match = re.match(r'SCAN (\S+)', detail)
+        if match and match.group(1) != 'CONSTANT' and 'USING' not in detail and 'VIRTUAL TABLE' not in detail:
+            scans.append(match.group(1))
+    return scans
+
+
+def postgres_scans(connection, statement, parameters):
+    plan = connection.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + statement, parameters).scalar()
+    scans = []
+
+    def walk(node):
+        if node.get('Node Type') == 'Seq Scan':
+            scans.append(node.get('Relation Name'))
+        for child in node.get('Plans', []):
+            walk(child)
+
+    walk(plan[0]['Plan'])
+    return scans
+
+
+def find_sequential_scans(app, order_number):
+    """Return {route: [(table, statement)]} for every sequential scan found"""
+    found = {}
+    with app.app_context():
+        engine = db.engine
+        explain = postgres_scans if engine.dialect.name == 'postgresql' else sqlite_scans
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['cart'] = {'1': 2, '7': 1}
+
+        history_token = customer_history_token(1)
+        for name, method, url, form in route_requests(order_number, history_token):
+            for cache in ('catalog_cache', 'fragment_cache'):
+                app.extensions[cache].bump_version()
+
+            captured = []
+
+            def capture(conn, cursor, statement, parameters, context, executemany):
+                if statement.lstrip().upper().startswith(('SELECT', 'WITH')) and not executemany:
+                    captured.append((statement, parameters))
+
+            event.listen(engine, 'before_cursor_execute', capture)
+            try:
+                if method == 'post':
+                    client.post(url, data=form)
+                    with client.session_transaction() as sess:
+                        sess['cart'] = {'1': 2, '7': 1}
+                else:
+                    client.get(url)
+            finally:
+                event.remove(engine, 'before_cursor_execute', capture)
+
+            with engine.connect() as connection:
+                for statement, parameters in captured:
+                    for table in explain(connection, statement, parameters):
+                        found.setdefault(name, []).append((table, ' '.join(statement.split())))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000, help='rows per table')
+    parser.add_argument('--database-url', help='defaults to a throwaway SQLite file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'explain.db')}"
+        app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': database_url, 'SECRET_KEY': 'explain'})
+        customers = max(args.rows // 10, 1)
+        seed(app, args.rows, customers)
+        order_number = seed_orders(app, args.rows, args.rows, customers)
+        with app.app_context():
+            db.session.execute(text('ANALYZE'))
+            db.session.commit()
+
+        found = find_sequential_scans(app, order_number)
+        with app.app_context():
+            db.engine.dispose()
+
+    failures = 0
+    for route, scans in found.items():
+        for table, statement in scans:
+            allowed = ALLOWED_SCANS.get((route, table))
+            label = f'allowed ({allowed})' if allowed else 'SEQUENTIAL SCAN'
+            print(f'{route}: {label} on {table}: {statement}')
+            failures += not allowed
+    print(f'{failures} unexpected sequential scan(s) at {args.rows} rows')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
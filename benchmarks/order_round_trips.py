@@ -0,0 +1,106 @@
+"""Count database round trips per placed order, before and after the batched write path.
+
+Usage: python benchmarks/order_round_trips.py [--lines 1,5,20] [--database-url URL]
+
+The "before" column replays the original place_order body (customer lookup,
+flush, per-line pastry fetches, per-item adds); "after" runs the current
+price_cart/upsert_customer/write_order path.
+"""
+import argparse
+import os
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+
+from sqlalchemy import event
+
+from app import create_app, db, Pastry, Customer, Order, OrderItem, DELIVERY_FEE
+from app import order_lines, price_cart, upsert_customer, write_order
+
+ORDER_FIELDS = {
+    'delivery_date': date(2030, 1, 1),
+    'delivery_address': '1 Main St',
+    'delivery_city': 'Nairobi',
+    'delivery_postal_code': '00100',
+    'special_instructions': ''
+}
+
+
+def legacy_place_order(cart, email):
+    customer = Customer.query.filter_by(email=email).first()
+    if not customer:
+        customer = Customer(name='Bench', email=email, phone='555')
+        db.session.add(customer)
+        db.session.flush()
+
+    total = 0
+    for pastry_id, quantity in cart.items():
+        pastry = db.session.get(Pastry, int(pastry_id))
+        if pastry:
+            total += pastry.price * quantity
+    total += DELIVERY_FEE
+
+    order = Order(customer_id=customer.id, total_amount=total, **ORDER_FIELDS)
+    db.session.add(order)
+    db.session.flush()
+
+    for pastry_id, quantity in cart.items():
+        pastry = db.session.get(Pastry, int(pastry_id))
+        if pastry:
+            db.session.add(OrderItem(order_id=order.id, pastry_id=pastry.id,
+                                     quantity=quantity, unit_price=pastry.price))
+    db.session.commit()
+    return order.order_number
+
+
+def batched_place_order(cart, email):
+    priced = price_cart(cart)
+    customer_id = upsert_customer('Bench', email, '555')
+    _, order_number = write_order(customer_id, priced['total'], order_lines(priced), **ORDER_FIELDS)
+    db.session.commit()
+    return order_number
+
+
+def count_round_trips(place_order, cart, email):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    # Start from a cold identity map, as a fresh request would
+    db.session.expunge_all()
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        place_order(cart, email)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return len(statements)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', default='1,5,20,50', help='comma-separated cart sizes')
+    parser.add_argument('--database-url', default='sqlite:///:memory:')
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.lines.split(',')]
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database_url, 'SECRET_KEY': 'bench'})
+    with app.app_context():
+        db.create_all()
+        pastries = [Pastry(name=f'Bench {i}', description='', price=1.0 + i) for i in range(max(sizes))]
+        db.session.add_all(pastries)
+        db.session.commit()
+        pastry_ids = [p.id for p in pastries]
+
+        print(f"{'lines':>6} {'before':>8} {'after':>8}")
+        for size in sizes:
+            cart = {str(pastry_id): 1 for pastry_id in pastry_ids[:size]}
+            before = count_round_trips(legacy_place_order, cart, f'legacy-{size}@example.com')
+            after = count_round_trips(batched_place_order, cart, f'batched-{size}@example.com')
+            print(f'{size:>6} {before:>8} {after:>8}')
+
+
+if __name__ == '__main__':
+    main()
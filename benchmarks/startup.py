@@ -0,0 +1,150 @@
+"""Measure cold start: process launch -> import app -> create_app() -> first response.
+
+Each run is a fresh Python process, timed against a seeded throwaway database,
+in three modes:
+
+    cold       empty Jinja bytecode cache (first boot of a new release)
+    warm       bytecode cache filled by `flask compile-templates` (normal boot)
+    create_all warm cache, plus AUTO_CREATE_SCHEMA=true (what every boot used to cost)
+
+Usage:
+    python benchmarks/startup.py --runs 5
+    python benchmarks/startup.py --save-baseline benchmarks/baselines/startup-sqlite.json
+    python benchmarks/startup.py --baseline benchmarks/baselines/startup-sqlite.json
+
+With --baseline the run exits non-zero when any mode's median time to first
+response grows past --threshold times the baseline, so startup time can be
+tracked from release to release.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+
+MODES = ['cold', 'warm', 'create_all']
+PHASES = ['import_ms', 'create_app_ms', 'first_response_ms', 'total_ms']
+
+# Runs in the child process; everything it reports is measured from after interpreter start-up
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import app as module
+imported = time.perf_counter()
+application = module.app
+built = time.perf_counter()
+status = application.test_client().get('/').status_code
+answered = time.perf_counter()
+print(json.dumps({'status': status, 'import_ms': (imported - started) * 1000,
+                  'create_app_ms': (built - imported) * 1000, 'first_response_ms': (answered - built) * 1000,
+                  'total_ms': (answered - started) * 1000}))
+"""
+
+
+def seed_database(database_url):
+    from app import create_app, db
+    from benchmarks.storefront import seed
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': database_url, 'SECRET_KEY': 'startup'})
+    seed(app, 500, 50)
+    with app.app_context():
+        db.engine.dispose()
+
+
+def child_env(database_url, cache_dir, auto_create_schema=False):
+    env = dict(os.environ, DATABASE_URL=database_url, JINJA_BYTECODE_CACHE_DIR=cache_dir,
+               AUTO_CREATE_SCHEMA=str(auto_create_schema), METRICS_ENABLED='True', ORDER_INTAKE='sync')
+    env.pop('FLASK_APP', None)
+    return env
+
+
+def time_startup(env):
+    """One fresh process: the child's phase timings plus the wall time including interpreter start-up"""
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=env, capture_output=True, text=True)
+    wall = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f'startup run failed:\n{result.stderr}')
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    if timings.pop('status') != 200:
+        raise RuntimeError('first request did not return 200')
+    timings['process_ms'] = wall
+    return timings
+
+
+def run_benchmark(database_url=None, runs=5):
+    """Seed a database, time each start-up mode runs times and return the median report"""
+    samples = {mode: [] for mode in MODES}
+    with tempfile.TemporaryDirectory() as workdir:
+        database_url = database_url or f"sqlite:///{os.path.join(workdir, 'startup.db')}"
+        seed_database(database_url)
+        cache_dir = os.path.join(workdir, 'jinja-cache')
+        for _ in range(runs):
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            samples['cold'].append(time_startup(child_env(database_url, cache_dir)))
+            subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'compile-templates'], cwd=ROOT,
+                           env=child_env(database_url, cache_dir), check=True, capture_output=True)
+            samples['warm'].append(time_startup(child_env(database_url, cache_dir)))
+            samples['create_all'].append(time_startup(child_env(database_url, cache_dir, auto_create_schema=True)))
+
+    modes = {
+        mode: {phase: round(statistics.median(run[phase] for run in runs_), 1) for phase in PHASES + ['process_ms']}
+        for mode, runs_ in samples.items()
+    }
+    return {'modes': modes, 'config': {'database': database_url.split(':', 1)[0], 'runs': runs}}
+
+
+def compare(report, baseline, threshold):
+    """Return a list of human readable regressions against a baseline report"""
+    regressions = []
+    for mode, base in baseline['modes'].items():
+        current = report['modes'].get(mode)
+        if current is not None and current['total_ms'] > base['total_ms'] * threshold:
+            regressions.append(f"{mode}: {current['total_ms']}ms to first response > "
+                               f"{threshold}x baseline {base['total_ms']}ms")
+    return regressions
+
+
+def print_report(report):
+    print(f"median of {report['config']['runs']} runs ({report['config']['database']})")
+    print(f"{'mode':<12} {'import':>8} {'create':>8} {'1st req':>8} {'total':>8} {'process':>8}   (ms)")
+    for mode, stats in report['modes'].items():
+        print(f"{mode:<12} {stats['import_ms']:>8} {stats['create_app_ms']:>8} {stats['first_response_ms']:>8} "
+              f"{stats['total_ms']:>8} {stats['process_ms']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='defaults to a throwaway SQLite file')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--baseline', help='JSON baseline to compare against')
+    parser.add_argument('--threshold', type=float, default=1.5, help='allowed growth factor')
+    parser.add_argument('--save-baseline', help='write this run to a JSON baseline file')
+    args = parser.parse_args()
+
+    report = run_benchmark(args.database_url, args.runs)
+    print_report(report)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""Stress test checkout of a hot pastry and check nothing is oversold.
+
+Concurrent buyers, each with their own session and customer, repeatedly
+check out a cart holding the hot pastry (plus a second tracked pastry, so
+every order takes two lines in one statement) through POST /place_order,
+until the stock runs out. Every order goes through the whole production
+path: stock, order rows, sales rollups in the app's default SALES_ROLLUP
+mode, and the delivery slot, all on the same day and city so they share one
+slot row. The slot capacity defaults to the stock, so it is the stock that
+ends a run. The run is repeated for each stripe count. Reports orders/s,
+sold-out rejections and errors (lock timeouts, full days), and exits
+non-zero if any run sold more than was in stock or lost track of a unit.
+
+Usage:
+    python benchmarks/stock_contention.py --buyers 8 --stock 2000 --stripes 1,8
+    python benchmarks/stock_contention.py --database-url postgresql://localhost/pastry_bench
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+
+from sqlalchemy import func, insert
+
+from app import create_app, db, DeliverySlot, Pastry, PastryStock, set_stock
+
+ORDER_FORM = {
+    'name': 'Bench Buyer', 'phone': '555', 'delivery_date': '2030-01-01',
+    'address': '1 Main St', 'city': 'Nairobi', 'postal_code': '00100'
+}
+# A buyer stuck on errors alone (e.g. a full delivery day) gives up rather than spin
+MAX_CONSECUTIVE_ERRORS = 50
+
+
+def seed(app, stock, stripes):
+    """A hot pastry with the given stock and stripes, and a side pastry with plenty"""
+    with app.app_context():
+        db.create_all()
+        stmt = insert(Pastry.__table__).returning(Pastry.id, sort_by_parameter_order=True)
+        hot_id, side_id = db.session.scalars(stmt, [
+            {'name': 'Hot Croissant', 'price': 3.0, 'category': 'Croissants', 'available': True},
+            {'name': 'Side Muffin', 'price': 2.0, 'category': 'Muffins', 'available': True},
+        ]).all()
+        set_stock(hot_id, stock, stripes)
+        set_stock(side_id, stock * 10)
+        db.session.commit()
+        return hot_id, side_id
+
+
+def buyer(app, cart, max_quantity, tally, lock, seed_value):
+    """Check out until even a single unit is turned away for lack of stock"""
+    rng = random.Random(seed_value)
+    client = app.test_client()
+    form = dict(ORDER_FORM, email=f'buyer{seed_value}@example.com')
+    sold = orders = rejected = errors = consecutive_errors = 0
+    while consecutive_errors < MAX_CONSECUTIVE_ERRORS:
+        quantity = rng.randint(1, max_quantity)
+        with client.session_transaction() as sess:
+            sess['cart'] = {pastry_id: quantity for pastry_id in cart}
+            sess.pop('_flashes', None)
+        location = client.post('/place_order', data=form).location or ''
+        if '/order/' in location:
+            sold += quantity
+            orders += 1
+            consecutive_errors = 0
+        elif location.endswith('/cart'):
+            rejected += 1
+            consecutive_errors = 0
+            if quantity == 1:
+                break
+            # Fewer left than asked for; buy them one at a time from here
+            max_quantity = 1
+        else:
+            # place_order turns lock timeouts and full days into a redirect back to checkout
+            errors += 1
+            consecutive_errors += 1
+    with lock:
+        tally['sold'] += sold
+        tally['orders'] += orders
+        tally['rejected'] += rejected
+        tally['errors'] += errors
+
+
+def run_contention(database_url=None, buyers=8, stock=2000, stripes=1, max_quantity=3, slot_capacity=None):
+    """Sell out a hot pastry with concurrent buyers checking out, and return the run's stats"""
+    with tempfile.TemporaryDirectory() as workdir:
+        database_url = database_url or f"sqlite:///{os.path.join(workdir, 'stock.db')}"
+        app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': database_url,
+            'SECRET_KEY': 'benchmark',
+            'DELIVERY_SLOT_CAPACITY': slot_capacity or stock
+        })
+        hot_id, side_id = seed(app, stock, stripes)
+        cart = (str(hot_id), str(side_id))
+
+        tally = {'sold': 0, 'orders': 0, 'rejected': 0, 'errors': 0}
+        lock = threading.Lock()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=buyers) as pool:
+            for future in [pool.submit(buyer, app, cart, max_quantity, tally, lock, i) for i in range(buyers)]:
+                future.result()
+        seconds = time.perf_counter() - started
+
+        with app.app_context():
+            left = db.session.query(func.sum(PastryStock.quantity)).filter_by(pastry_id=hot_id).scalar()
+            booked = db.session.query(func.coalesce(func.sum(DeliverySlot.reserved), 0)).scalar()
+            db.drop_all()
+            db.engine.dispose()
+
+    return dict(tally, stripes=stripes, buyers=buyers, stock=stock, left=left, booked=booked,
+                oversold=max(tally['sold'] - stock, 0), lost=stock - tally['sold'] - left,
+                seconds=round(seconds, 3), orders_per_second=round(tally['orders'] / seconds, 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='defaults to a throwaway SQLite file')
+    parser.add_argument('--buyers', type=int, default=8)
+    parser.add_argument('--stock', type=int, default=2000, help='units of the hot pastry')
+    parser.add_argument('--stripes', default='1,8', help='comma-separated stripe counts to compare')
+    parser.add_argument('--max-quantity', type=int, default=3, help='largest quantity per order')
+    parser.add_argument('--slot-capacity', type=int, help='orders the shared delivery day takes; defaults to --stock')
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'stripes':>7} {'orders':>7} {'orders/s':>9} {'sold':>6} {'left':>5} {'rejected':>8} {'errors':>6}")
+    for stripes in [int(value) for value in args.stripes.split(',')]:
+        result = run_contention(args.database_url, args.buyers, args.stock, stripes, args.max_quantity,
+                                args.slot_capacity)
+        print(f"{stripes:>7} {result['orders']:>7} {result['orders_per_second']:>9} {result['sold']:>6} "
+              f"{result['left']:>5} {result['rejected']:>8} {result['errors']:>6}")
+        if result['oversold'] or result['lost']:
+            print(f"FAILED: oversold {result['oversold']}, lost {result['lost']} with {stripes} stripe(s)")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""End-to-end load test for the storefront purchase funnel.
+
+Seeds a catalog and customer base, then drives concurrent virtual users
+through / -> /browse?search= -> /add_to_cart -> /checkout -> /place_order ->
+/order/<n> against create_app(), and reports req/s, p50/p95/p99 latency and
+SQL statements per request for each step.
+
+Usage:
+    python benchmarks/storefront.py --users 8 --iterations 25
+    python benchmarks/storefront.py --save-baseline benchmarks/baselines/storefront-sqlite.json
+    python benchmarks/storefront.py --baseline benchmarks/baselines/storefront-sqlite.json
+
+With --baseline the run exits non-zero when any step's mean SQL statements
+per request grow by more than --sql-tolerance (cache warm-up makes cached
+steps vary a little between runs). Statement counts don't depend on the
+machine, so that gate holds anywhere; latencies do, so they are only
+reported next to the baseline's. To gate on latency too, save a baseline on
+the same machine with plenty of samples (e.g. --iterations 200) and pass
+--threshold. Point --database-url at a local Postgres to benchmark against it.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+
+from sqlalchemy import event, insert
+
+from app import create_app, db, Pastry, Customer
+
+STEPS = ['index', 'browse_search', 'add_to_cart', 'checkout', 'place_order', 'order_confirmation']
+FLAVOURS = ['Chocolate', 'Almond', 'Lemon', 'Raspberry', 'Cinnamon', 'Blueberry', 'Pecan', 'Vanilla', 'Maple']
+KINDS = ['Croissant', 'Muffin', 'Danish', 'Tart', 'Eclair', 'Brownie', 'Scone', 'Roll', 'Cupcake', 'Macaron']
+
+
+def seed(app, pastries, customers, seed_value=0):
+    """Bulk-insert a synthetic catalog and customer base"""
+    rng = random.Random(seed_value)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(insert(Pastry.__table__), [
+            {
+                'name': f'{rng.choice(FLAVOURS)} {rng.choice(KINDS)} {i}',
+                'description': f'Hand made {rng.choice(FLAVOURS).lower()} pastry, batch {i}',
+                'price': round(rng.uniform(1.5, 9.5), 2),
+                'category': rng.choice(KINDS) + 's',
+                'available': True
+            }
+            for i in range(pastries)
+        ])
+        db.session.execute(insert(Customer.__table__), [
+            {'name': f'Customer {i}', 'email': f'customer{i}@example.com', 'phone': '555-0100'}
+            for i in range(customers)
+        ])
+        db.session.commit()
+        return [pastry_id for (pastry_id,) in db.session.query(Pastry.id)]
+
+
+class StatementCounter:
+    """Counts SQL statements issued by the current thread"""
+
+    def __init__(self, engine):
+        self.local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.local.count = getattr(self.local, 'count', 0) + 1
+
+    def reset(self):
+        self.local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self.local, 'count', 0)
+
+
+def virtual_user(app, counter, pastry_ids, customers, iterations, user_id, samples):
+    rng = random.Random(user_id)
+    client = app.test_client()
+
+    def timed(step, method, url, **kwargs):
+        counter.reset()
+        started = time.perf_counter()
+        response = getattr(client, method)(url, **kwargs)
+        elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            raise RuntimeError(f'{step}: {method.upper()} {url} returned {response.status_code}')
+        samples.append((step, elapsed, counter.count))
+        return response
+
+    for _ in range(iterations):
+        timed('index', 'get', '/')
+        timed('browse_search', 'get', f'/browse?search={rng.choice(FLAVOURS + KINDS).lower()}')
+        for pastry_id in rng.sample(pastry_ids, rng.randint(1, 3)):
+            timed('add_to_cart', 'post', '/add_to_cart',
+                  data={'pastry_id': pastry_id, 'quantity': rng.randint(1, 4)})
+        timed('checkout', 'get', '/checkout')
+        customer = rng.randrange(customers)
+        response = timed('place_order', 'post', '/place_order', data={
+            'name': f'Customer {customer}',
+            'email': f'customer{customer}@example.com',
+            'phone': '555-0100',
+            'delivery_date': (date.today() + timedelta(days=rng.randint(1, 14))).isoformat(),
+            'address': f'{rng.randint(1, 999)} Baker Street',
+            'city': 'Nairobi',
+            'postal_code': '00100'
+        })
+        if '/order/' not in response.location:
+            raise RuntimeError(f'place_order redirected to {response.location}')
+        timed('order_confirmation', 'get', response.location)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(samples, wall_time):
+    report = {'total_requests': len(samples), 'wall_seconds': round(wall_time, 3),
+              'requests_per_second': round(len(samples) / wall_time, 1), 'steps': {}}
+    for step in STEPS:
+        latencies = [elapsed for name, elapsed, _ in samples if name == step]
+        statements = [count for name, _, count in samples if name == step]
+        if not latencies:
+            continue
+        report['steps'][step] = {
+            'requests': len(latencies),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'sql_per_request': round(sum(statements) / len(statements), 2)
+        }
+    return report
+
+
+def run_benchmark(database_url=None, users=4, iterations=10, pastries=500, customers=200):
+    """Seed a fresh database, run the funnel and return the summary report"""
+    with tempfile.TemporaryDirectory() as workdir:
+        database_url = database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': database_url,
+            'SECRET_KEY': 'benchmark'
+        })
+        pastry_ids = seed(app, pastries, customers)
+
+        with app.app_context():
+            counter = StatementCounter(db.engine)
+            samples = []
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=users) as pool:
+                futures = [pool.submit(virtual_user, app, counter, pastry_ids, customers, iterations, user, samples)
+                           for user in range(users)]
+                for future in futures:
+                    future.result()
+            wall_time = time.perf_counter() - started
+
+            db.session.remove()
+            db.engine.dispose()
+
+    report = summarize(samples, wall_time)
+    report['config'] = {'database': database_url.split(':', 1)[0], 'users': users,
+                        'iterations': iterations, 'pastries': pastries, 'customers': customers}
+    return report
+
+
+def compare(report, baseline, threshold=None, sql_tolerance=0.5):
+    """Return a list of human readable regressions against a baseline report.
+
+    p95 latency only counts when a threshold is given, for baselines saved on the same machine.
+    """
+    regressions = []
+    for step, base in baseline['steps'].items():
+        current = report['steps'].get(step)
+        if current is None:
+            continue
+        if threshold is not None and current['p95_ms'] > base['p95_ms'] * threshold:
+            regressions.append(f"{step}: p95 {current['p95_ms']}ms > {threshold}x baseline {base['p95_ms']}ms")
+        if current['sql_per_request'] > base['sql_per_request'] + sql_tolerance:
+            regressions.append(f"{step}: {current['sql_per_request']} SQL/request > baseline {base['sql_per_request']}")
+    return regressions
+
+
+def print_report(report):
+    print(f"{report['total_requests']} requests in {report['wall_seconds']}s "
+          f"({report['requests_per_second']} req/s)")
+    print(f"{'step':<20} {'reqs':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'SQL/req':>8}")
+    for step, stats in report['steps'].items():
+        print(f"{step:<20} {stats['requests']:>6} {stats['p50_ms']:>9} {stats['p95_ms']:>9} "
+              f"{stats['p99_ms']:>9} {stats['sql_per_request']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='defaults to a throwaway SQLite file')
+    parser.add_argument('--users', type=int, default=4)
+    parser.add_argument('--iterations', type=int, default=10, help='funnel passes per virtual user')
+    parser.add_argument('--pastries', type=int, default=500)
+    parser.add_argument('--customers', type=int, default=200)
+    parser.add_argument('--baseline', help='JSON baseline to compare against')
+    parser.add_argument('--threshold', type=float,
+                        help='also fail when a p95 grows past this factor (same-machine baselines only)')
+    parser.add_argument('--sql-tolerance', type=float, default=0.5, help='allowed SQL/request growth')
+    parser.add_argument('--save-baseline', help='write this run to a JSON baseline file')
+    args = parser.parse_args()
+
+    report = run_benchmark(args.database_url, args.users, args.iterations, args.pastries, args.customers)
+    print_report(report)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if args.threshold is None:
+            for step, base in baseline['steps'].items():
+                if step in report['steps']:
+                    print(f"{step}: p95 {report['steps'][step]['p95_ms']}ms (baseline {base['p95_ms']}ms, "
+                          "not gated)")
+        regressions = compare(report, baseline, args.threshold, args.sql_tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
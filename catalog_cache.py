@@ -0,0 +1,200 @@
+"""In-process catalog caches, invalidated by a catalog version shared between processes.
+
+Catalog writes mostly come from other processes than the web workers holding
+the caches (`flask load-catalog`, `flask ingest-images`, run_setup.py), so
+each cache polls a CatalogVersion at most every CATALOG_VERSION_CHECK_SECONDS
+and drops its entries when the version has moved. The version is a Redis
+counter that writers increment, or without Redis a fingerprint of the pastry
+table (row count, max id, max updated_at) read from the database. Entries also
+expire after their TTL.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogVersion:
+    """A catalog version token shared by every process, read at most every check_interval seconds.
+
+    read() returns the current token; bump(), if given, moves it after a write
+    (the database fingerprint moves by itself).
+    """
+
+    def __init__(self, read, bump=None, check_interval=5):
+        self.read = read
+        self._bump = bump
+        self.check_interval = check_interval
+        self.token = None
+        self._checked_at = float('-inf')
+        self._lock = threading.Lock()
+
+    def current(self):
+        # One caller re-reads a due token; the others use the last one rather than wait
+        if time.monotonic() - self._checked_at >= self.check_interval and self._lock.acquire(blocking=False):
+            try:
+                self.token = self.read()
+            except Exception:
+                logger.warning('Could not read the shared catalog version; caches fall back to their TTL',
+                               exc_info=True)
+            finally:
+                self._checked_at = time.monotonic()
+                self._lock.release()
+        return self.token
+
+    def bump(self):
+        if self._bump is not None:
+            self._bump()
+        # The writing process sees its own change on the next read
+        self._checked_at = float('-inf')
+
+
+def redis_catalog_version(url, key='catalog:version', check_interval=5):
+    """CatalogVersion kept as a Redis counter"""
+    import redis
+    client = redis.Redis.from_url(url)
+    return CatalogVersion(lambda: int(client.get(key) or 0), lambda: client.incr(key), check_interval)
+
+
+class CatalogCache:
+    """Bounded TTL/LRU store for read-mostly catalog data.
+
+    Entries are tagged with the local version they were loaded under, so
+    bumping it invalidates everything without walking the store. The local
+    version is bumped by writes in this process and whenever the shared
+    CatalogVersion (app.extensions['catalog_version']) is seen to move.
+    """
+
+    extension_name = 'catalog_cache'
+    config_prefix = 'CATALOG_CACHE'
+    follows_catalog_version = True
+
+    def __init__(self, maxsize=256, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.shared_version = None
+        self._shared_token = None
+
+    def init_app(self, app):
+        self.maxsize = app.config.get(f'{self.config_prefix}_SIZE', self.maxsize)
+        self.ttl = app.config.get(f'{self.config_prefix}_TTL', self.ttl)
+        if self.follows_catalog_version:
+            self.shared_version = app.extensions.get('catalog_version')
+        app.extensions[self.extension_name] = self
+
+    def bump_version(self):
+        with self._lock:
+            self.version += 1
+            self._reset()
+
+    def get_or_load(self, key, loader):
+        """Return the cached value for key, calling loader() on a miss"""
+        if self.shared_version is not None:
+            token = self.shared_version.current()
+            if token != self._shared_token:
+                with self._lock:
+                    self._shared_token = token
+                    self.version += 1
+                    self._reset()
+        now = time.monotonic()
+        with self._lock:
+            version = self.version
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        value = loader()
+
+        with self._lock:
+            # Don't store a value loaded while the catalog was changing
+            if self.version == version:
+                self._store(key, (version, now + self.ttl, value))
+                self._evict()
+        return value
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+
+    def _evict(self):
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'version': self.version,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+class FragmentCache(CatalogCache):
+    """Catalog cache for rendered template fragments, also bounded by total size"""
+
+    extension_name = 'fragment_cache'
+    config_prefix = 'FRAGMENT_CACHE'
+
+    def __init__(self, maxsize=512, ttl=300, max_bytes=8 * 1024 * 1024):
+        super().__init__(maxsize, ttl)
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+
+    def init_app(self, app):
+        super().init_app(app)
+        self.max_bytes = app.config.get('FRAGMENT_CACHE_BYTES', self.max_bytes)
+
+    def _reset(self):
+        super()._reset()
+        self.size_bytes = 0
+
+    def _store(self, key, entry):
+        previous = self._entries.get(key)
+        if previous is not None:
+            self.size_bytes -= len(previous[2])
+        super()._store(key, entry)
+        self.size_bytes += len(entry[2])
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.maxsize or self.size_bytes > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self.size_bytes -= len(entry[2])
+
+    def stats(self):
+        stats = super().stats()
+        stats['bytes'] = self.size_bytes
+        return stats
+
+
+class DeliverySlotCache(CatalogCache):
+    """Short-lived cache of delivery slot availability.
+
+    Availability is display-only, so entries simply expire; reservations always
+    check capacity in the database.
+    """
+
+    extension_name = 'delivery_slot_cache'
+    config_prefix = 'DELIVERY_SLOT_CACHE'
+    follows_catalog_version = False
+
+    def __init__(self, maxsize=64, ttl=15):
+        super().__init__(maxsize, ttl)
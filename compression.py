@@ -0,0 +1,114 @@
+"""Negotiated gzip/brotli compression for dynamic responses.
+
+Rendered HTML and JSON are compressed on the way out with whichever of
+brotli (when the brotli package is installed) or gzip the client prefers.
+Buffered bodies under COMPRESS_MIN_SIZE are left alone, since the framing
+would cost more than it saves. Streamed bodies (the NDJSON/CSV pastry export)
+are compressed chunk by chunk with a sync flush, so the client still receives
+rows as they are produced. File responses (static assets, images) are skipped:
+they are either precompressed at build time or already compressed formats.
+"""
+import zlib
+
+from flask import request
+
+COMPRESSIBLE_MIMETYPES = frozenset({
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/xml', 'text/javascript',
+    'application/json', 'application/x-ndjson', 'application/javascript', 'application/xml',
+    'image/svg+xml',
+})
+
+
+def load_brotli():
+    """The brotli module, or None when it isn't installed (gzip is then the only encoding offered)"""
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+class ResponseCompressor:
+    """after_request hook that compresses compressible responses the client will accept"""
+
+    def __init__(self, min_size=500, level=6, brotli_quality=4):
+        self.min_size = min_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.brotli = load_brotli()
+
+    def init_app(self, app):
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', self.min_size)
+        self.level = app.config.get('COMPRESS_LEVEL', self.level)
+        self.brotli_quality = app.config.get('COMPRESS_BROTLI_QUALITY', self.brotli_quality)
+        app.extensions['response_compressor'] = self
+        if app.config.get('COMPRESS_ENABLED', True):
+            app.after_request(self.after_request)
+
+    def negotiate(self, accept_encodings):
+        """'br', 'gzip' or None for an Accept-Encoding header"""
+        if self.brotli is not None and accept_encodings['br']:
+            return 'br'
+        if accept_encodings['gzip']:
+            return 'gzip'
+        return None
+
+    def after_request(self, response):
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES or response.direct_passthrough:
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self.negotiate(request.accept_encodings)
+        if encoding is None or 'Content-Encoding' in response.headers:
+            return response
+        if response.status_code < 200 or response.status_code == 204:
+            return response
+
+        if response.is_streamed:
+            original = response.response
+            response.response = self._compress_stream(response.iter_encoded(), original, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            compressed = self._compress(data, encoding)
+            if len(compressed) >= len(data):
+                return response
+            response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        self._weaken_etag(response)
+        return response
+
+    @staticmethod
+    def _weaken_etag(response):
+        # A compressed body is a different byte sequence, so a strong validator would no longer hold
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+
+    def _compress(self, data, encoding):
+        if encoding == 'br':
+            return self.brotli.compress(data, quality=self.brotli_quality)
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+
+    def _compress_stream(self, chunks, original, encoding):
+        if encoding == 'br':
+            compressor = self.brotli.Compressor(quality=self.brotli_quality)
+            process, flush, finish = compressor.process, compressor.flush, compressor.finish
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+            process = compressor.compress
+            flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+            finish = compressor.flush
+        try:
+            for chunk in chunks:
+                if chunk:
+                    data = process(chunk) + flush()
+                    if data:
+                        yield data
+            yield finish()
+        finally:
+            # The wrapped iterable may hold a request context (stream_with_context) that close() releases
+            if hasattr(original, 'close'):
+                original.close()
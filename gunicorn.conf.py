@@ -0,0 +1,72 @@
+# gunicorn.conf.py - Production WSGI server settings, all overridable from the environment
+#
+#   gunicorn -c gunicorn.conf.py app:app
+#
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', f"0.0.0.0:{os.getenv('PORT', 5000)}")
+
+# Worker model: "sync" (one request per process), "gthread" (threads per process)
+# or "gevent" (green threads; requires gevent, and psycogreen for Postgres).
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+# Every worker keeps its own pool of up to DB_POOL_SIZE + DB_MAX_OVERFLOW
+# connections per database server, so the whole server can hold workers times
+# that. DB_MAX_CONNECTIONS is this deployment's share of Postgres'
+# max_connections (100 by default, leaving room for migrations, cron jobs and
+# psql); unless the pool is sized explicitly it is split across the workers.
+db_max_connections = int(os.getenv('DB_MAX_CONNECTIONS', 80))
+if 'DB_POOL_SIZE' not in os.environ and 'DB_MAX_OVERFLOW' not in os.environ:
+    per_worker = max(db_max_connections // workers, 1)
+    os.environ['DB_POOL_SIZE'] = str(min(per_worker, 5))
+    os.environ['DB_MAX_OVERFLOW'] = str(min(per_worker - min(per_worker, 5), 10))
+db_connections_per_worker = int(os.getenv('DB_POOL_SIZE', 5)) + int(os.getenv('DB_MAX_OVERFLOW', 10))
+
+# Import the app once in the master so workers fork with it already loaded
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True').lower() == 'true'
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = os.getenv('GUNICORN_ERROR_LOG', '-')
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def when_ready(server):
+    """Warn when the workers' pools together can open more connections than DB_MAX_CONNECTIONS"""
+    if workers * db_connections_per_worker > db_max_connections:
+        server.log.warning(
+            '%d workers x %d pooled connections (DB_POOL_SIZE + DB_MAX_OVERFLOW) can exceed '
+            'DB_MAX_CONNECTIONS=%d; lower them or WEB_CONCURRENCY',
+            workers, db_connections_per_worker, db_max_connections)
+
+def post_fork(server, worker):
+    """Give each worker its own connection pool.
+
+    With preload_app the master may already hold pooled connections (to the
+    primary and any read replicas); sharing those sockets across processes
+    corrupts them, so each worker drops the inherited pools (without closing
+    the parent's connections) and opens new ones lazily.
+    """
+    if worker_class == 'gevent':
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            server.log.warning('psycogreen is not installed; Postgres calls will block the gevent loop')
+
+    from app import app, db, start_warmup
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    # Connect, fill the catalog caches and load templates while the worker starts taking requests
+    if app.config.get('WARMUP_ON_START'):
+        start_warmup(app)
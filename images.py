@@ -0,0 +1,220 @@
+"""Resized pastry image derivatives, rendered lazily and cached on disk.
+
+Pastry images are ingested once into a content-addressed store, named by the
+SHA-256 of their bytes, and referenced from Pastry.image_url as
+/images/<digest>. Derivatives at fixed widths, in WebP and JPEG, are rendered
+on first request by a small bounded thread pool and written alongside the
+originals, so every later request (from any worker process) is a plain file
+send. A URL names the exact bytes it serves, so responses are cached as
+immutable for a year.
+
+    flask --app app ingest-image 12 photos/croissant.jpg
+    flask --app app ingest-images    # every pastry whose image is a file under UPLOAD_FOLDER
+"""
+import hashlib
+import io
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from flask import abort, send_file
+
+IMAGE_WIDTHS = (160, 320, 640, 1000)
+# URL extension -> (Pillow format, mimetype)
+IMAGE_FORMATS = {'webp': ('WEBP', 'image/webp'), 'jpg': ('JPEG', 'image/jpeg')}
+URL_PREFIX = '/images/'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+DIGEST = re.compile(r'[0-9a-f]{64}')
+
+
+class ImageBusy(Exception):
+    """Too many derivatives are already waiting to be rendered"""
+
+
+def image_digest(url):
+    """The content digest of an /images/<digest> URL, or None for any other URL"""
+    if url and url.startswith(URL_PREFIX) and DIGEST.fullmatch(url[len(URL_PREFIX):]):
+        return url[len(URL_PREFIX):]
+    return None
+
+
+class ImageStore:
+    """Content-addressed originals plus derivatives rendered on demand by a bounded pool"""
+
+    def __init__(self, root='static/uploads/images', widths=IMAGE_WIDTHS, quality=80, workers=2,
+                 max_pending=32, timeout=10):
+        self.root = root
+        self.widths = tuple(widths)
+        self.quality = quality
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.rendered = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def init_app(self, app):
+        root = app.config.get('IMAGE_STORE_DIR') or os.path.join(app.config.get('UPLOAD_FOLDER', 'static/uploads'),
+                                                                 'images')
+        self.root = os.path.join(app.root_path, root)
+        self.widths = tuple(app.config.get('IMAGE_WIDTHS', self.widths))
+        self.quality = app.config.get('IMAGE_QUALITY', self.quality)
+        self.workers = app.config.get('IMAGE_WORKERS', self.workers)
+        self.max_pending = app.config.get('IMAGE_MAX_PENDING', self.max_pending)
+        app.extensions['image_store'] = self
+        app.add_url_rule(URL_PREFIX + '<digest>', 'image_original', self.original_view)
+        app.add_url_rule(URL_PREFIX + '<digest>/<int:width>.<fmt>', 'image_derivative', self.derivative_view)
+        app.jinja_env.globals['image_sources'] = self.sources
+
+    def original_path(self, digest):
+        return os.path.join(self.root, 'originals', digest[:2], digest)
+
+    def derivative_path(self, digest, width, fmt):
+        return os.path.join(self.root, 'derived', digest[:2], f'{digest}-{width}.{fmt}')
+
+    def ingest(self, data):
+        """Add image bytes to the store, returning their /images/<digest> URL"""
+        from PIL import Image
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image.verify()
+        except Exception as e:
+            # Pillow raises a grab bag of exception types for corrupt or unsupported files
+            raise ValueError(f'not a readable image ({e})') from None
+        digest = hashlib.sha256(data).hexdigest()
+        if not os.path.exists(self.original_path(digest)):
+            _write_atomic(self.original_path(digest), data)
+        return URL_PREFIX + digest
+
+    def sources(self, url):
+        """{'src', 'webp', 'jpg'} src and srcset strings for a stored image URL, or None for any other URL"""
+        digest = image_digest(url)
+        if digest is None:
+            return None
+        srcsets = {fmt: ', '.join(f'{URL_PREFIX}{digest}/{width}.{fmt} {width}w' for width in self.widths)
+                   for fmt in IMAGE_FORMATS}
+        default_width = self.widths[len(self.widths) // 2]
+        return dict(srcsets, src=f'{URL_PREFIX}{digest}/{default_width}.jpg')
+
+    @property
+    def executor(self):
+        # Threads don't survive a fork, so each worker process starts its own pool
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='image-render')
+                    self._pending = {}
+                    self._pid = os.getpid()
+        return self._executor
+
+    def derivative(self, digest, width, fmt):
+        """Path of a rendered derivative, rendering it first if needed.
+
+        Concurrent requests for the same derivative share one render. Raises
+        ImageBusy rather than queueing without bound when the pool is behind.
+        """
+        path = self.derivative_path(digest, width, fmt)
+        if os.path.exists(path):
+            return path
+        executor = self.executor
+        key = (digest, width, fmt)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                if len(self._pending) >= self.max_pending:
+                    raise ImageBusy()
+                future = self._pending[key] = executor.submit(self._render, digest, width, fmt)
+        future.add_done_callback(lambda _: self._forget(key))
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            raise ImageBusy() from None
+
+    def _forget(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def _render(self, digest, width, fmt):
+        from PIL import Image, ImageOps
+        path = self.derivative_path(digest, width, fmt)
+        if os.path.exists(path):
+            # Another process rendered it first
+            return path
+        pillow_format = IMAGE_FORMATS[fmt][0]
+        with Image.open(self.original_path(digest)) as image:
+            # Let the JPEG decoder downscale while decoding; both sides stay >= width, so either orientation is safe
+            image.draft(image.mode, (width, width))
+            image = ImageOps.exif_transpose(image)
+            if image.width > width:
+                image = image.resize((width, max(1, round(image.height * width / image.width))),
+                                     Image.Resampling.LANCZOS)
+            has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+            if pillow_format == 'JPEG' and has_alpha:
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            elif image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if has_alpha else 'RGB')
+            buffer = io.BytesIO()
+            if pillow_format == 'JPEG':
+                image.save(buffer, 'JPEG', quality=self.quality, optimize=True, progressive=True)
+            else:
+                image.save(buffer, 'WEBP', quality=self.quality, method=4)
+        _write_atomic(path, buffer.getvalue())
+        self.rendered += 1
+        return path
+
+    def original_view(self, digest):
+        path = self.original_path(digest)
+        if not DIGEST.fullmatch(digest) or not os.path.exists(path):
+            abort(404)
+        return _immutable(send_file(path, mimetype=_sniff_mimetype(path), etag=digest))
+
+    def derivative_view(self, digest, width, fmt):
+        if not DIGEST.fullmatch(digest) or width not in self.widths or fmt not in IMAGE_FORMATS:
+            abort(404)
+        if not os.path.exists(self.original_path(digest)):
+            abort(404)
+        try:
+            path = self.derivative(digest, width, fmt)
+        except ImageBusy:
+            abort(503, headers={'Retry-After': '1'})
+        return _immutable(send_file(path, mimetype=IMAGE_FORMATS[fmt][1], etag=f'{digest}-{width}-{fmt}'))
+
+
+def _immutable(response):
+    response.headers['Cache-Control'] = IMMUTABLE
+    return response
+
+
+def _sniff_mimetype(path):
+    with open(path, 'rb') as f:
+        head = f.read(12)
+    if head.startswith(b'\xff\xd8'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG'):
+        return 'image/png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    return 'application/octet-stream'
+
+
+def _write_atomic(path, data):
+    """Write a file via a temporary name and rename, so readers never see a partial file"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
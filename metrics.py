@@ -0,0 +1,264 @@
+"""Per-request instrumentation and a Prometheus-format /metrics endpoint.
+
+Records route latency, SQL statement count and time per request, connection
+pool checkout wait and template render time. Metrics are per process; under
+gunicorn scrape each worker or aggregate with a sidecar.
+
+/metrics answers 404 unless METRICS_ENABLED is set, and with METRICS_TOKEN
+set it also requires 'Authorization: Bearer <METRICS_TOKEN>'. Responses carry
+a Server-Timing header (app and SQL time) only in debug mode.
+
+An opt-in sampling profiler runs cProfile on a fraction of requests and dumps
+the stats for any that exceed a latency threshold, ready for snakeviz,
+flameprof or gprof2dot.
+"""
+import cProfile
+import hmac
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+
+from flask import Response, abort, before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                     for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += 1
+            series[2] += value
+
+    def count(self, *label_values):
+        series = self._series.get(label_values)
+        return series[1] if series else 0
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        label_names = self.labels + ('le',)
+        with self._lock:
+            for label_values, (bucket_counts, count, total) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    labels = _format_labels(label_names, label_values + (bound,))
+                    lines.append(f'{self.name}_bucket{labels} {bucket_count}')
+                labels = _format_labels(label_names, label_values + ('+Inf',))
+                lines.append(f'{self.name}_bucket{labels} {count}')
+                labels = _format_labels(self.labels, label_values)
+                lines.append(f'{self.name}_count{labels} {count}')
+                lines.append(f'{self.name}_sum{labels} {total}')
+        return lines
+
+
+class RequestMetrics:
+    """Flask extension wiring request hooks, SQLAlchemy events and template signals to metrics"""
+
+    def __init__(self):
+        self.request_latency = Histogram(
+            'http_request_duration_seconds', 'Request latency by route.', ('endpoint', 'method', 'status'))
+        self.request_sql_statements = Histogram(
+            'http_request_sql_statements', 'SQL statements issued per request.', ('endpoint',), COUNT_BUCKETS)
+        self.request_sql_seconds = Histogram(
+            'http_request_sql_duration_seconds', 'Time spent in SQL per request.', ('endpoint',))
+        self.sql_statements = Counter('sql_statements_total', 'SQL statements executed.')
+        self.pool_checkout_wait = Histogram(
+            'db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled connection.')
+        self.template_render = Histogram(
+            'template_render_duration_seconds', 'Template render time.', ('template',))
+        self.profiles_dumped = Counter('profiler_dumps_total', 'Slow request profiles written.', ('endpoint',))
+        self._local = threading.local()
+        self.app = None
+
+    def init_app(self, app, engine):
+        self.app = app
+        app.extensions['request_metrics'] = self
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        self.instrument_engine(engine)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    def instrument_engine(self, engine):
+        """Count and time statements and pool checkouts on an engine (the primary, or a read replica)"""
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+        self._time_pool_checkouts(engine)
+
+    def _time_pool_checkouts(self, engine):
+        # The pool has no "checkout requested" event, so wrap the engine's
+        # raw_connection(), which every Connection uses to borrow from the pool
+        raw_connection = engine.raw_connection
+
+        def timed_raw_connection(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return raw_connection(*args, **kwargs)
+            finally:
+                self.pool_checkout_wait.observe(time.perf_counter() - started)
+
+        engine.raw_connection = timed_raw_connection
+
+    # Request lifecycle
+
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.sql_statements = 0
+        g.sql_seconds = 0.0
+
+        config = self.app.config
+        g.profiler = None
+        if config.get('PROFILE_SLOW_REQUESTS_MS') and random.random() < config.get('PROFILE_SAMPLE_RATE', 0.01):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    def _after_request(self, response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+
+        endpoint = request.endpoint or 'unmatched'
+        self.request_latency.observe(elapsed, endpoint, request.method, str(response.status_code))
+        self.request_sql_statements.observe(g.sql_statements, endpoint)
+        self.request_sql_seconds.observe(g.sql_seconds, endpoint)
+        # Timings help an attacker probe for slow paths, so only expose them while debugging
+        if self.app.debug:
+            response.headers['Server-Timing'] = (
+                f'app;dur={elapsed * 1000:.1f}, sql;dur={g.sql_seconds * 1000:.1f};'
+                f'desc="{g.sql_statements} statements"'
+            )
+
+        threshold = self.app.config.get('PROFILE_SLOW_REQUESTS_MS')
+        if profiler is not None and elapsed * 1000 >= threshold:
+            self._dump_profile(profiler, endpoint)
+        return response
+
+    def _dump_profile(self, profiler, endpoint):
+        directory = self.app.config.get('PROFILE_DIR', 'logs/profiles')
+        os.makedirs(directory, exist_ok=True)
+        filename = f'{time.strftime("%Y%m%d-%H%M%S")}-{endpoint}-{os.getpid()}-{random.randrange(1 << 16):04x}.prof'
+        profiler.dump_stats(os.path.join(directory, filename))
+        self.profiles_dumped.inc(endpoint)
+
+    # SQLAlchemy engine events
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        self.sql_statements.inc()
+        if has_request_context() and 'sql_statements' in g:
+            g.sql_statements += 1
+            g.sql_seconds += elapsed
+
+    def _handle_error(self, exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get('query_started'):
+            connection.info['query_started'].pop()
+
+    # Template signals
+
+    def _before_render(self, sender, template, context, **extra):
+        self._local.__dict__.setdefault('render_started', []).append(time.perf_counter())
+
+    def _after_render(self, sender, template, context, **extra):
+        stack = getattr(self._local, 'render_started', None)
+        if stack:
+            self.template_render.observe(time.perf_counter() - stack.pop(), template.name or 'string')
+
+    # Exposition
+
+    def metrics_view(self):
+        config = self.app.config
+        if not config.get('METRICS_ENABLED', False):
+            abort(404)
+        token = config.get('METRICS_TOKEN')
+        if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return Response('A valid metrics token is required\n', 401, mimetype='text/plain')
+
+        lines = []
+        for metric in (self.request_latency, self.request_sql_statements, self.request_sql_seconds,
+                       self.sql_statements, self.pool_checkout_wait, self.template_render, self.profiles_dumped):
+            lines.extend(metric.expose())
+
+        for name in ('catalog_cache', 'fragment_cache', 'delivery_slot_cache'):
+            cache = self.app.extensions.get(name)
+            if cache is None:
+                continue
+            stats = cache.stats()
+            for key in ('hits', 'misses'):
+                lines.append(f'# TYPE {name}_{key}_total counter')
+                lines.append(f'{name}_{key}_total {stats[key]}')
+            lines.append(f'# TYPE {name}_entries gauge')
+            lines.append(f"{name}_entries {stats['size']}")
+
+        router = self.app.extensions.get('replica_router')
+        if router is not None and router.replicas:
+            stats = router.stats()
+            lines.append('# TYPE db_replica_fallbacks_total counter')
+            lines.append(f"db_replica_fallbacks_total {stats['fallbacks']}")
+            for key, name, kind in (('healthy', 'db_replica_healthy', 'gauge'),
+                                    ('lag', 'db_replica_lag_seconds', 'gauge'),
+                                    ('reads', 'db_replica_reads_total', 'counter')):
+                lines.append(f'# TYPE {name} {kind}')
+                for replica in stats['replicas']:
+                    value = replica[key]
+                    if value is not None:
+                        lines.append(f"{name}{_format_labels(('replica',), (replica['name'],))} {float(value)}")
+
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,75 @@
+"""pastry search indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 03:10:42.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute("""
+            ALTER TABLE pastry ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+                setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+                setweight(to_tsvector('english', coalesce(category, '')), 'B') ||
+                setweight(to_tsvector('english', coalesce(description, '')), 'C')
+            ) STORED
+        """)
+        op.execute("CREATE INDEX IF NOT EXISTS ix_pastry_search_vector ON pastry USING GIN (search_vector)")
+        op.execute("CREATE INDEX IF NOT EXISTS ix_pastry_name_trgm ON pastry USING GIN (name gin_trgm_ops)")
+    elif dialect == 'sqlite':
+        op.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS pastry_fts USING fts5(
+                name, description, category,
+                content='pastry', content_rowid='id', prefix='2 3',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+        op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS pastry_fts_vocab USING fts5vocab(pastry_fts, 'row')")
+        op.execute("""
+            CREATE TRIGGER IF NOT EXISTS pastry_fts_ai AFTER INSERT ON pastry BEGIN
+                INSERT INTO pastry_fts(rowid, name, description, category)
+                VALUES (new.id, new.name, new.description, new.category);
+            END
+        """)
+        op.execute("""
+            CREATE TRIGGER IF NOT EXISTS pastry_fts_ad AFTER DELETE ON pastry BEGIN
+                INSERT INTO pastry_fts(pastry_fts, rowid, name, description, category)
+                VALUES ('delete', old.id, old.name, old.description, old.category);
+            END
+        """)
+        op.execute("""
+            CREATE TRIGGER IF NOT EXISTS pastry_fts_au AFTER UPDATE ON pastry BEGIN
+                INSERT INTO pastry_fts(pastry_fts, rowid, name, description, category)
+                VALUES ('delete', old.id, old.name, old.description, old.category);
+                INSERT INTO pastry_fts(rowid, name, description, category)
+                VALUES (new.id, new.name, new.description, new.category);
+            END
+        """)
+        op.execute("INSERT INTO pastry_fts(pastry_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_pastry_name_trgm")
+        op.execute("DROP INDEX IF EXISTS ix_pastry_search_vector")
+        op.execute("ALTER TABLE pastry DROP COLUMN IF EXISTS search_vector")
+    elif dialect == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS pastry_fts_au")
+        op.execute("DROP TRIGGER IF EXISTS pastry_fts_ad")
+        op.execute("DROP TRIGGER IF EXISTS pastry_fts_ai")
+        op.execute("DROP TABLE IF EXISTS pastry_fts_vocab")
+        op.execute("DROP TABLE IF EXISTS pastry_fts")
@@ -0,0 +1,28 @@
+"""pastry updated_at
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 03:31:09.540217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('pastry', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+    op.execute("UPDATE pastry SET updated_at = created_at")
+
+
+def downgrade():
+    with op.batch_alter_table('pastry', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
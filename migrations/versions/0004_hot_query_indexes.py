@@ -0,0 +1,43 @@
+"""hot query indexes
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 04:12:55.306871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    # name, table, columns, partial on available (predicate matches filter(Pastry.available))
+    ('ix_pastry_available_id', 'pastry', ['id'], True),
+    ('ix_pastry_available_category_id', 'pastry', ['category', 'id'], True),
+    ('ix_pastry_category', 'pastry', ['category'], False),
+    ('ix_pastry_updated_at', 'pastry', ['updated_at'], False),
+    ('ix_order_customer_id', 'order', ['customer_id'], False),
+    ('ix_order_item_order_id', 'order_item', ['order_id'], False),
+    ('ix_order_item_pastry_id', 'order_item', ['pastry_id'], False),
+]
+
+
+def upgrade():
+    postgres = op.get_bind().dialect.name == 'postgresql'
+    # Build the Postgres indexes without blocking writes to live tables
+    with op.get_context().autocommit_block():
+        for name, table, columns, partial in INDEXES:
+            op.create_index(name, table, columns, unique=False, if_not_exists=True,
+                            postgresql_where=sa.text('available') if partial else None,
+                            sqlite_where=sa.text('available = 1') if partial else None,
+                            postgresql_concurrently=postgres)
+
+
+def downgrade():
+    for name, table, columns, partial in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
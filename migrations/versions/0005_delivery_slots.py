@@ -0,0 +1,41 @@
+"""delivery slots
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 09:12:44.318207
+
+"""
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('delivery_slot',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('delivery_date', sa.Date(), nullable=False),
+    sa.Column('city', sa.String(length=100), nullable=False),
+    sa.Column('capacity', sa.Integer(), nullable=False),
+    sa.Column('reserved', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('city', 'delivery_date', name='uq_delivery_slot_city_date')
+    )
+
+    # Seed the shared per-day counters with the orders already booked for upcoming days
+    op.execute(sa.text(
+        'INSERT INTO delivery_slot (delivery_date, city, capacity, reserved) '
+        "SELECT delivery_date, '', :capacity, count(*) FROM \"order\" "
+        'WHERE delivery_date > CURRENT_DATE GROUP BY delivery_date'
+    ).bindparams(capacity=int(os.getenv('DELIVERY_SLOT_CAPACITY', 50))))
+
+
+def downgrade():
+    op.drop_table('delivery_slot')
@@ -0,0 +1,66 @@
+"""pastry sku
+
+On SQLite the unique constraint makes batch mode rebuild the pastry table,
+which drops the FTS5 sync triggers from 0002, so they are recreated (and the
+index rebuilt) afterwards.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 10:02:17.904126
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+# The 0002 triggers, which a batch rebuild of pastry drops with the old table
+SQLITE_FTS_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS pastry_fts_ai AFTER INSERT ON pastry BEGIN
+        INSERT INTO pastry_fts(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS pastry_fts_ad AFTER DELETE ON pastry BEGIN
+        INSERT INTO pastry_fts(pastry_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS pastry_fts_au AFTER UPDATE ON pastry BEGIN
+        INSERT INTO pastry_fts(pastry_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+        INSERT INTO pastry_fts(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END
+    """,
+]
+
+
+def restore_fts_triggers():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for statement in SQLITE_FTS_TRIGGERS:
+        op.execute(statement)
+    op.execute("INSERT INTO pastry_fts(pastry_fts) VALUES ('rebuild')")
+
+
+def upgrade():
+    with op.batch_alter_table('pastry', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('sku', sa.String(length=64), nullable=True))
+        batch_op.create_unique_constraint('uq_pastry_sku', ['sku'])
+    restore_fts_triggers()
+
+
+def downgrade():
+    with op.batch_alter_table('pastry', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_pastry_sku', type_='unique')
+        batch_op.drop_column('sku')
+    restore_fts_triggers()
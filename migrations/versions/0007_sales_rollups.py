@@ -0,0 +1,59 @@
+"""sales rollups
+
+Existing orders start out uncounted; run `flask --app app rollup-sales`
+after upgrading to backfill the rollups.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 11:26:53.117402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('daily_sales',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('orders', sa.Integer(), nullable=False),
+    sa.Column('units', sa.Integer(), nullable=False),
+    sa.Column('revenue', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('day')
+    )
+    op.create_table('pastry_daily_sales',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('pastry_id', sa.Integer(), nullable=False),
+    sa.Column('units', sa.Integer(), nullable=False),
+    sa.Column('revenue', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['pastry_id'], ['pastry.id'], ),
+    sa.PrimaryKeyConstraint('day', 'pastry_id')
+    )
+    op.create_table('category_daily_sales',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('category', sa.String(length=50), nullable=False),
+    sa.Column('units', sa.Integer(), nullable=False),
+    sa.Column('revenue', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'category')
+    )
+
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('sales_rolled_up', sa.Boolean(), nullable=False, server_default=sa.false()))
+    op.create_index('ix_order_not_rolled_up', 'order', ['id'],
+                    postgresql_where=sa.text('NOT sales_rolled_up'), sqlite_where=sa.text('sales_rolled_up = 0'))
+
+
+def downgrade():
+    op.drop_index('ix_order_not_rolled_up', table_name='order')
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.drop_column('sales_rolled_up')
+
+    op.drop_table('category_daily_sales')
+    op.drop_table('pastry_daily_sales')
+    op.drop_table('daily_sales')
@@ -0,0 +1,40 @@
+"""order history index
+
+Replaces the plain order.customer_id index with a (customer_id, created_at,
+id) index that also serves keyset-paginated order history; on Postgres it
+includes the summary columns so history pages are index-only scans.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 12:40:05.662931
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    postgres = op.get_bind().dialect.name == 'postgresql'
+    with op.get_context().autocommit_block():
+        op.create_index('ix_order_customer_history', 'order', ['customer_id', 'created_at', 'id'],
+                        if_not_exists=True,
+                        postgresql_include=['order_number', 'status', 'total_amount', 'delivery_date'],
+                        postgresql_concurrently=postgres)
+        op.drop_index('ix_order_customer_id', table_name='order', if_exists=True,
+                      postgresql_concurrently=postgres)
+
+
+def downgrade():
+    postgres = op.get_bind().dialect.name == 'postgresql'
+    with op.get_context().autocommit_block():
+        op.create_index('ix_order_customer_id', 'order', ['customer_id'], if_not_exists=True,
+                        postgresql_concurrently=postgres)
+        op.drop_index('ix_order_customer_history', table_name='order', if_exists=True,
+                      postgresql_concurrently=postgres)
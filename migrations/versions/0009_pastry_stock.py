@@ -0,0 +1,35 @@
+"""pastry stock
+
+Stock levels live in their own table rather than on pastry, so taking stock
+at checkout doesn't rewrite catalog rows (or their search index entries and
+updated_at). Existing pastries get no rows and so stay untracked.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18 13:21:37.104825
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('pastry_stock',
+    sa.Column('pastry_id', sa.Integer(), nullable=False),
+    sa.Column('stripe', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.CheckConstraint('quantity >= 0', name='ck_pastry_stock_quantity'),
+    sa.ForeignKeyConstraint(['pastry_id'], ['pastry.id'], ),
+    sa.PrimaryKeyConstraint('pastry_id', 'stripe')
+    )
+
+
+def downgrade():
+    op.drop_table('pastry_stock')
@@ -0,0 +1,55 @@
+"""restore pastry fts triggers
+
+Databases upgraded through 0006 before it recreated the FTS5 sync triggers
+lost them to its SQLite table rebuild, leaving search blind to every pastry
+written since. Recreate them and rebuild the index; a no-op elsewhere.
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18 16:40:12.518307
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+SQLITE_FTS_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS pastry_fts_ai AFTER INSERT ON pastry BEGIN
+        INSERT INTO pastry_fts(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS pastry_fts_ad AFTER DELETE ON pastry BEGIN
+        INSERT INTO pastry_fts(pastry_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS pastry_fts_au AFTER UPDATE ON pastry BEGIN
+        INSERT INTO pastry_fts(pastry_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+        INSERT INTO pastry_fts(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END
+    """,
+]
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for statement in SQLITE_FTS_TRIGGERS:
+        op.execute(statement)
+    op.execute("INSERT INTO pastry_fts(pastry_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    # The triggers belong to 0002; nothing to undo
+    pass
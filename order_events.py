@@ -0,0 +1,293 @@
+"""Order status events, pushed to customers over Server-Sent Events.
+
+When an order's status or payment status changes, the web app publishes the
+new state to a broker once the change commits. A separate, lightweight ASGI
+app streams each order's events to the browsers waiting on its confirmation
+page. An idle subscriber is one coroutine and a queue rather than a WSGI
+thread, so one process can hold thousands of open streams:
+
+    uvicorn --factory order_events:create_stream_app --port 5001
+
+with the proxy sending /order/<order_number>/events there, and
+ORDER_EVENTS_STREAM_URL=/order/{order_number}/events set for the web app.
+Browsers without a stream (or when none is configured) poll the compact
+/api/orders/<order_number>/status endpoint instead.
+
+Brokers: RedisEventBroker (pub/sub, shared by every process; the stream app
+holds one pattern subscription and fans events out locally) and
+MemoryEventBroker, an in-process stand-in for tests and single-process runs.
+Both keep each order's latest event, which a new subscriber receives first,
+so a status change between page render and stream connect isn't missed.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = 'order-events:'
+STREAM_PATH = re.compile(r'/order/([A-Za-z0-9-]{1,64})/events')
+
+
+class _Subscription:
+    """One stream's queue of events for an order"""
+
+    def __init__(self, broker, order_number):
+        self.broker = broker
+        self.order_number = order_number
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    async def get(self, timeout):
+        """The next event, or None if none arrives within timeout seconds"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker._unsubscribe(self)
+
+
+class _FanOut:
+    """Local registry of subscriptions by order number, shared by both brokers"""
+
+    def __init__(self):
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+
+    def _subscribe(self, order_number):
+        subscription = _Subscription(self, order_number)
+        with self._lock:
+            self._subscriptions.setdefault(order_number, set()).add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.order_number)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.order_number]
+
+    def _dispatch(self, order_number, event):
+        # Publishers may be WSGI threads; each subscription's queue belongs to its event loop
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(order_number, ()))
+        for subscription in subscriptions:
+            subscription.loop.call_soon_threadsafe(subscription.queue.put_nowait, event)
+
+    @property
+    def subscribers(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+
+class MemoryEventBroker(_FanOut):
+    """In-process broker for tests and single-process local runs"""
+
+    def __init__(self, max_orders=10000):
+        super().__init__()
+        self.max_orders = max_orders
+        self._latest = OrderedDict()
+
+    def publish(self, order_number, event):
+        with self._lock:
+            self._latest[order_number] = event
+            self._latest.move_to_end(order_number)
+            while len(self._latest) > self.max_orders:
+                self._latest.popitem(last=False)
+        self._dispatch(order_number, event)
+
+    def latest(self, order_number):
+        with self._lock:
+            return self._latest.get(order_number)
+
+    async def subscribe(self, order_number):
+        """A subscription whose queue starts with the order's latest event, if any"""
+        subscription = self._subscribe(order_number)
+        latest = self.latest(order_number)
+        if latest is not None:
+            subscription.queue.put_nowait(latest)
+        return subscription
+
+    async def aclose(self):
+        pass
+
+
+class RedisEventBroker(_FanOut):
+    """Redis pub/sub broker shared by every web and stream process"""
+
+    def __init__(self, url, prefix=CHANNEL_PREFIX, latest_ttl=86400):
+        super().__init__()
+        import redis
+        self.url = url
+        self.prefix = prefix
+        self.latest_ttl = latest_ttl
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self._async_redis = None
+        self._reader = None
+
+    def publish(self, order_number, event):
+        message = json.dumps(event, separators=(',', ':'))
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.set(f'{self.prefix}latest:{order_number}', message, ex=self.latest_ttl)
+        pipe.publish(f'{self.prefix}{order_number}', message)
+        pipe.execute()
+
+    async def subscribe(self, order_number):
+        if self._reader is None or self._reader.done():
+            import redis.asyncio
+            self._async_redis = redis.asyncio.Redis.from_url(self.url, decode_responses=True)
+            self._reader = asyncio.ensure_future(self._read())
+        subscription = self._subscribe(order_number)
+        try:
+            latest = await self._async_redis.get(f'{self.prefix}latest:{order_number}')
+        except BaseException:
+            # The caller never gets this subscription, so it can't close it
+            subscription.close()
+            raise
+        if latest is not None:
+            subscription.queue.put_nowait(json.loads(latest))
+        return subscription
+
+    async def _read(self):
+        # One pattern subscription per process, however many streams are open
+        while True:
+            pubsub = self._async_redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.psubscribe(f'{self.prefix}*')
+                async for message in pubsub.listen():
+                    if message['type'] == 'pmessage':
+                        self._dispatch(message['channel'][len(self.prefix):], json.loads(message['data']))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Order event subscription lost; reconnecting')
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    async def aclose(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        if self._async_redis is not None:
+            await self._async_redis.aclose()
+
+
+def create_event_broker(app):
+    """Build the configured order event broker"""
+    backend = app.config.get('ORDER_EVENTS_BACKEND', 'memory')
+    if backend == 'memory':
+        return MemoryEventBroker()
+    if backend == 'redis':
+        return RedisEventBroker(app.config['REDIS_URL'], latest_ttl=app.config.get('ORDER_EVENTS_TTL', 86400))
+    raise ValueError(f'Unknown ORDER_EVENTS_BACKEND: {backend}')
+
+
+def format_event(event):
+    return f"event: status\ndata: {json.dumps(event, separators=(',', ':'))}\n\n".encode()
+
+
+class OrderEventStream:
+    """ASGI app serving GET /order/<order_number>/events as a text/event-stream"""
+
+    def __init__(self, broker, heartbeat=15, retry_ms=3000, max_connections=10000, allow_origin=None):
+        self.broker = broker
+        # Set when pages are served from another origin than the stream (e.g. separate ports in development)
+        self.allow_origin = allow_origin
+        self.heartbeat = heartbeat
+        self.retry_ms = retry_ms
+        self.max_connections = max_connections
+        self.connections = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        match = STREAM_PATH.fullmatch(scope['path'])
+        if match is None:
+            await _plain(send, 404, b'Not Found')
+            return
+        if scope['method'] != 'GET':
+            await _plain(send, 405, b'Method Not Allowed', [(b'allow', b'GET')])
+            return
+        if self.connections >= self.max_connections:
+            await _plain(send, 503, b'Too many open streams', [(b'retry-after', b'5')])
+            return
+
+        subscription = disconnected = None
+        try:
+            self.connections += 1
+            subscription = await self.broker.subscribe(match.group(1))
+            disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+            headers = [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                # Keep nginx from buffering the stream
+                (b'x-accel-buffering', b'no'),
+            ]
+            if self.allow_origin:
+                headers.append((b'access-control-allow-origin', self.allow_origin.encode()))
+            await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+            retry = f'retry: {self.retry_ms}\n\n'.encode()
+            await send({'type': 'http.response.body', 'body': retry, 'more_body': True})
+            while True:
+                next_event = asyncio.ensure_future(subscription.get(self.heartbeat))
+                await asyncio.wait({next_event, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    next_event.cancel()
+                    break
+                event = next_event.result()
+                # A comment line every heartbeat keeps proxies from timing out an idle stream
+                body = format_event(event) if event is not None else b': keepalive\n\n'
+                await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        finally:
+            # Subscribing may have failed (e.g. Redis unreachable); only undo what was set up
+            if disconnected is not None:
+                disconnected.cancel()
+            if subscription is not None:
+                subscription.close()
+            self.connections -= 1
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.broker.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _plain(send, status, body, headers=()):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/plain')] + list(headers)})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def create_stream_app():
+    """The event stream app configured from the environment, for `uvicorn --factory`"""
+    backend = os.getenv('ORDER_EVENTS_BACKEND') or ('redis' if os.getenv('REDIS_URL') else 'memory')
+    if backend == 'redis':
+        broker = RedisEventBroker(os.environ['REDIS_URL'], latest_ttl=int(os.getenv('ORDER_EVENTS_TTL', 86400)))
+    elif backend == 'memory':
+        logger.warning('ORDER_EVENTS_BACKEND=memory only sees events published in this process')
+        broker = MemoryEventBroker()
+    else:
+        raise ValueError(f'Unknown ORDER_EVENTS_BACKEND: {backend}')
+    return OrderEventStream(broker, heartbeat=float(os.getenv('ORDER_EVENTS_HEARTBEAT', 15)),
+                            max_connections=int(os.getenv('ORDER_EVENTS_MAX_CONNECTIONS', 10000)),
+                            allow_origin=os.getenv('ORDER_EVENTS_ALLOW_ORIGIN'))
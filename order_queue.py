@@ -0,0 +1,337 @@
+"""Durable order intake queue drained by background workers.
+
+In queued intake mode place_order validates and prices the cart, appends the
+order to a durable queue under its pre-assigned order number and redirects
+straight away. Worker threads claim batches of orders under a lease and write
+each batch to the database in a single transaction.
+
+Delivery is at-least-once (a worker that dies mid-batch leaves its lease to
+expire and the orders are claimed again); the order number doubles as an
+idempotency key, so replayed orders are recognised and never written twice.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteOrderQueue:
+    """Order queue in a local SQLite file in WAL mode, shared by every process on the host"""
+
+    def __init__(self, path, max_attempts=5):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Set up the schema on a throwaway connection so none is inherited across a fork
+        connection = self._connect()
+        try:
+            connection.execute('''CREATE TABLE IF NOT EXISTS order_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                order_number TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_expires REAL,
+                error TEXT
+            )''')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_order_queue_state_id ON order_queue (state, id)')
+        finally:
+            connection.close()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        # An order is acknowledged to the customer once put() returns, so fsync every commit
+        connection.execute('PRAGMA synchronous=FULL')
+        return connection
+
+    @property
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = self._local.connection = self._connect()
+            self._local.pid = os.getpid()
+        return connection
+
+    def put(self, order_number, payload):
+        self._connection.execute('INSERT INTO order_queue (order_number, payload) VALUES (?, ?)',
+                                 (order_number, payload))
+
+    def claim(self, limit, lease_seconds):
+        """Lease up to limit pending (or abandoned) orders, oldest first, as (order_number, payload)"""
+        connection = self._connection
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            # Abandoned orders out of attempts are left for fail_exhausted()
+            jobs = connection.execute(
+                "SELECT order_number, payload FROM order_queue WHERE state = 'pending' "
+                "OR (state = 'claimed' AND lease_expires < ? AND attempts < ?) ORDER BY id LIMIT ?",
+                (now, self.max_attempts, limit)
+            ).fetchall()
+            connection.executemany(
+                "UPDATE order_queue SET state = 'claimed', lease_expires = ?, attempts = attempts + 1 "
+                "WHERE order_number = ?",
+                [(now + lease_seconds, order_number) for order_number, _ in jobs]
+            )
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return jobs
+
+    def fail_exhausted(self):
+        """Park orders whose lease lapsed on their last attempt as failed, returning them as (order_number, payload)"""
+        connection = self._connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            jobs = connection.execute(
+                "SELECT order_number, payload FROM order_queue "
+                "WHERE state = 'claimed' AND lease_expires < ? AND attempts >= ?",
+                (time.time(), self.max_attempts)
+            ).fetchall()
+            connection.executemany(
+                "UPDATE order_queue SET state = 'failed', lease_expires = NULL, "
+                "error = coalesce(error, 'worker lease expired too many times') WHERE order_number = ?",
+                [(order_number,) for order_number, _ in jobs]
+            )
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return jobs
+
+    def ack(self, order_numbers):
+        self._connection.executemany('DELETE FROM order_queue WHERE order_number = ?',
+                                     [(order_number,) for order_number in order_numbers])
+
+    def release(self, order_number, error):
+        """Return a failed order to the queue, or park it as failed once out of attempts"""
+        self._connection.execute(
+            "UPDATE order_queue SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "lease_expires = NULL, error = ? WHERE order_number = ?",
+            (self.max_attempts, error, order_number)
+        )
+
+    def status(self, order_number):
+        """'processing' while queued or being written, 'failed' once given up on, else None"""
+        row = self._connection.execute('SELECT state FROM order_queue WHERE order_number = ?',
+                                       (order_number,)).fetchone()
+        if row is None:
+            return None
+        return 'failed' if row[0] == 'failed' else 'processing'
+
+    def depth(self):
+        return self._connection.execute("SELECT count(*) FROM order_queue WHERE state != 'failed'").fetchone()[0]
+
+
+class RedisOrderQueue:
+    """Order queue in Redis, shared by every worker on every host"""
+
+    CLAIM_SCRIPT = """
+    local limit, now, lease, max_attempts = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+    for _, number in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)) do
+        -- Abandoned orders out of attempts keep their lapsed lease for FAIL_EXHAUSTED_SCRIPT
+        if tonumber(redis.call('HGET', KEYS[3], number) or 0) < max_attempts then
+            redis.call('ZREM', KEYS[2], number)
+            redis.call('RPUSH', KEYS[1], number)
+        end
+    end
+    local jobs = {}
+    for _ = 1, limit do
+        local number = redis.call('LPOP', KEYS[1])
+        if not number then break end
+        redis.call('ZADD', KEYS[2], now + lease, number)
+        redis.call('HINCRBY', KEYS[3], number, 1)
+        table.insert(jobs, number)
+        table.insert(jobs, redis.call('HGET', KEYS[4], number))
+    end
+    return jobs
+    """
+
+    FAIL_EXHAUSTED_SCRIPT = """
+    local now, max_attempts = tonumber(ARGV[1]), tonumber(ARGV[2])
+    local jobs = {}
+    for _, number in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now)) do
+        if tonumber(redis.call('HGET', KEYS[2], number) or 0) >= max_attempts then
+            redis.call('ZREM', KEYS[1], number)
+            redis.call('HSET', KEYS[4], number, 'worker lease expired too many times')
+            table.insert(jobs, number)
+            table.insert(jobs, redis.call('HGET', KEYS[3], number))
+        end
+    end
+    return jobs
+    """
+
+    def __init__(self, url, prefix='orders:', max_attempts=5):
+        import redis
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.max_attempts = max_attempts
+        # Claiming runs server-side so an order is never popped without also being leased
+        self._claim = self.redis.register_script(self.CLAIM_SCRIPT)
+        self._fail_exhausted = self.redis.register_script(self.FAIL_EXHAUSTED_SCRIPT)
+
+    def _key(self, name):
+        return f'{self.prefix}{name}'
+
+    def put(self, order_number, payload):
+        pipe = self.redis.pipeline()
+        pipe.hset(self._key('payloads'), order_number, payload)
+        pipe.rpush(self._key('pending'), order_number)
+        pipe.execute()
+
+    def claim(self, limit, lease_seconds):
+        keys = [self._key(name) for name in ('pending', 'leases', 'attempts', 'payloads', 'failed')]
+        flat = self._claim(keys=keys, args=[limit, time.time(), lease_seconds, self.max_attempts])
+        return list(zip(flat[::2], flat[1::2]))
+
+    def fail_exhausted(self):
+        keys = [self._key(name) for name in ('leases', 'attempts', 'payloads', 'failed')]
+        flat = self._fail_exhausted(keys=keys, args=[time.time(), self.max_attempts])
+        return list(zip(flat[::2], flat[1::2]))
+
+    def ack(self, order_numbers):
+        if not order_numbers:
+            return
+        pipe = self.redis.pipeline()
+        pipe.zrem(self._key('leases'), *order_numbers)
+        pipe.hdel(self._key('payloads'), *order_numbers)
+        pipe.hdel(self._key('attempts'), *order_numbers)
+        pipe.execute()
+
+    def release(self, order_number, error):
+        self.redis.zrem(self._key('leases'), order_number)
+        if int(self.redis.hget(self._key('attempts'), order_number) or 0) >= self.max_attempts:
+            self.redis.hset(self._key('failed'), order_number, error)
+        else:
+            self.redis.rpush(self._key('pending'), order_number)
+
+    def status(self, order_number):
+        if self.redis.hexists(self._key('failed'), order_number):
+            return 'failed'
+        if self.redis.hexists(self._key('payloads'), order_number):
+            return 'processing'
+        return None
+
+    def depth(self):
+        return self.redis.llen(self._key('pending')) + self.redis.zcard(self._key('leases'))
+
+
+class OrderIntakeWorkers:
+    """Pool of background threads draining the order queue in batches.
+
+    write_batch(jobs) runs inside an app context and returns the order numbers
+    now safely in the database plus a dict of order number -> error for the
+    rest. on_failed(order_number, payload), when given, runs in an app context
+    for each order given up on, whether write_batch kept failing it or its
+    lease lapsed too many times. Threads are started lazily per process, so
+    forking servers (gunicorn with preload_app) get workers in each child
+    rather than in the master.
+    """
+
+    def __init__(self, queue, write_batch, workers=2, batch_size=50, lease_seconds=60, poll_interval=0.2,
+                 on_failed=None):
+        self.queue = queue
+        self.write_batch = write_batch
+        self.on_failed = on_failed
+        self.workers = workers
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.app = None
+        self._threads = []
+        self._pid = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['order_intake'] = self
+        if self.workers:
+            app.before_request(self.ensure_started)
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._stopping.clear()
+            self._threads = [threading.Thread(target=self._run, name=f'order-intake-{i}', daemon=True)
+                             for i in range(self.workers)]
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self._pid = None
+
+    def run_once(self):
+        """Claim and write one batch, returning how many orders it held"""
+        # Orders whose workers kept dying on them are given up on here rather than in write_batch
+        for order_number, payload in self.queue.fail_exhausted():
+            self._report_failed(order_number, payload)
+        jobs = self.queue.claim(self.batch_size, self.lease_seconds)
+        if not jobs:
+            return 0
+        with self.app.app_context():
+            written, failed = self.write_batch(jobs)
+        # Acknowledge only after the commit: a crash in between replays the batch, which is idempotent
+        self.queue.ack(written)
+        payloads = dict(jobs)
+        for order_number, error in failed.items():
+            self.queue.release(order_number, error)
+            if self.queue.status(order_number) == 'failed':
+                self._report_failed(order_number, payloads[order_number])
+        return len(jobs)
+
+    def _report_failed(self, order_number, payload):
+        if self.on_failed is not None:
+            with self.app.app_context():
+                self.on_failed(order_number, payload)
+
+    def drain(self):
+        """Process batches until the queue is empty"""
+        total = 0
+        while True:
+            processed = self.run_once()
+            if not processed:
+                return total
+            total += processed
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                processed = self.run_once()
+            except Exception:
+                logger.exception('Order intake batch failed')
+                processed = 0
+            if not processed:
+                self._stopping.wait(self.poll_interval)
+
+
+def create_order_queue(app):
+    """Build the configured order intake queue, or None when orders are written synchronously"""
+    intake = app.config.get('ORDER_INTAKE', 'sync')
+    if intake == 'sync':
+        return None
+    if intake != 'queue':
+        raise ValueError(f'Unknown ORDER_INTAKE: {intake}')
+    backend = app.config.get('ORDER_QUEUE_BACKEND', 'sqlite')
+    max_attempts = app.config.get('ORDER_QUEUE_MAX_ATTEMPTS', 5)
+    if backend == 'sqlite':
+        path = app.config.get('ORDER_QUEUE_PATH') or os.path.join(app.instance_path, 'order_queue.db')
+        return SQLiteOrderQueue(path, max_attempts)
+    if backend == 'redis':
+        return RedisOrderQueue(app.config['REDIS_URL'], max_attempts=max_attempts)
+    raise ValueError(f'Unknown ORDER_QUEUE_BACKEND: {backend}')
@@ -0,0 +1,206 @@
+"""Read-replica routing for read-only views.
+
+Replicas are extra Flask-SQLAlchemy binds named replica_0, replica_1, ...
+(DATABASE_REPLICA_URLS in production), so they get their own pools and are
+disposed and instrumented like the primary. Views decorated with
+@replica_reads send their plain SELECTs to one healthy replica per request,
+picked round robin. Everything else stays on the primary: writes, SELECT ...
+FOR UPDATE, raw SQL, views without the decorator, CLI commands and the order
+intake workers.
+
+Replicas are probed at most every REPLICA_CHECK_INTERVAL seconds (SELECT 1,
+plus replay lag on a Postgres standby) and leave the rotation when a probe
+fails, lag passes REPLICA_MAX_LAG_SECONDS or a query on them loses its
+connection. With no healthy replica, reads fall back to the primary.
+
+Read-your-writes: a request that commits a write pins that client to the
+primary for REPLICA_STICKY_SECONDS (a timestamp in its session), so the order
+confirmation after place_order never reads a replica that hasn't caught up.
+A catalog change holds the whole process on the primary for as long, so the
+caches refilled after the version bump aren't loaded from a stale replica.
+
+Locally, two SQLite files stand in for primary and replica:
+
+    cp pastry.db replica.db
+    DATABASE_URL=sqlite:///pastry.db DATABASE_REPLICA_URLS=sqlite:///replica.db flask --app app run
+"""
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql import Select
+
+BIND_PREFIX = 'replica_'
+PIN_KEY = '_primary_until'
+# Seconds a Postgres standby is behind; 0 for a primary or a standby that has replayed everything it received
+PG_LAG_QUERY = ('SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() '
+                'THEN 0 ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END')
+
+
+def replica_reads(view):
+    """Let a read-only view's queries be served by a replica"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.replica_reads = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+class Replica:
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.healthy = True
+        self.lag = None
+        self.checked_at = float('-inf')
+        self.reads = 0
+        self.lock = threading.Lock()
+
+
+class ReplicaRouter:
+    """Picks a healthy replica, round robin, for requests whose reads may be served by one"""
+
+    def __init__(self, check_interval=5, max_lag=30, sticky_seconds=5):
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self.sticky_seconds = sticky_seconds
+        self.replicas = []
+        self.fallbacks = 0
+        self.logger = None
+        self._turn = 0
+        self._primary_until = 0.0
+        self._lock = threading.Lock()
+
+    def init_app(self, app, engines):
+        self.check_interval = app.config.get('REPLICA_CHECK_INTERVAL', self.check_interval)
+        self.max_lag = app.config.get('REPLICA_MAX_LAG_SECONDS', self.max_lag)
+        self.sticky_seconds = app.config.get('REPLICA_STICKY_SECONDS', self.sticky_seconds)
+        self.logger = app.logger
+        self.replicas = [Replica(key, engine) for key, engine in sorted(engines.items(), key=lambda item: str(item[0]))
+                         if key and key.startswith(BIND_PREFIX)]
+        for replica in self.replicas:
+            event.listen(replica.engine, 'handle_error', self._error_listener(replica))
+        app.extensions['replica_router'] = self
+        app.before_request(self._reset_request)
+        app.after_request(self._pin_writer)
+
+    def choose(self):
+        """A healthy replica's engine, or None when reads should go to the primary"""
+        if time.monotonic() >= self._primary_until:
+            with self._lock:
+                start = self._turn
+                self._turn += 1
+            for i in range(len(self.replicas)):
+                replica = self.replicas[(start + i) % len(self.replicas)]
+                if self._available(replica):
+                    with self._lock:
+                        replica.reads += 1
+                    return replica.engine
+        with self._lock:
+            self.fallbacks += 1
+        return None
+
+    def _available(self, replica):
+        # One request re-probes a due replica; the others go by the last result rather than wait
+        if time.monotonic() - replica.checked_at >= self.check_interval and replica.lock.acquire(blocking=False):
+            try:
+                self.check(replica)
+            finally:
+                replica.lock.release()
+        return replica.healthy
+
+    def check(self, replica):
+        """Probe a replica, taking it out of rotation if it can't be reached or lags too far behind"""
+        try:
+            with replica.engine.connect() as connection:
+                if connection.dialect.name == 'postgresql':
+                    lag = float(connection.exec_driver_sql(PG_LAG_QUERY).scalar())
+                else:
+                    connection.exec_driver_sql('SELECT 1')
+                    lag = None
+            healthy = lag is None or self.max_lag is None or lag <= self.max_lag
+            reason = f'{lag or 0:.1f}s behind'
+        except SQLAlchemyError as e:
+            healthy, lag, reason = False, None, str(e).splitlines()[0]
+        if healthy != replica.healthy and self.logger is not None:
+            if healthy:
+                self.logger.info('Replica %s is back in rotation', replica.name)
+            else:
+                self.logger.warning('Replica %s taken out of rotation: %s', replica.name, reason)
+        replica.healthy, replica.lag, replica.checked_at = healthy, lag, time.monotonic()
+        return healthy
+
+    def _error_listener(self, replica):
+        def handle_error(context):
+            # A lost connection, or a failure to connect at all; a slow or failing query says nothing about health
+            if context.is_disconnect or context.connection is None:
+                # Out until the next probe, one check interval from now, finds it working again
+                replica.healthy, replica.checked_at = False, time.monotonic()
+        return handle_error
+
+    def hold_primary(self, seconds=None):
+        """Send every read in this process to the primary for a while"""
+        self._primary_until = time.monotonic() + (self.sticky_seconds if seconds is None else seconds)
+
+    @staticmethod
+    def _reset_request():
+        # g outlives the request when an app context was already pushed (the CLI, tests)
+        for name in ('replica_reads', 'replica_engine', 'wrote_primary'):
+            g.pop(name, None)
+
+    def _pin_writer(self, response):
+        if g.pop('wrote_primary', False) and self.replicas and self.sticky_seconds:
+            session[PIN_KEY] = time.time() + self.sticky_seconds
+        return response
+
+    def engine_for_request(self):
+        """The replica engine serving this request's reads, chosen on first use; None for the primary"""
+        if 'replica_engine' not in g:
+            pinned = session.get(PIN_KEY, 0) > time.time()
+            g.replica_engine = None if pinned else self.choose()
+        return g.replica_engine
+
+    def stats(self):
+        return {'fallbacks': self.fallbacks, 'replicas': [
+            {'name': replica.name, 'healthy': replica.healthy, 'lag': replica.lag, 'reads': replica.reads}
+            for replica in self.replicas
+        ]}
+
+
+class RoutingSession(Session):
+    """db.session that sends a replica_reads view's plain SELECTs to the request's replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+        if (bind is None and not self._flushing and isinstance(clause, Select) and clause._for_update_arg is None
+                and has_request_context() and g.get('replica_reads') and engine is self._db.engines.get(None)):
+            router = current_app.extensions.get('replica_router')
+            if router is not None and router.replicas:
+                return router.engine_for_request() or engine
+        return engine
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _note_flush(session_, flush_context):
+    session_.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _note_dml(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _pin_after_write(session_):
+    if session_.info.pop('wrote', False) and has_request_context():
+        g.wrote_primary = True
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_write(session_):
+    session_.info.pop('wrote', None)
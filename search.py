@@ -0,0 +1,165 @@
+"""Full-text and fuzzy pastry search.
+
+Postgres ranks a weighted tsvector (name > category > description) and falls
+back to pg_trgm similarity on the name for typos; both are served by GIN
+indexes. SQLite uses an FTS5 index kept in sync by triggers, and expands
+misspelt terms with close matches from the FTS5 vocabulary.
+"""
+import difflib
+import re
+
+from sqlalchemy import DDL, event, text
+
+POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """ALTER TABLE pastry ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(category, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'C')
+    ) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_pastry_search_vector ON pastry USING GIN (search_vector)",
+    "CREATE INDEX IF NOT EXISTS ix_pastry_name_trgm ON pastry USING GIN (name gin_trgm_ops)",
+]
+
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS pastry_fts USING fts5(
+        name, description, category,
+        content='pastry', content_rowid='id', prefix='2 3',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS pastry_fts_vocab USING fts5vocab(pastry_fts, 'row')",
+    """CREATE TRIGGER IF NOT EXISTS pastry_fts_ai AFTER INSERT ON pastry BEGIN
+        INSERT INTO pastry_fts(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS pastry_fts_ad AFTER DELETE ON pastry BEGIN
+        INSERT INTO pastry_fts(pastry_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS pastry_fts_au AFTER UPDATE ON pastry BEGIN
+        INSERT INTO pastry_fts(pastry_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+        INSERT INTO pastry_fts(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END""",
+]
+
+SQLITE_DROP_DDL = [
+    "DROP TABLE IF EXISTS pastry_fts_vocab",
+    "DROP TABLE IF EXISTS pastry_fts",
+]
+
+# bm25 column weights for name, description, category
+SQLITE_RANK = "bm25(pastry_fts, 10.0, 2.0, 5.0)"
+
+# Created by the DDL above rather than the models, so autogenerate must not drop them
+SEARCH_COLUMNS = {('pastry', 'search_vector')}
+SEARCH_INDEXES = {'ix_pastry_search_vector', 'ix_pastry_name_trgm'}
+# FTS5 keeps its index in pastry_fts_data, pastry_fts_idx, ... shadow tables
+SEARCH_TABLE_PREFIX = 'pastry_fts'
+
+
+def include_in_autogenerate(object_, name, type_, reflected, compare_to):
+    """Alembic include_object hook that leaves the search column, indexes and FTS5 tables out of autogenerate"""
+    if not reflected:
+        return True
+    if type_ == 'table':
+        return not name.startswith(SEARCH_TABLE_PREFIX)
+    if type_ == 'column':
+        return (object_.table.name, name) not in SEARCH_COLUMNS
+    if type_ == 'index':
+        return name not in SEARCH_INDEXES
+    return True
+
+
+def install_search_ddl(table):
+    """Create the search indexes alongside the pastry table on create_all()"""
+    for statement in POSTGRES_DDL:
+        event.listen(table, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+    for statement in SQLITE_DDL:
+        event.listen(table, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+    for statement in SQLITE_DROP_DDL:
+        event.listen(table, 'before_drop', DDL(statement).execute_if(dialect='sqlite'))
+
+
+def normalize_search_term(term):
+    """Lower-case word tokens, used both for matching and as a cache key"""
+    return ' '.join(re.findall(r'\w+', (term or '').lower()))
+
+
+def search_pastries(session, term, category=None, page=1, per_page=24):
+    """Rank available pastries against term and return one page of ids.
+
+    Returns a dict with the matching ``ids`` in rank order for the requested
+    page plus ``total``, ``page``, ``per_page`` and ``pages``.
+    """
+    term = normalize_search_term(term)
+    page = max(int(page), 1)
+    if not term:
+        return _page([], 0, page, per_page)
+
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        where, params = _postgres_where(term)
+        rank = "ts_rank_cd(p.search_vector, websearch_to_tsquery('english', :term)) + similarity(p.name, :term) DESC"
+        source = "pastry p"
+    elif dialect == 'sqlite':
+        where, params = _sqlite_where(session, term)
+        rank = SQLITE_RANK
+        source = "pastry_fts JOIN pastry p ON p.id = pastry_fts.rowid"
+    else:
+        where, params = "lower(p.name) LIKE :pattern", {'pattern': f'%{term}%'}
+        rank = "p.name"
+        source = "pastry p"
+
+    where = f"p.available = :available AND ({where})"
+    params['available'] = True
+    if category:
+        where += " AND p.category = :category"
+        params['category'] = category
+
+    total = session.execute(text(f"SELECT count(*) FROM {source} WHERE {where}"), params).scalar()
+    ids = [row[0] for row in session.execute(
+        text(f"SELECT p.id FROM {source} WHERE {where} ORDER BY {rank}, p.id LIMIT :limit OFFSET :offset"),
+        dict(params, limit=per_page, offset=(page - 1) * per_page)
+    )]
+    return _page(ids, total, page, per_page)
+
+
+def _page(ids, total, page, per_page):
+    return {
+        'ids': ids,
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'pages': (total + per_page - 1) // per_page
+    }
+
+
+def _postgres_where(term):
+    return (
+        "p.search_vector @@ websearch_to_tsquery('english', :term) OR p.name % :term",
+        {'term': term}
+    )
+
+
+def _sqlite_where(session, term):
+    clauses = []
+    for token in term.split():
+        alternatives = [f'"{token}"*'] + [f'"{match}"' for match in _close_terms(session, token)]
+        clauses.append('(' + ' OR '.join(alternatives) + ')')
+    return "pastry_fts MATCH :query", {'query': ' AND '.join(clauses)}
+
+
+def _close_terms(session, token):
+    """Indexed terms within a small edit distance of token, for typo tolerance"""
+    if len(token) < 4:
+        return []
+    # Typos rarely hit the first letter, which keeps the vocabulary scan to one range
+    candidates = [row[0] for row in session.execute(
+        text("SELECT term FROM pastry_fts_vocab WHERE term >= :start AND term < :stop "
+             "AND length(term) BETWEEN :shortest AND :longest"),
+        {'start': token[0], 'stop': chr(ord(token[0]) + 1),
+         'shortest': len(token) - 2, 'longest': len(token) + 2}
+    )]
+    return difflib.get_close_matches(token, candidates, n=3, cutoff=0.75)
@@ -0,0 +1,209 @@
+"""Server-side session storage.
+
+Only a random session id travels in the cookie. Session data lives in a
+pluggable store, and the cart is kept beside it as a compact
+pastry_id -> quantity hash so add-to-cart is a single atomic increment
+instead of re-signing and re-sending the whole cart.
+"""
+import secrets
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+class MemorySessionStore:
+    """Process-local session store for tests and single-process local runs"""
+
+    def __init__(self):
+        self._sessions = {}
+        self._carts = {}
+        self._lock = threading.Lock()
+
+    def _alive(self, table, sid):
+        entry = table.get(sid)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del table[sid]
+            return None
+        return entry
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._alive(self._sessions, sid)
+            return entry[1] if entry else None
+
+    def save(self, sid, data, ttl):
+        with self._lock:
+            self._sessions[sid] = (time.monotonic() + ttl, data)
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def cart(self, sid):
+        with self._lock:
+            entry = self._alive(self._carts, sid)
+            return dict(entry[1]) if entry else {}
+
+    def _cart_for_update(self, sid, ttl):
+        entry = self._alive(self._carts, sid)
+        cart = entry[1] if entry else {}
+        self._carts[sid] = (time.monotonic() + ttl, cart)
+        return cart
+
+    def cart_incr(self, sid, pastry_id, quantity, ttl):
+        with self._lock:
+            cart = self._cart_for_update(sid, ttl)
+            cart[pastry_id] = cart.get(pastry_id, 0) + quantity
+            return cart[pastry_id]
+
+    def cart_set(self, sid, pastry_id, quantity, ttl):
+        with self._lock:
+            self._cart_for_update(sid, ttl)[pastry_id] = quantity
+
+    def cart_remove(self, sid, pastry_id):
+        with self._lock:
+            entry = self._alive(self._carts, sid)
+            if entry:
+                entry[1].pop(pastry_id, None)
+
+    def cart_clear(self, sid):
+        with self._lock:
+            self._carts.pop(sid, None)
+
+
+class RedisSessionStore:
+    """Redis-backed session store shared by every worker"""
+
+    def __init__(self, url, prefix='session:'):
+        import redis
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+
+    def _session_key(self, sid):
+        return f'{self.prefix}{sid}'
+
+    def _cart_key(self, sid):
+        return f'{self.prefix}{sid}:cart'
+
+    def load(self, sid):
+        return self.redis.get(self._session_key(sid))
+
+    def save(self, sid, data, ttl):
+        self.redis.set(self._session_key(sid), data, ex=ttl)
+
+    def delete(self, sid):
+        self.redis.delete(self._session_key(sid))
+
+    def cart(self, sid):
+        return {pastry_id: int(quantity) for pastry_id, quantity in self.redis.hgetall(self._cart_key(sid)).items()}
+
+    def cart_incr(self, sid, pastry_id, quantity, ttl):
+        pipe = self.redis.pipeline()
+        pipe.hincrby(self._cart_key(sid), pastry_id, quantity)
+        pipe.expire(self._cart_key(sid), ttl)
+        return pipe.execute()[0]
+
+    def cart_set(self, sid, pastry_id, quantity, ttl):
+        pipe = self.redis.pipeline()
+        pipe.hset(self._cart_key(sid), pastry_id, quantity)
+        pipe.expire(self._cart_key(sid), ttl)
+        pipe.execute()
+
+    def cart_remove(self, sid, pastry_id):
+        self.redis.hdel(self._cart_key(sid), pastry_id)
+
+    def cart_clear(self, sid):
+        self.redis.delete(self._cart_key(sid))
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.accessed = False
+        self.cart_modified = False
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Flask session interface that keeps only the session id in the cookie"""
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store):
+        self.store = store
+
+    def _ttl(self, app):
+        return int(app.permanent_session_lifetime.total_seconds())
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.load(sid)
+            if data is not None:
+                return ServerSideSession(self.serializer.loads(data), sid=sid)
+        # Never adopt an id the store doesn't know (expired, or planted by someone else): issue a fresh one
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if session.new and not session and not session.cart_modified:
+            return
+        if session.modified or session.cart_modified:
+            # Saved even when empty: the stored record is what makes the id valid, and the cart belongs to it
+            self.store.save(session.sid, self.serializer.dumps(dict(session)), self._ttl(app))
+
+        if session.modified or session.cart_modified or self.should_set_cookie(app, session):
+            response.set_cookie(
+                self.get_cookie_name(app),
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=self.get_cookie_domain(app),
+                path=self.get_cookie_path(app),
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+    # Cart operations, keyed by the current session id
+
+    def cart(self, session):
+        return self.store.cart(session.sid)
+
+    def cart_add(self, app, session, pastry_id, quantity):
+        session.cart_modified = True
+        return self.store.cart_incr(session.sid, pastry_id, quantity, self._ttl(app))
+
+    def cart_set(self, app, session, pastry_id, quantity):
+        session.cart_modified = True
+        self.store.cart_set(session.sid, pastry_id, quantity, self._ttl(app))
+
+    def cart_remove(self, app, session, pastry_id):
+        self.store.cart_remove(session.sid, pastry_id)
+
+    def cart_clear(self, app, session):
+        self.store.cart_clear(session.sid)
+
+
+def create_session_interface(app):
+    """Build the configured server-side session interface, or None for signed cookies"""
+    backend = app.config.get('SESSION_BACKEND', 'cookie')
+    if backend == 'cookie':
+        return None
+    if backend == 'memory':
+        return ServerSideSessionInterface(MemorySessionStore())
+    if backend == 'redis':
+        return ServerSideSessionInterface(RedisSessionStore(app.config['REDIS_URL']))
+    raise ValueError(f'Unknown SESSION_BACKEND: {backend}')
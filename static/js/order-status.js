@@ -0,0 +1,50 @@
+// Live order status on the confirmation and processing pages.
+// Follows the order's Server-Sent Events stream when one is configured and falls back to
+// polling the JSON status endpoint (cheap 304s while nothing changes) when it isn't or goes away.
+(function () {
+    var root = document.getElementById('order-status');
+    if (!root) {
+        return;
+    }
+    var current = {status: root.dataset.status, payment_status: root.dataset.paymentStatus || null};
+    var pollSeconds = parseInt(root.dataset.pollSeconds, 10) || 5;
+
+    function label(value) {
+        return value ? value.charAt(0).toUpperCase() + value.slice(1).replace(/_/g, ' ') : '';
+    }
+
+    function apply(state) {
+        if (state.status === current.status && state.payment_status === current.payment_status) {
+            return;
+        }
+        if (root.dataset.reloadOnChange === 'true') {
+            // A queued order was written (or given up on): the page itself changes
+            window.location.reload();
+            return;
+        }
+        current = state;
+        root.querySelectorAll('[data-field]').forEach(function (element) {
+            element.textContent = label(state[element.dataset.field]);
+        });
+    }
+
+    function poll() {
+        fetch(root.dataset.statusUrl, {cache: 'no-cache', headers: {'Accept': 'application/json'}})
+            .then(function (response) { return response.ok ? response.json().then(apply) : null; })
+            .catch(function () {})
+            .then(function () { setTimeout(poll, pollSeconds * 1000); });
+    }
+
+    if (root.dataset.streamUrl && window.EventSource) {
+        var source = new EventSource(root.dataset.streamUrl);
+        source.addEventListener('status', function (event) { apply(JSON.parse(event.data)); });
+        source.onerror = function () {
+            // EventSource reconnects by itself unless the server refused the stream outright
+            if (source.readyState === EventSource.CLOSED) {
+                poll();
+            }
+        };
+    } else {
+        setTimeout(poll, pollSeconds * 1000);
+    }
+})();
@@ -1,9 +1,29 @@
 import pytest
-from app import create_app  
+from contextlib import contextmanager
+from sqlalchemy import event
+from app import create_app, db
 
 @pytest.fixture
 def client():
     app = create_app()
     app.config['TESTING'] = True
     with app.test_client() as client:
-        yield client
\ No newline at end of file
+        yield client
+
+@pytest.fixture
+def count_queries():
+    """Context manager factory that counts SQL statements sent to the engine"""
+    @contextmanager
+    def counter():
+        statements = []
+        
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    
+    return counter
@@ -1,6 +1,10 @@
+import io
+import os
 import pytest
+from datetime import datetime, timezone
+from sqlalchemy import func
 from app import create_app, db
-from app import Pastry, Customer, Order, OrderItem
+from app import Pastry, Customer, Order, OrderItem, DELIVERY_FEE
 
 @pytest.fixture
 def app():
@@ -56,4 +60,1186 @@ def test_checkout_empty_cart(client):
     """Test checkout with empty cart redirects"""
     response = client.get('/checkout')
     # Should redirect to browse page when cart is empty
-    assert response.status_code == 302
\ No newline at end of file
+    assert response.status_code == 302
+
+def _add_pastries(count):
+    pastries = [Pastry(name=f'Pastry {i}', description=f'Fresh pastry number {i}', price=2.50 + i,
+                       category='Tarts') for i in range(count)]
+    db.session.add_all(pastries)
+    db.session.commit()
+    return pastries
+
+def test_price_cart_totals(app):
+    """Test cart pricing returns line items, subtotal and delivery fee"""
+    from app import price_cart
+    croissant, muffin = _add_pastries(2)
+    
+    priced = price_cart({str(croissant.id): 2, str(muffin.id): 1, '9999': 3})
+    
+    assert [item['pastry'].id for item in priced['items']] == [croissant.id, muffin.id]
+    assert priced['subtotal'] == croissant.price * 2 + muffin.price
+    assert priced['total'] == priced['subtotal'] + DELIVERY_FEE
+
+def test_cart_query_count_is_constant(app, client, count_queries):
+    """Test cart, checkout and place_order issue the same queries for 1 or 20 lines"""
+    pastries = _add_pastries(20)
+    counts = []
+    
+    # Warm the delivery slot cache so both passes see it in the same state
+    with client.session_transaction() as sess:
+        sess['cart'] = {str(pastries[0].id): 1}
+    client.get('/checkout')
+    
+    for size in (1, 20):
+        with client.session_transaction() as sess:
+            sess['cart'] = {str(p.id): 1 for p in pastries[:size]}
+        
+        with count_queries() as statements:
+            assert client.get('/cart').status_code == 200
+            assert client.get('/checkout').status_code == 200
+        counts.append(len(statements))
+    
+    assert counts[0] == counts[1]
+
+def test_place_order_prices_cart_once(app, client, count_queries):
+    """Test placing an order loads all cart pastries with a single query"""
+    pastries = _add_pastries(20)
+    with client.session_transaction() as sess:
+        sess['cart'] = {str(p.id): 2 for p in pastries}
+    
+    with count_queries() as statements:
+        response = client.post('/place_order', data={
+            'name': 'Ada', 'email': 'ada@example.com', 'phone': '555',
+            'delivery_date': '2030-01-01', 'address': '1 Main St',
+            'city': 'Nairobi', 'postal_code': '00100'
+        })
+    
+    assert response.status_code == 302
+    assert '/order/' in response.location
+    pastry_selects = [s for s in statements if s.lstrip().startswith('SELECT') and 'FROM pastry' in s]
+    assert len(pastry_selects) == 1
+    
+    order = Order.query.one()
+    assert len(order.items) == 20
+    assert order.total_amount == sum(p.price * 2 for p in pastries) + DELIVERY_FEE
+
+def test_catalog_pages_served_from_cache(app, client, count_queries):
+    """Test browsing issues no SQL once the catalog cache is warm"""
+    _add_pastries(3)
+    urls = ['/', '/browse', '/browse?category=Tarts&search=pastry', '/pastry/1', '/api/pastries']
+    for url in urls:
+        assert client.get(url).status_code == 200
+    
+    with count_queries() as statements:
+        for url in urls:
+            assert client.get(url).status_code == 200
+    
+    assert statements == []
+    assert app.extensions['catalog_cache'].stats()['hits'] >= len(urls)
+
+def test_catalog_cache_invalidated_on_pastry_write(app, client):
+    """Test inserting or updating a pastry bumps the catalog version"""
+    pastry, = _add_pastries(1)
+    cache = app.extensions['catalog_cache']
+    assert len(client.get('/api/pastries').get_json()) == 1
+    version = cache.version
+    
+    pastry.available = False
+    db.session.commit()
+    
+    assert cache.version == version + 1
+    assert client.get('/api/pastries').get_json() == []
+    assert client.get('/pastry/9999').status_code == 404
+
+def test_catalog_cache_follows_writes_from_other_processes(tmp_path):
+    """Test a catalog write made outside the web process invalidates its caches after the check interval"""
+    from sqlalchemy import create_engine, update
+    config = {'TESTING': True, 'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'shop.db'}", 'SECRET_KEY': 'x',
+              'AUTO_CREATE_SCHEMA': True, 'CATALOG_VERSION_BACKEND': 'database', 'CATALOG_VERSION_CHECK_SECONDS': 60}
+    app = create_app(config)
+    version = app.extensions['catalog_version']
+    with app.app_context():
+        _add_pastries(1)
+        client = app.test_client()
+        assert client.get('/api/pastries').json[0]['name'] == 'Pastry 0'
+        
+        # Stand-in for `flask load-catalog` in another process: its commit can't bump this process's caches
+        other = create_engine(config['SQLALCHEMY_DATABASE_URI'])
+        with other.begin() as connection:
+            connection.execute(update(Pastry.__table__).values(name='Renamed', updated_at=datetime.now(timezone.utc)))
+        other.dispose()
+        assert client.get('/api/pastries').json[0]['name'] == 'Pastry 0'
+        
+        version.check_interval = 0
+        assert client.get('/api/pastries').json[0]['name'] == 'Renamed'
+        db.engine.dispose()
+
+def test_search_ranks_name_description_and_category(app):
+    """Test search matches across fields and ranks name matches first"""
+    from app import search_catalog
+    db.session.add_all([
+        Pastry(name='Lemon Tart', description='Tangy curd in a crisp shell', price=4.95, category='Tarts'),
+        Pastry(name='Blueberry Muffin', description='With a hint of lemon zest', price=2.75, category='Muffins'),
+        Pastry(name='Lemon Eclair', description='Choux pastry', price=3.75, category='Eclairs', available=False),
+    ])
+    db.session.commit()
+    
+    results = search_catalog('lemon')
+    assert [p.name for p in results['pastries']] == ['Lemon Tart', 'Blueberry Muffin']
+    assert results['total'] == 2
+    assert [p.name for p in search_catalog('muffins')['pastries']] == ['Blueberry Muffin']
+    assert search_catalog('lemon', category='Tarts')['total'] == 1
+
+def test_search_tolerates_typos_and_paginates(app, client):
+    """Test misspelt terms still match and results are paged"""
+    from app import search_catalog
+    app.config['SEARCH_PAGE_SIZE'] = 2
+    db.session.add_all([
+        Pastry(name=f'Almond Croissant {i}', description='Flaky', price=4.0, category='Croissants')
+        for i in range(5)
+    ])
+    db.session.commit()
+    
+    first = search_catalog('crossaint')
+    assert first['total'] == 5
+    assert first['pages'] == 3
+    assert len(first['pastries']) == 2
+    assert len(search_catalog('crossaint', page=3)['pastries']) == 1
+    
+    response = client.get('/browse?search=almond&page=2')
+    assert response.status_code == 200
+    assert b'Page 2 of 3' in response.data
+
+def test_api_pastries_keyset_pagination(app, client):
+    """Test the API pages with limit/after and projects requested fields"""
+    _add_pastries(5)
+    
+    response = client.get('/api/pastries?limit=2&fields=name,price')
+    assert response.get_json() == [
+        {'id': 1, 'name': 'Pastry 0', 'price': 2.5},
+        {'id': 2, 'name': 'Pastry 1', 'price': 3.5},
+    ]
+    assert response.headers['X-Next-Cursor'] == '2'
+    
+    ids = []
+    url = '/api/pastries?limit=2'
+    while url:
+        response = client.get(url)
+        ids += [p['id'] for p in response.get_json()]
+        url = response.headers.get('Link', '').partition('<')[2].partition('>')[0]
+    assert ids == [1, 2, 3, 4, 5]
+    
+    assert client.get('/api/pastries?fields=name,secret').status_code == 400
+
+def test_api_pastries_streaming(app, client):
+    """Test the opt-in NDJSON and JSON array streaming modes"""
+    import json
+    _add_pastries(3)
+    
+    response = client.get('/api/pastries?stream=ndjson&fields=name')
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines == [{'id': 1, 'name': 'Pastry 0'}, {'id': 2, 'name': 'Pastry 1'}, {'id': 3, 'name': 'Pastry 2'}]
+    
+    response = client.get('/api/pastries?stream=json&after=1')
+    assert [p['id'] for p in response.get_json()] == [2, 3]
+    assert client.get('/api/pastries?stream=json&after=3').get_json() == []
+
+def test_catalog_conditional_requests(app, client, count_queries):
+    """Test catalog responses carry validators and answer 304 without SQL"""
+    pastry, = _add_pastries(1)
+    
+    for url in ['/', '/browse?category=Tarts', '/pastry/1', '/api/pastries']:
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.headers['ETag']
+        assert 'public' in response.headers['Cache-Control']
+        
+        with count_queries() as statements:
+            revalidated = client.get(url, headers={'If-None-Match': response.headers['ETag']})
+        assert revalidated.status_code == 304
+        assert revalidated.data == b''
+        assert statements == []
+        
+    
+    # Only the API is revalidated by date; a page's cart badge can change while the catalog doesn't
+    last_modified = client.get('/api/pastries').headers['Last-Modified']
+    assert client.get('/api/pastries', headers={'If-Modified-Since': last_modified}).status_code == 304
+    assert 'Last-Modified' not in client.get('/').headers
+    with client.session_transaction() as sess:
+        sess['cart'] = {str(pastry.id): 2}
+    by_date = client.get('/', headers={'If-Modified-Since': last_modified})
+    assert by_date.status_code == 200
+    assert b'<span class="cart-badge">2</span>' in by_date.data
+    
+    etag = client.get('/api/pastries').headers['ETag']
+    pastry.price = 9.99
+    db.session.commit()
+    assert client.get('/api/pastries', headers={'If-None-Match': etag}).status_code == 200
+
+def test_catalog_pages_with_cart_are_private(app, client):
+    """Test pages showing a cart badge are not cached by shared proxies"""
+    _add_pastries(1)
+    etag = client.get('/').headers['ETag']
+    
+    with client.session_transaction() as sess:
+        sess['cart'] = {'1': 2}
+    response = client.get('/', headers={'If-None-Match': etag})
+    
+    assert response.status_code == 200
+    assert 'private' in response.headers['Cache-Control']
+
+def test_browse_fragments_cached_per_catalog_version(app, client):
+    """Test grid fragments are reused while flash messages and the cart badge render per request"""
+    pastry, = _add_pastries(1)
+    fragments = app.extensions['fragment_cache']
+    
+    client.get('/browse?search=Pastry')
+    misses = fragments.stats()['misses']
+    
+    client.post('/add_to_cart', data={'pastry_id': pastry.id, 'quantity': 3})
+    response = client.get('/browse?search=%20PASTRY%20')
+    assert fragments.stats()['misses'] == misses
+    assert b'Item added to cart!' in response.data
+    assert b'<span class="cart-badge">3</span>' in response.data
+    assert b'Pastry 0' in response.data
+    
+    pastry.name = 'Renamed Tart'
+    db.session.commit()
+    assert fragments.stats()['size'] == 0
+    assert b'Renamed Tart' in client.get('/browse').data
+
+def test_fragment_cache_is_bounded_by_bytes():
+    """Test the fragment cache evicts least recently used entries past its byte budget"""
+    from catalog_cache import FragmentCache
+    cache = FragmentCache(max_bytes=10)
+    cache.get_or_load('a', lambda: 'x' * 6)
+    cache.get_or_load('b', lambda: 'y' * 6)
+    
+    assert cache.stats()['size'] == 1
+    assert cache.stats()['bytes'] == 6
+    assert cache.get_or_load('b', lambda: 'unused') == 'y' * 6
+
+@pytest.fixture
+def server_side_client(app):
+    """A test client whose sessions live in the in-memory session store"""
+    from session_store import create_session_interface
+    app.config['SESSION_BACKEND'] = 'memory'
+    app.session_interface = create_session_interface(app)
+    return app.test_client()
+
+def test_server_side_session_keeps_cart_out_of_cookie(app, server_side_client):
+    """Test only a session id is sent in the cookie and the cart is stored as a hash"""
+    pastries = _add_pastries(2)
+    client = server_side_client
+    
+    for _ in range(3):
+        client.post('/add_to_cart', data={'pastry_id': pastries[0].id, 'quantity': 2})
+    client.post('/add_to_cart', data={'pastry_id': pastries[1].id, 'quantity': 1})
+    
+    cookie = client.get_cookie('session')
+    store = app.session_interface.store
+    assert store.cart(cookie.value) == {str(pastries[0].id): 6, str(pastries[1].id): 1}
+    assert len(cookie.value) < 64
+    
+    response = client.get('/cart')
+    assert b'<span class="cart-badge">7</span>' in response.data
+    
+    client.post('/update_cart', data={'pastry_id': pastries[0].id, 'quantity': 0})
+    assert store.cart(cookie.value) == {str(pastries[1].id): 1}
+
+def test_server_side_session_place_order_clears_cart(app, server_side_client):
+    """Test placing an order empties the stored cart"""
+    pastry, = _add_pastries(1)
+    client = server_side_client
+    client.post('/add_to_cart', data={'pastry_id': pastry.id, 'quantity': 2})
+    
+    response = client.post('/place_order', data={
+        'name': 'Ada', 'email': 'ada@example.com', 'phone': '555',
+        'delivery_date': '2030-01-01', 'address': '1 Main St',
+        'city': 'Nairobi', 'postal_code': '00100'
+    })
+    
+    assert '/order/' in response.location
+    assert app.session_interface.store.cart(client.get_cookie('session').value) == {}
+    assert Order.query.one().items[0].quantity == 2
+
+def test_server_side_session_rejects_unknown_ids(app, server_side_client):
+    """Test a session id the store never issued is replaced rather than adopted"""
+    pastry, = _add_pastries(1)
+    client = server_side_client
+    client.set_cookie('session', 'planted-by-someone-else')
+    client.post('/add_to_cart', data={'pastry_id': pastry.id, 'quantity': 2})
+    
+    sid = client.get_cookie('session').value
+    store = app.session_interface.store
+    assert sid != 'planted-by-someone-else'
+    assert store.cart('planted-by-someone-else') == {}
+    # The flash is gone after this page, but the now-empty session keeps its id and cart
+    client.get('/cart')
+    client.get('/cart')
+    assert client.get_cookie('session').value == sid
+    assert store.cart(sid) == {str(pastry.id): 2}
+
+def test_place_order_with_empty_cart_books_nothing(app, client):
+    """Test checking out an empty cart is turned away without writing an order or booking a slot"""
+    from app import DeliverySlot
+    _add_pastries(1)
+    with client.session_transaction() as sess:
+        sess['cart'] = {'9999': 1}
+    
+    response = client.post('/place_order', data=ORDER_FORM)
+    
+    assert response.location.endswith('/browse')
+    assert Order.query.count() == 0
+    assert DeliverySlot.query.count() == 0
+
+def test_place_order_write_path_round_trips(app, client, count_queries):
+    """Test an order costs a fixed number of statements and reuses existing customers"""
+    pastries = _add_pastries(10)
+    form = {
+        'name': 'Ada', 'email': 'ada@example.com', 'phone': '555',
+        'delivery_date': '2030-01-01', 'address': '1 Main St',
+        'city': 'Nairobi', 'postal_code': '00100'
+    }
+    
+    for size in (1, 10):
+        with client.session_transaction() as sess:
+            sess['cart'] = {str(p.id): 1 for p in pastries[:size]}
+        with count_queries() as statements:
+            response = client.post('/place_order', data=form)
+        assert '/order/' in response.location
+        # pastry SELECT, customer upsert, order INSERT ... RETURNING, item executemany, delivery slot upsert;
+        # the sales rollups are left to `flask rollup-sales`
+        assert len(statements) == 5
+    
+    assert Customer.query.count() == 1
+    assert [len(order.items) for order in Order.query.order_by(Order.id)] == [1, 10]
+
+def test_order_confirmation_query_count(app, client, count_queries):
+    """Test the confirmation page loads order, customer, items and pastries in two queries"""
+    pastries = _add_pastries(15)
+    with client.session_transaction() as sess:
+        sess['cart'] = {str(p.id): 1 for p in pastries}
+    location = client.post('/place_order', data={
+        'name': 'Ada', 'email': 'ada@example.com', 'phone': '555',
+        'delivery_date': '2030-01-01', 'address': '1 Main St',
+        'city': 'Nairobi', 'postal_code': '00100'
+    }).location
+    db.session.expunge_all()
+    
+    with count_queries() as statements:
+        response = client.get(location)
+    
+    assert response.status_code == 200
+    assert b'Pastry 14' in response.data
+    assert len(statements) == 2
+
+def test_engine_options_from_env(monkeypatch):
+    """Test pool and statement-timeout settings are read from the environment"""
+    from app import engine_options_from_env
+    monkeypatch.setenv('DB_POOL_SIZE', '20')
+    monkeypatch.setenv('DB_STATEMENT_TIMEOUT_MS', '5000')
+    
+    options = engine_options_from_env('postgresql://u:p@db/pastry_db')
+    assert options['pool_size'] == 20
+    assert options['pool_pre_ping'] is True
+    assert options['connect_args'] == {'options': '-c statement_timeout=5000'}
+    assert 'pool_size' not in engine_options_from_env('sqlite:///pastry.db')
+
+def test_gunicorn_pool_fits_connection_budget(monkeypatch):
+    """Test gunicorn splits DB_MAX_CONNECTIONS across workers, and warns when explicit pools overrun it"""
+    import runpy
+    config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'gunicorn.conf.py')
+    monkeypatch.setenv('WEB_CONCURRENCY', '17')
+    monkeypatch.setenv('DB_MAX_CONNECTIONS', '80')
+    for name in ('DB_POOL_SIZE', 'DB_MAX_OVERFLOW'):
+        monkeypatch.setenv(name, '')
+        monkeypatch.delenv(name)
+    
+    config = runpy.run_path(config_path)
+    assert (os.environ['DB_POOL_SIZE'], os.environ['DB_MAX_OVERFLOW']) == ('4', '0')
+    assert config['workers'] * config['db_connections_per_worker'] <= 80
+    
+    warnings = []
+    server = type('Server', (), {'log': type('Log', (), {'warning': lambda self, *args: warnings.append(args)})()})()
+    config['when_ready'](server)
+    assert warnings == []
+    
+    monkeypatch.setenv('DB_POOL_SIZE', '5')
+    monkeypatch.setenv('DB_MAX_OVERFLOW', '10')
+    config = runpy.run_path(config_path)
+    config['when_ready'](server)
+    assert warnings and warnings[0][1:] == (17, 15, 80)
+
+def test_storefront_benchmark_smoke():
+    """Test the load-test harness runs the full funnel and flags regressions"""
+    from benchmarks.storefront import run_benchmark, compare, STEPS
+    report = run_benchmark(users=2, iterations=1, pastries=20, customers=5)
+    
+    assert list(report['steps']) == STEPS
+    assert report['steps']['place_order']['sql_per_request'] == 5
+    assert compare(report, report, threshold=1.0) == []
+    # Latency from another machine (or a noisy run) is reported, not gated, unless a threshold is given
+    slower = {'steps': {'place_order': dict(report['steps']['place_order'], p95_ms=0.001)}}
+    assert compare(report, slower) == []
+    assert compare(report, slower, threshold=1.5)[0].startswith('place_order: p95')
+    
+    baseline = {'steps': {'checkout': dict(report['steps']['checkout'], sql_per_request=-1)}}
+    assert compare(report, baseline, threshold=1.0)[0].startswith('checkout:')
+
+def test_metrics_endpoint(app, client):
+    """Test request, SQL and template metrics are exported in Prometheus format"""
+    _add_pastries(2)
+    client.get('/browse')
+    client.get('/cart')
+    metrics = app.extensions['request_metrics']
+    
+    assert metrics.request_latency.count('browse', 'GET', '200') == 1
+    assert metrics.request_sql_statements.count('browse') == 1
+    
+    assert client.get('/metrics').status_code == 404
+    app.config.update(METRICS_ENABLED=True, METRICS_TOKEN='scrape')
+    assert client.get('/metrics').status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer scrape'})
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert 'http_request_duration_seconds_bucket{endpoint="browse",method="GET",status="200",le="+Inf"} 1' in body
+    assert 'template_render_duration_seconds_count{template="browse.html"}' in body
+    assert 'db_pool_checkout_wait_seconds_count' in body
+    assert 'catalog_cache_misses_total' in body
+
+def test_server_timing_only_while_debugging(app, client):
+    """Test request timings are only disclosed in a Server-Timing header in debug mode"""
+    assert 'Server-Timing' not in client.get('/').headers
+    app.config['DEBUG'] = True
+    assert client.get('/').headers['Server-Timing'].startswith('app;dur=')
+
+def test_slow_request_profiler(app, client, tmp_path):
+    """Test sampled requests over the threshold are dumped as cProfile stats"""
+    app.config.update(PROFILE_SLOW_REQUESTS_MS=0.0001, PROFILE_SAMPLE_RATE=1.0, PROFILE_DIR=str(tmp_path))
+    client.get('/browse')
+    
+    dumps = list(tmp_path.glob('*-browse-*.prof'))
+    assert len(dumps) == 1
+    assert app.extensions['request_metrics'].profiles_dumped.value('browse') == 1
+
+def test_storefront_queries_avoid_sequential_scans(tmp_path):
+    """Test EXPLAIN finds no unexpected sequential scans on any storefront route"""
+    from benchmarks.explain_queries import ALLOWED_SCANS, find_sequential_scans, seed_orders
+    from benchmarks.storefront import seed
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'explain.db'}",
+        'SECRET_KEY': 'test-secret-key'
+    })
+    seed(app, 2000, 200)
+    order_number = seed_orders(app, 2000, 2000, 200)
+    
+    found = find_sequential_scans(app, order_number)
+    unexpected = [(route, table) for route, scans in found.items() for table, _ in scans
+                  if (route, table) not in ALLOWED_SCANS]
+    assert unexpected == []
+
+@pytest.fixture
+def order_intake(app, tmp_path):
+    """Queued order intake on a throwaway SQLite queue, drained by hand instead of by threads"""
+    from order_queue import OrderIntakeWorkers, SQLiteOrderQueue
+    from app import abandon_queued_order, write_queued_orders
+    intake = OrderIntakeWorkers(SQLiteOrderQueue(str(tmp_path / 'orders.db'), max_attempts=2),
+                                write_queued_orders, workers=0, on_failed=abandon_queued_order)
+    intake.init_app(app)
+    return intake
+
+ORDER_FORM = {
+    'name': 'Ada', 'email': 'ada@example.com', 'phone': '555',
+    'delivery_date': '2030-01-01', 'address': '1 Main St',
+    'city': 'Nairobi', 'postal_code': '00100'
+}
+
+def test_queued_order_intake_shows_processing_then_confirmation(app, client, order_intake):
+    """Test a queued order redirects at once, shows as processing and is written by the worker"""
+    pastries = _add_pastries(3)
+    with client.session_transaction() as sess:
+        sess['cart'] = {str(p.id): 2 for p in pastries}
+    
+    location = client.post('/place_order', data=ORDER_FORM).location
+    assert '/order/' in location
+    assert Order.query.count() == 0
+    assert b'Processing Your Order' in client.get(location).data
+    
+    assert order_intake.drain() == 1
+    db.session.expunge_all()
+    order = Order.query.one()
+    assert location.endswith(order.order_number)
+    assert [item.quantity for item in order.items] == [2, 2, 2]
+    assert order.total_amount == pytest.approx(sum(2 * p.price for p in pastries) + DELIVERY_FEE)
+    assert b'Order Confirmed!' in client.get(location).data
+    assert order_intake.queue.depth() == 0
+
+def test_queued_orders_written_exactly_once_after_worker_restart(app, client, order_intake):
+    """Test a batch replayed after its worker died before acknowledging is not written twice"""
+    pastry, = _add_pastries(1)
+    for _ in range(3):
+        with client.session_transaction() as sess:
+            sess['cart'] = {str(pastry.id): 1}
+        client.post('/place_order', data=ORDER_FORM)
+    
+    from app import write_queued_orders
+    # A worker commits the batch and dies before acknowledging it; its lease lapses at once
+    jobs = order_intake.queue.claim(10, lease_seconds=-1)
+    assert write_queued_orders(jobs) == ([number for number, _ in jobs], {})
+    
+    assert order_intake.drain() == 3
+    assert Order.query.count() == 3
+    assert OrderItem.query.count() == 3
+    assert Customer.query.count() == 1
+    assert order_intake.queue.depth() == 0
+
+def test_queued_order_that_cannot_be_written_is_reported_failed(app, client, order_intake):
+    """Test a bad order is retried, then parked as failed, gives back its slot and stock and holds up nothing"""
+    import json
+    from app import DeliverySlot, PastryStock, set_stock
+    pastry, = _add_pastries(1)
+    set_stock(pastry.id, 5)
+    db.session.commit()
+    numbers = []
+    for _ in range(2):
+        with client.session_transaction() as sess:
+            sess['cart'] = {str(pastry.id): 2}
+        numbers.append(client.post('/place_order', data=ORDER_FORM).location.rsplit('/', 1)[1])
+    good, doomed = numbers
+    # The second order's slot and stock are taken, but its payload can no longer be written
+    connection = order_intake.queue._connection
+    payload = json.loads(connection.execute('SELECT payload FROM order_queue WHERE order_number = ?',
+                                            (doomed,)).fetchone()[0])
+    connection.execute('UPDATE order_queue SET payload = ? WHERE order_number = ?',
+                       (json.dumps(dict(payload, customer={})), doomed))
+    order_intake.queue.put('bad-order', '{"customer": {}}')
+    
+    order_intake.drain()
+    
+    db.session.expunge_all()
+    assert [order.order_number for order in Order.query] == [good]
+    assert order_intake.queue.status(doomed) == 'failed'
+    assert order_intake.queue.status('bad-order') == 'failed'
+    assert DeliverySlot.query.one().reserved == 1
+    assert db.session.query(func.sum(PastryStock.quantity)).scalar() == 3
+    assert b"Couldn't Complete Your Order" in client.get(f'/order/{doomed}').data
+    assert b"Couldn't Complete Your Order" in client.get('/order/bad-order').data
+    assert client.get('/order/unknown').status_code == 404
+
+def test_queued_order_whose_lease_keeps_lapsing_gives_back_slot_and_stock(app, client, order_intake):
+    """Test an order given up on after its workers died on every attempt still releases its reservations"""
+    from app import DeliverySlot, PastryStock, set_stock
+    pastry, = _add_pastries(1)
+    set_stock(pastry.id, 5)
+    db.session.commit()
+    with client.session_transaction() as sess:
+        sess['cart'] = {str(pastry.id): 2}
+    order_number = client.post('/place_order', data=ORDER_FORM).location.rsplit('/', 1)[1]
+    assert DeliverySlot.query.one().reserved == 1
+    
+    # Both attempts (max_attempts=2) are claimed by workers that die, so their leases lapse at once
+    for _ in range(2):
+        assert [number for number, _ in order_intake.queue.claim(10, lease_seconds=-1)] == [order_number]
+    
+    assert order_intake.drain() == 0
+    db.session.expunge_all()
+    assert order_intake.queue.status(order_number) == 'failed'
+    assert Order.query.count() == 0
+    assert DeliverySlot.query.one().reserved == 0
+    assert db.session.query(func.sum(PastryStock.quantity)).scalar() == 5
+    assert b"Couldn't Complete Your Order" in client.get(f'/order/{order_number}').data
+
+def test_delivery_slot_capacity_is_enforced(app, client):
+    """Test a full delivery day turns orders away while other days and per-city counters still book"""
+    app.config.update(DELIVERY_SLOT_CAPACITY=2, DELIVERY_CITY_CAPACITY={'mombasa': 1})
+    pastry, = _add_pastries(1)
+    
+    def order(city, day='2030-01-01'):
+        with client.session_transaction() as sess:
+            sess['cart'] = {str(pastry.id): 1}
+        return client.post('/place_order', data=dict(ORDER_FORM, city=city, delivery_date=day)).location
+    
+    assert '/order/' in order('Nairobi')
+    assert '/order/' in order('Nakuru')
+    assert order('Nairobi').endswith('/checkout')
+    assert '/order/' in order('Nairobi', '2030-01-02')
+    assert '/order/' in order(' Mombasa')
+    assert order('mombasa').endswith('/checkout')
+    
+    from app import DeliverySlot
+    assert Order.query.count() == 4
+    assert sorted((s.city, str(s.delivery_date), s.reserved) for s in DeliverySlot.query) == [
+        ('', '2030-01-01', 2), ('', '2030-01-02', 1), ('mombasa', '2030-01-01', 1)
+    ]
+
+def test_checkout_shows_cached_delivery_availability(app, client, count_queries):
+    """Test checkout lists remaining capacity per day without re-querying while the cache is warm"""
+    from app import delivery_window, reserve_delivery_slot
+    app.config['DELIVERY_SLOT_CAPACITY'] = 3
+    first, second = delivery_window()[:2]
+    for _ in range(3):
+        reserve_delivery_slot(first, 'Nairobi')
+    reserve_delivery_slot(second, 'Nairobi')
+    db.session.commit()
+    
+    pastry, = _add_pastries(1)
+    with client.session_transaction() as sess:
+        sess['cart'] = {str(pastry.id): 1}
+    body = client.get('/checkout').get_data(as_text=True)
+    assert f'<option value="{first.isoformat()}" disabled>' in body
+    assert '(fully booked)' in body
+    assert '(2 left)' in body
+    
+    with count_queries() as statements:
+        client.get('/checkout')
+    assert not [s for s in statements if 'delivery_slot' in s]
+
+def test_load_catalog_cli_upserts_csv_and_jsonl(app, client, tmp_path):
+    """Test the load-catalog command streams CSV and JSONL, upserts on sku and is idempotent"""
+    from app import load_catalog_command
+    csv_path = tmp_path / 'catalog.csv'
+    csv_path.write_text('sku,name,description,price,category,available\n'
+                        + ''.join(f'SKU-{i},Tart {i},Fresh tart {i},{2 + i},Tarts,yes\n' for i in range(25))
+                        + 'SKU-24,Tart 24,Fresh tart 24,99,Tarts,no\n')
+    runner = app.test_cli_runner()
+    
+    result = runner.invoke(load_catalog_command, [str(csv_path), '--chunk-size', '10'])
+    assert result.exit_code == 0, result.output
+    assert 'Loaded 26 rows' in result.output and 'rows/s' in result.output
+    assert Pastry.query.count() == 25
+    assert db.session.query(Pastry.price, Pastry.available).filter_by(sku='SKU-24').one() == (99, False)
+    
+    result = runner.invoke(load_catalog_command, [str(csv_path), '--chunk-size', '10'])
+    assert '(0 inserted or updated, 26 unchanged)' in result.output
+    
+    jsonl_path = tmp_path / 'catalog.jsonl'
+    jsonl_path.write_text('{"sku": "SKU-0", "name": "Almond Tart", "price": 4.5, "category": "Tarts"}\n'
+                          '{"sku": "SKU-new", "name": "Pecan Roll", "price": 3}\n')
+    result = runner.invoke(load_catalog_command, [str(jsonl_path)])
+    assert '(2 inserted or updated, 0 unchanged)' in result.output
+    assert Pastry.query.count() == 26
+    assert Pastry.query.filter_by(sku='SKU-0').one().name == 'Almond Tart'
+    # Core upserts still reach the catalog cache and the search index
+    assert b'Almond Tart' in client.get('/browse?search=almond').data
+
+def test_load_catalog_streams_in_chunks_and_reports_bad_rows(app):
+    """Test records are pulled one chunk at a time and invalid rows are reported by line"""
+    from catalog_loader import CatalogLoadError, load_catalog
+    pulled = []
+    
+    def records():
+        for i in range(1, 8):
+            pulled.append(i)
+            yield i, {'sku': f'S{i}', 'name': f'Roll {i}', 'price': '2.5'}
+    
+    chunks = []
+    stats = load_catalog(db.session, Pastry.__table__, records(), chunk_size=3,
+                         progress=lambda rows, seconds: chunks.append((rows, len(pulled))))
+    assert stats['rows'] == 7 and stats['written'] == 7
+    assert chunks == [(3, 3), (6, 6), (7, 7)]
+    
+    with pytest.raises(CatalogLoadError, match='line 2: could not convert'):
+        load_catalog(db.session, Pastry.__table__, iter([(2, {'sku': 'X', 'name': 'X', 'price': 'free'})]))
+
+def _place_orders(client, carts):
+    for cart in carts:
+        with client.session_transaction() as sess:
+            sess['cart'] = {str(pastry_id): quantity for pastry_id, quantity in cart.items()}
+        assert '/order/' in client.post('/place_order', data=ORDER_FORM).location
+
+def test_sales_rollups_maintained_inline_and_reported(app, client):
+    """Test each order updates the rollups in its own transaction and the reports read them back"""
+    app.config['SALES_ROLLUP'] = 'inline'
+    tart, muffin = _add_pastries(2)
+    muffin.category = 'Muffins'
+    db.session.commit()
+    _place_orders(client, [{tart.id: 2, muffin.id: 1}, {tart.id: 1}])
+    today = datetime.now(timezone.utc).date().isoformat()
+    
+    report = client.get(f'/api/reports/sales?start={today}&end={today}').get_json()
+    assert report['days'] == [{'day': today, 'orders': 2, 'units': 4,
+                               'revenue': round(3 * tart.price + muffin.price, 2)}]
+    assert report['totals']['orders'] == 2
+    
+    top = client.get('/api/reports/top-pastries?by=units').get_json()['pastries']
+    assert [(row['name'], row['units']) for row in top] == [(tart.name, 3), (muffin.name, 1)]
+    categories = client.get('/api/reports/categories').get_json()['categories']
+    assert [(row['category'], row['units']) for row in categories] == [('Tarts', 3), ('Muffins', 1)]
+    
+    assert len(client.get('/api/reports/sales').get_json()['days']) == 30
+    assert client.get('/api/reports/sales?start=2030-01-02&end=2030-01-01').status_code == 400
+
+def test_sales_rollups_deferred_catch_up_and_rebuild(app, client):
+    """Test deferred rollups, the default, are filled in by the catch-up job, which can also rebuild from scratch"""
+    pastry, = _add_pastries(1)
+    _place_orders(client, [{pastry.id: 2}] * 3)
+    from app import DailySales, catch_up_sales_rollups
+    assert DailySales.query.count() == 0
+    
+    runner = app.test_cli_runner()
+    assert 'Rolled up 3 orders' in runner.invoke(args=['rollup-sales', '--batch-size', '2']).output
+    assert 'Rolled up 0 orders' in runner.invoke(args=['rollup-sales']).output
+    daily = DailySales.query.one()
+    assert (daily.orders, daily.units) == (3, 6)
+    
+    assert catch_up_sales_rollups(rebuild=True) == 3
+    db.session.expire_all()
+    daily = DailySales.query.one()
+    assert (daily.orders, daily.units) == (3, 6)
+
+def test_reports_require_token_when_configured(app, client):
+    """Test a configured reports token is enforced"""
+    app.config['REPORTS_API_TOKEN'] = 's3cret'
+    assert client.get('/api/reports/sales').status_code == 401
+    response = client.get('/api/reports/sales', headers={'Authorization': 'Bearer s3cret'})
+    assert response.status_code == 200
+
+def test_reports_closed_without_token_outside_testing_and_debug(app, client):
+    """Test reports are refused when no token is configured, unless testing or debugging"""
+    assert client.get('/api/reports/sales').status_code == 200
+    app.config['TESTING'] = False
+    assert client.get('/api/reports/sales').status_code == 403
+    app.config['DEBUG'] = True
+    assert client.get('/api/reports/sales').status_code == 200
+
+def test_order_history_keyset_pagination(app, client, count_queries):
+    """Test order history pages newest first on (created_at, id), with item counts, in one query a page"""
+    from app import customer_history_token
+    pastry, = _add_pastries(1)
+    _place_orders(client, [{pastry.id: quantity} for quantity in range(1, 8)])
+    # Give several orders the same timestamp so pages have to break ties on id
+    tied = datetime(2030, 1, 1, 12, 0)
+    Order.query.filter(Order.id.in_([2, 3, 4, 5])).update({'created_at': tied})
+    db.session.commit()
+    token = customer_history_token(Customer.query.one().id)
+    
+    pages, url = [], f'/api/orders/history/{token}?limit=3'
+    while url:
+        with count_queries() as statements:
+            response = client.get(url)
+        assert len(statements) == 1
+        pages.append([order['item_count'] for order in response.get_json()['orders']])
+        url = response.headers.get('Link', '').partition('>')[0][1:]
+    
+    # Quantities equal order ids: the tied orders come first (latest timestamp), then the rest newest first
+    assert pages == [[5, 4, 3], [2, 7, 6], [1]]
+    
+    assert client.get('/api/orders/history/not-a-token').status_code == 404
+    assert client.get(f'/api/orders/history/{token}?after=garbage').status_code == 400
+    page = client.get(f'/orders/history/{token}?limit=3')
+    assert b'Older Orders' in page.data
+    order_page = client.get(f'/order/{Order.query.first().order_number}')
+    assert f'/orders/history/{token}'.encode() in order_page.data
+
+def test_stock_is_taken_atomically_and_never_oversold(app, client, count_queries):
+    """Test tracked stock is taken in one statement for the whole cart and a short line rejects the order"""
+    from app import DeliverySlot, PastryStock, set_stock
+    tart, muffin, scone = _add_pastries(3)
+    set_stock(tart.id, 5)
+    set_stock(muffin.id, 4, stripes=2)
+    db.session.commit()
+    
+    with client.session_transaction() as sess:
+        sess['cart'] = {str(tart.id): 2, str(muffin.id): 1, str(scone.id): 10}
+    with count_queries() as statements:
+        assert '/order/' in client.post('/place_order', data=ORDER_FORM).location
+    # The usual five statements plus a single UPDATE ... RETURNING for both tracked lines
+    assert len(statements) == 6
+    assert sum(s.lstrip().startswith('UPDATE pastry_stock') for s in statements) == 1
+    
+    # Three muffins are left over two stripes, so this order has to draw on both
+    _place_orders(client, [{muffin.id: 3}])
+    with client.session_transaction() as sess:
+        sess['cart'] = {str(tart.id): 4, str(scone.id): 1}
+    response = client.post('/place_order', data=ORDER_FORM, follow_redirects=True)
+    assert b"have enough Pastry 0 left" in response.data
+    assert b'Only 3 left' in client.get('/cart').data
+    
+    stock = dict(db.session.query(PastryStock.pastry_id, func.sum(PastryStock.quantity))
+                 .group_by(PastryStock.pastry_id))
+    assert stock == {tart.id: 3, muffin.id: 0}
+    assert Order.query.count() == 2
+    assert DeliverySlot.query.one().reserved == 2
+
+def test_non_positive_quantities_never_refill_stock(app, client):
+    """Test a negative cart line can't be added and rejects the order instead of putting stock back"""
+    from app import PastryStock, set_stock
+    hot, other = _add_pastries(2)
+    set_stock(hot.id, 2)
+    db.session.commit()
+    
+    response = client.post('/add_to_cart', data={'pastry_id': hot.id, 'quantity': -100}, follow_redirects=True)
+    assert b'at least 1' in response.data
+    with client.session_transaction() as sess:
+        assert not sess.get('cart')
+    
+    with client.session_transaction() as sess:
+        sess['cart'] = {str(hot.id): -100, str(other.id): 30}
+    response = client.post('/place_order', data=ORDER_FORM)
+    assert '/cart' in response.location
+    assert db.session.query(func.sum(PastryStock.quantity)).scalar() == 2
+    assert Order.query.count() == 0
+
+def test_set_stock_cli(app):
+    """Test stock can be set, striped and untracked from the command line"""
+    from app import PastryStock
+    pastry, = _add_pastries(1)
+    runner = app.test_cli_runner()
+    
+    result = runner.invoke(args=['set-stock', str(pastry.id), '10', '--stripes', '3'])
+    assert '10 in stock over 3 stripe(s)' in result.output
+    assert sorted(stripe.quantity for stripe in PastryStock.query) == [3, 3, 4]
+    assert 'stock not tracked' in runner.invoke(args=['set-stock', str(pastry.id), '--untrack']).output
+    assert PastryStock.query.count() == 0
+    assert runner.invoke(args=['set-stock', '9999', '1']).exit_code != 0
+
+def test_stock_contention_never_oversells():
+    """Test concurrent buyers checking out sell a hot pastry out exactly, with and without stripes"""
+    from benchmarks.stock_contention import run_contention
+    for stripes in (1, 4):
+        result = run_contention(buyers=4, stock=200, stripes=stripes)
+        assert (result['oversold'], result['lost'], result['left']) == (0, 0, 0)
+        assert result['sold'] == 200 and result['orders_per_second'] > 0
+        # Every order went through place_order and booked the shared delivery slot
+        assert result['booked'] == result['orders']
+
+def _jpeg_bytes(width, height, color=(200, 120, 40)):
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+def test_image_derivatives_rendered_once_and_cached_immutably(app, client, tmp_path):
+    """Test an ingested image is served as lazily rendered, immutable WebP/JPEG derivatives at fixed widths"""
+    pytest.importorskip('PIL')
+    store = app.extensions['image_store']
+    store.root = str(tmp_path)
+    pastry, = _add_pastries(1)
+    pastry.image_url = store.ingest(_jpeg_bytes(1000, 750))
+    db.session.commit()
+    
+    page = client.get(f'/pastry/{pastry.id}').get_data(as_text=True)
+    assert f'{pastry.image_url}/320.webp 320w' in page and 'type="image/webp"' in page
+    
+    response = client.get(f'{pastry.image_url}/320.webp')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/webp'
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    from PIL import Image
+    assert Image.open(io.BytesIO(response.data)).size == (320, 240)
+    
+    assert client.get(f'{pastry.image_url}/320.webp').status_code == 200
+    assert client.get(f'{pastry.image_url}/1000.jpg').mimetype == 'image/jpeg'
+    assert store.rendered == 2
+    revalidated = client.get(f'{pastry.image_url}/320.webp', headers={'If-None-Match': response.headers['ETag']})
+    assert revalidated.status_code == 304
+    
+    assert client.get(f'{pastry.image_url}/321.webp').status_code == 404
+    assert client.get(f'{pastry.image_url}/320.gif').status_code == 404
+    assert client.get(f'/images/{"0" * 64}/320.jpg').status_code == 404
+    assert client.get(pastry.image_url).mimetype == 'image/jpeg'
+    with pytest.raises(ValueError):
+        store.ingest(b'not an image')
+
+def test_ingest_images_cli_moves_local_images_into_store(app, tmp_path):
+    """Test local pastry images are ingested and remote URLs left alone"""
+    pytest.importorskip('PIL')
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    app.extensions['image_store'].root = str(tmp_path / 'images')
+    (tmp_path / 'tart.jpg').write_bytes(_jpeg_bytes(400, 400))
+    local, remote, missing = _add_pastries(3)
+    local.image_url, remote.image_url, missing.image_url = 'tart.jpg', 'https://cdn.example.com/a.jpg', 'gone.jpg'
+    db.session.commit()
+    
+    output = app.test_cli_runner().invoke(args=['ingest-images']).output
+    assert 'Ingested 1 images, skipped 1' in output
+    assert local.image_url.startswith('/images/') and remote.image_url == 'https://cdn.example.com/a.jpg'
+
+def test_responses_compressed_per_accept_encoding(app, client):
+    """Test HTML and streamed JSON are gzip/brotli compressed when accepted, and tiny bodies are not"""
+    import gzip
+    brotli = pytest.importorskip('brotli')
+    _add_pastries(30)
+    plain = client.get('/browse')
+    assert 'Content-Encoding' not in plain.headers
+    
+    gzipped = client.get('/browse', headers={'Accept-Encoding': 'gzip'})
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in gzipped.headers['Vary']
+    assert gzip.decompress(gzipped.data) == plain.data
+    assert len(gzipped.data) < len(plain.data) / 3
+    assert gzipped.headers['ETag'].startswith('W/')
+    revalidated = client.get('/browse', headers={'Accept-Encoding': 'gzip', 'If-None-Match': gzipped.headers['ETag']})
+    assert revalidated.status_code == 304
+    
+    brotlied = client.get('/browse', headers={'Accept-Encoding': 'gzip, br'})
+    assert brotlied.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(brotlied.data) == plain.data
+    
+    streamed = client.get('/api/pastries?stream=ndjson', headers={'Accept-Encoding': 'gzip'})
+    assert streamed.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(streamed.data) == client.get('/api/pastries?stream=ndjson').data
+    
+    tiny = client.get('/api/pastries?limit=1', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in tiny.headers
+
+def test_built_assets_are_fingerprinted_and_served_precompressed(app, client, tmp_path):
+    """Test the asset build hashes and precompresses static files and pages link the hashed URLs"""
+    import shutil
+    brotli = pytest.importorskip('brotli')
+    from assets import build_assets
+    static = tmp_path / 'static'
+    shutil.copytree(app.static_folder, static, ignore=shutil.ignore_patterns('uploads', 'dist'))
+    manifest = build_assets(str(static))
+    assets = app.extensions['asset_manifest']
+    assets.output = str(static / 'dist')
+    assets.reload()
+    
+    hashed = manifest['css/site.css']
+    assert hashed.startswith('css/site.') and hashed != 'css/site.css'
+    assert f'/static/dist/{hashed}'.encode() in client.get('/').data
+    
+    source = (static / 'css' / 'site.css').read_bytes()
+    response = client.get(f'/static/dist/{hashed}', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert response.mimetype == 'text/css'
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert brotli.decompress(response.data) == source
+    assert client.get(f'/static/dist/{hashed}').data == source
+    assert client.get('/static/dist/css/missing.css').status_code == 404
+
+def test_autogenerate_leaves_search_objects_alone(tmp_path):
+    """Test a migrated database shows no autogenerate diff, and the Postgres search objects are skipped too"""
+    from alembic.autogenerate import compare_metadata
+    from alembic.migration import MigrationContext
+    from flask_migrate import upgrade
+    from sqlalchemy import Column, Index, MetaData, Table
+    from app import init_migrations
+    from search import include_in_autogenerate
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'migrated.db'}",
+                      'SECRET_KEY': 'x'})
+    with app.app_context():
+        init_migrations(app)
+        upgrade()
+        with db.engine.connect() as connection:
+            context = MigrationContext.configure(connection, opts={'include_object': include_in_autogenerate})
+            assert compare_metadata(context, db.metadata) == []
+        db.engine.dispose()
+    
+    pastry = Table('pastry', MetaData(), Column('search_vector'), Column('name'))
+    assert not include_in_autogenerate(pastry.c.search_vector, 'search_vector', 'column', True, None)
+    assert not include_in_autogenerate(Index('ix_pastry_name_trgm', pastry.c.name), 'ix_pastry_name_trgm', 'index',
+                                       True, None)
+    assert include_in_autogenerate(pastry.c.name, 'name', 'column', True, None)
+
+def test_search_finds_catalog_loaded_into_migrated_database(tmp_path):
+    """Test the FTS5 triggers survive the migrations, so pastries loaded by the catalog loader are searchable"""
+    from flask_migrate import upgrade
+    from app import init_migrations
+    from catalog_loader import load_catalog, read_catalog
+    catalog = os.path.join(os.path.dirname(__file__), os.pardir, 'data', 'sample_catalog.jsonl')
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'migrated.db'}",
+                      'SECRET_KEY': 'x'})
+    with app.app_context():
+        init_migrations(app)
+        upgrade()
+        with open(catalog, encoding='utf-8') as stream:
+            load_catalog(db.session, Pastry.__table__, read_catalog(stream, 'jsonl'))
+        
+        response = app.test_client().get('/browse?search=croissant')
+        assert b'No pastries found' not in response.data
+        assert b'Croissant' in response.data
+        db.engine.dispose()
+
+def test_app_construction_does_no_schema_work(tmp_path):
+    """Test importing app builds nothing and create_app only creates tables when asked to"""
+    import app as module
+    from sqlalchemy import inspect
+    assert module._app is None
+    
+    config = {'TESTING': True, 'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'boot.db'}", 'SECRET_KEY': 'x'}
+    app = create_app(config)
+    with app.app_context():
+        assert inspect(db.engine).get_table_names() == []
+        db.engine.dispose()
+    app = create_app(dict(config, AUTO_CREATE_SCHEMA=True))
+    with app.app_context():
+        assert 'pastry' in inspect(db.engine).get_table_names()
+        db.engine.dispose()
+
+def test_compile_templates_and_warm_up(app, tmp_path):
+    """Test templates precompile into the bytecode cache and warm-up primes the catalog caches"""
+    from jinja2 import FileSystemBytecodeCache
+    from app import warm_up
+    _add_pastries(3)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(str(tmp_path))
+    app.config['JINJA_BYTECODE_CACHE_DIR'] = str(tmp_path)
+    
+    output = app.test_cli_runner().invoke(args=['compile-templates']).output
+    assert f'Compiled {len(app.jinja_env.list_templates())} templates' in output
+    assert len(list(tmp_path.iterdir())) == len(app.jinja_env.list_templates())
+    
+    cache = app.extensions['catalog_cache']
+    warm_up(app)
+    misses = cache.misses
+    with app.test_request_context():
+        from app import available_pastries, pastry_categories
+        available_pastries()
+        pastry_categories()
+    assert cache.misses == misses
+
+def test_startup_benchmark_smoke():
+    """Test the start-up benchmark times every mode in fresh processes and flags regressions"""
+    from benchmarks.startup import MODES, compare, run_benchmark
+    report = run_benchmark(runs=1)
+    assert list(report['modes']) == MODES
+    assert all(stats['total_ms'] > 0 for stats in report['modes'].values())
+    assert compare(report, report, threshold=1.0) == []
+    slower = {'modes': {'warm': dict(report['modes']['warm'], total_ms=report['modes']['warm']['total_ms'] / 2)}}
+    assert compare(report, slower, threshold=1.5)[0].startswith('warm:')
+
+def test_read_only_views_use_replica_and_writers_stick_to_primary(tmp_path):
+    """Test reads go to a healthy replica, writes and the writer's next reads to the primary, with fallback"""
+    import shutil
+    from sqlalchemy import update
+    config = {'TESTING': True, 'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'primary.db'}",
+              'SECRET_KEY': 'x', 'AUTO_CREATE_SCHEMA': True}
+    app = create_app(config)
+    with app.app_context():
+        pastry_id = _add_pastries(1)[0].id
+        db.engine.dispose()
+    # Stand-in for replication: the replica starts as a copy, then diverges so each read shows where it went
+    shutil.copy(tmp_path / 'primary.db', tmp_path / 'replica.db')
+    app = create_app(dict(config, SQLALCHEMY_BINDS={'replica_0': f"sqlite:///{tmp_path / 'replica.db'}"}))
+    router = app.extensions['replica_router']
+    with app.app_context():
+        with db.engines['replica_0'].begin() as connection:
+            connection.execute(update(Pastry.__table__).values(name='Replica Pastry'))
+        
+        client = app.test_client()
+        assert client.get('/api/pastries').json[0]['name'] == 'Replica Pastry'
+        with client.session_transaction() as sess:
+            sess['cart'] = {str(pastry_id): 1}
+        location = client.post('/place_order', data=ORDER_FORM).location
+        assert Order.query.count() == 1
+        # The order only exists on the primary, so the confirmation is served from there
+        assert client.get(location).status_code == 200
+        assert app.test_client().get(location).status_code == 404
+        
+        router.replicas[0].healthy = False
+        router.replicas[0].checked_at = float('inf')
+        assert app.test_client().get(location).status_code == 200
+        assert router.stats()['fallbacks'] >= 1
+        
+        router.replicas[0].engine = db.create_engine(f"sqlite:///{tmp_path / 'missing' / 'replica.db'}")
+        assert router.check(router.replicas[0]) is False
+        router.replicas[0].engine = db.engines['replica_0']
+        assert router.check(router.replicas[0]) is True
+        
+        # A catalog change holds reads on the primary while replicas catch up
+        db.session.get(Pastry, pastry_id).price = 9.5
+        db.session.commit()
+        assert app.test_client().get('/api/pastries').json[0]['name'] == 'Pastry 0'
+        for engine in db.engines.values():
+            engine.dispose()
+    # db keeps a metadata per bind key it has seen; later apps in this process have no replica bind
+    db.metadatas.pop('replica_0')
+
+def test_order_status_endpoint_and_events_published_on_commit(app, client, order_intake):
+    """Test the JSON status fallback answers 304s while unchanged and status changes publish only once committed"""
+    from app import update_order_status
+    pastry, = _add_pastries(1)
+    with client.session_transaction() as sess:
+        sess['cart'] = {str(pastry.id): 1}
+    order_number = client.post('/place_order', data=ORDER_FORM).location.rsplit('/', 1)[1]
+    broker = app.extensions['order_events']
+    
+    assert client.get(f'/api/orders/{order_number}/status').json['status'] == 'processing'
+    order_intake.drain()
+    assert broker.latest(order_number)['status'] == 'pending'
+    response = client.get(f'/api/orders/{order_number}/status')
+    assert response.json == {'order_number': order_number, 'status': 'pending', 'payment_status': 'pending'}
+    assert client.get(f'/api/orders/{order_number}/status',
+                      headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    assert client.get('/api/orders/unknown/status').status_code == 404
+    
+    update_order_status(order_number, status='baking')
+    db.session.rollback()
+    assert broker.latest(order_number)['status'] == 'pending'
+    result = app.test_cli_runner().invoke(args=['set-order-status', order_number, '--status', 'baking',
+                                                '--payment-status', 'paid'])
+    assert 'baking, payment paid' in result.output
+    assert broker.latest(order_number) == {'order_number': order_number, 'status': 'baking', 'payment_status': 'paid'}
+    assert b'data-field="status">Baking' in client.get(f'/order/{order_number}').data
+    
+    order_intake.queue.put('bad-order', '{"customer": {}}')
+    order_intake.drain()
+    assert broker.latest('bad-order')['status'] == 'failed'
+
+def test_order_event_stream_pushes_status_changes(app):
+    """Test the ASGI stream replays the latest status, then pushes changes published from another thread"""
+    import asyncio
+    import threading
+    from order_events import MemoryEventBroker, OrderEventStream
+    broker = MemoryEventBroker()
+    broker.publish('abc-123', {'order_number': 'abc-123', 'status': 'pending', 'payment_status': 'pending'})
+    stream = OrderEventStream(broker, heartbeat=0.05)
+    
+    async def scenario():
+        sent, disconnected = [], asyncio.Event()
+        
+        async def receive():
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+        
+        async def send(message):
+            sent.append(message)
+            if b'out_for_delivery' in message.get('body', b''):
+                disconnected.set()
+        
+        scope = {'type': 'http', 'method': 'GET', 'path': '/order/abc-123/events'}
+        task = asyncio.ensure_future(stream(scope, receive, send))
+        await asyncio.sleep(0.1)
+        assert broker.subscribers == 1
+        threading.Thread(target=broker.publish, args=('abc-123', {
+            'order_number': 'abc-123', 'status': 'out_for_delivery', 'payment_status': 'paid'})).start()
+        await asyncio.wait_for(task, 5)
+        
+        not_found = []
+        
+        async def collect(message):
+            not_found.append(message)
+        await stream({'type': 'http', 'method': 'GET', 'path': '/orders'}, receive, collect)
+        return sent, not_found
+    
+    sent, not_found = asyncio.run(scenario())
+    assert sent[0]['status'] == 200 and (b'content-type', b'text/event-stream') in sent[0]['headers']
+    body = b''.join(message.get('body', b'') for message in sent[1:])
+    assert body.startswith(b'retry: 3000\n\n')
+    assert b'event: status\ndata: {"order_number":"abc-123","status":"pending"' in body
+    assert b': keepalive\n\n' in body
+    assert body.endswith(b'"status":"out_for_delivery","payment_status":"paid"}\n\n')
+    assert broker.subscribers == 0 and stream.connections == 0
+    assert not_found[0]['status'] == 404
+
+def test_order_event_stream_releases_connection_when_subscribe_fails():
+    """Test a stream whose subscription can't be opened doesn't count against max_connections"""
+    import asyncio
+    from order_events import MemoryEventBroker, OrderEventStream
+    
+    class UnreachableBroker(MemoryEventBroker):
+        async def subscribe(self, order_number):
+            raise ConnectionError('broker unreachable')
+    
+    stream = OrderEventStream(UnreachableBroker(), max_connections=1)
+    
+    async def noop(*args):
+        pass
+    
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            asyncio.run(stream({'type': 'http', 'method': 'GET', 'path': '/order/abc-123/events'}, noop, noop))
+    assert stream.connections == 0